@@ -1,81 +1,251 @@
-import asyncio
+import collections
 import logging
-import os
-import os.path
 import random
+import re
 import string
+import tempfile
+import time
 import sqlalchemy as sa
-import sqlalchemy.ext as sa_ext
 import sqlalchemy.ext.asyncio as sa_async
 import sqlalchemy.future as sa_future
-import sqlalchemy.orm as sa_orm
 
 import nextcord
 from nextcord.ext import commands
 
-from KaraokeQueueBotObjects import QueueEntry, NextMsgEntry, Base
-
-class KaraokeQueueBotConfigError(Exception):
-    pass
-
-class KaraokeQueueBotConfig():
-    def __init__(self, log_path: str, db_path: str, log_level: int, guild_ids: list):
-        self.log_path = log_path
-        self.db_path = db_path
-        self.log_level = log_level
-        self.guild_ids = guild_ids
-
-    @classmethod
-    def default(cls, base_dir: str, guild_ids = []):
-        return cls(
-            os.path.join(base_dir, "KaraokeQueueBot.log"),
-            os.path.join(base_dir, "KaraokeQueueBot_data.db"),
-            logging.INFO,
-            guild_ids
-        )
-
-    @classmethod
-    def from_yaml_data(cls, in_data: dict) -> None:
-        log_str_map = {
-            "critical": logging.CRITICAL,
-            "error": logging.ERROR,
-            "warning": logging.WARNING,
-            "info": logging.INFO,
-            "debug": logging.DEBUG
-        }
-
-        data = in_data["config"]
-        
-        log_path = data["log_path"]
-        db_path = data["sqlite_database_path"]
-        
-        log_level = log_str_map.get(data["logging_level"].lower(), logging.INFO)
-
-        guild_ids = data["guild_ids"]
-
-        return cls(log_path, db_path, log_level, guild_ids)
+from KaraokeQueueBotConfig import (
+    KaraokeQueueBotConfig, KaraokeQueueBotConfigError, KaraokeQueueBotDispatchConfig,
+    KaraokeQueueBotMetricsConfig, KaraokeQueueBotShardingConfig, KaraokeQueueBotStorageConfig
+)
+from KaraokeQueueBotObjects import MAIN_ROOM_ID, NextMsgEntry, BoardEntry, GuildSettingsEntry
+from KaraokeQueueBotCache import GuildQueueState, QueueCache
+from KaraokeQueueBotExecutor import GuildExecutor
+from KaraokeQueueBotTemplates import GuildTemplates, NextMsgTemplate, TemplateCache
+from KaraokeQueueBotStorage import begin_write
+from KaraokeQueueBotShards import ShardRouter
+from KaraokeQueueBotViews import QueueListView
+from KaraokeQueueBotMetrics import BotMetrics
+from KaraokeQueueBotStore import SqlQueueStore
+from KaraokeQueueBotJournal import JournalQueueStore
+from KaraokeQueueBotBoard import Board, BoardUpdater
+from KaraokeQueueBotDispatch import LANE_ANNOUNCE, LANE_CONFIRM, LANE_EDIT, OutboundDispatcher
+from KaraokeQueueBotCatalog import SongCatalog
+from KaraokeQueueBotHistory import PerformanceHistory
+from KaraokeQueueBotScheduler import TimerScheduler
+from KaraokeQueueBotBackup import ExportError, export_guild, import_guild
+from KaraokeQueueBotPolicies import MAX_WEIGHT, POLICIES, POLICY_DESCRIPTIONS, POLICY_FIFO, POLICY_WEIGHTED
+
+# Keeps a page of the queue list under Discord's 2000 character limit: 15 lines of a mention,
+# a position and a song name cut down to QUEUE_SONG_MAX_CHARS, plus the header and footer.
+QUEUE_PAGE_SIZE = 15
+QUEUE_SONG_MAX_CHARS = 80
+
+# Waiting singers shown on a board unless /board show asks for another number.
+BOARD_DEFAULT_SIZE = 5
+
+# Singers and songs listed by /stats.
+STATS_TOP_SIZE = 5
+
+# Longest /queue auto-advance a guild can set.
+AUTO_ADVANCE_MAX_MINUTES = 180
+
+# Exports and imports bigger than this are spilled from memory to a temporary file.
+EXPORT_SPOOL_BYTES = 1024 * 1024
+
+# Rooms whose announcement channel is remembered. Auto-advances in a room that was dropped go
+# unannounced until the next /next there, so this is well over the rooms a bot has going.
+ANNOUNCE_CHANNELS_MAX = 16384
+
+# Channels that have a room of their own, picking any other channel means the main queue.
+ROOM_CHANNEL_TYPES = [nextcord.ChannelType.voice, nextcord.ChannelType.stage_voice]
+
+def room_option() -> nextcord.SlashOption:
+    return nextcord.SlashOption(
+        description="Voice channel whose queue to use, or a text channel for the main queue. Yours if left out.",
+        channel_types=ROOM_CHANNEL_TYPES + [nextcord.ChannelType.text],
+        required=False
+    )
+
+def get_room_id(interaction: nextcord.Interaction, room: nextcord.abc.GuildChannel) -> int:
+    """The room a command acts on: the room option, else the invoker's voice channel, else
+    the guild's main queue.
+
+    Picking a text channel as the room also means the main queue. That's where queues from
+    before there were rooms ended up, and it's how someone in a voice channel gets at it.
+    """
+    if(room != None):
+        return room.id if getattr(room, "type", None) in ROOM_CHANNEL_TYPES else MAIN_ROOM_ID
+    voice = getattr(interaction.user, "voice", None)
+    if(voice != None and voice.channel != None):
+        return voice.channel.id
+    return MAIN_ROOM_ID
+
+def describe_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    return f"{minutes}m {seconds}s" if minutes else f"{seconds}s"
+
+def get_page_count(queue_length: int) -> int:
+    return max(1, (queue_length + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE)
+
+def describe_song_name(song_name: str) -> str:
+    if(len(song_name) > QUEUE_SONG_MAX_CHARS):
+        song_name = song_name[:QUEUE_SONG_MAX_CHARS - 1] + "\u2026"
+    return song_name
+
+def describe_entry(queue_elem) -> str:
+    if(queue_elem.song_name is None):
+        return f"<@{queue_elem.user_id}>"
+    return f"<@{queue_elem.user_id}> singing {describe_song_name(queue_elem.song_name)}"
+
+MENTION_RE = re.compile(r"<@!?(\d+)>")
+
+def parse_mentions(text: str) -> list:
+    """Splits "<@1> Song A <@2> <@3> Song C" into [(1, "Song A"), (2, None), (3, "Song C")].
+
+    Whatever follows a mention, up to the next one, is that user's song.
+    """
+    parts = MENTION_RE.split(text)
+    entries = []
+    for i in range(1, len(parts), 2):
+        song = parts[i + 1].strip(" \t\n,;")
+        entries.append((int(parts[i]), song if song else None))
+    return entries
 
 class KaraokeQueueBot():
-    def __init__(self, bot: commands.Bot, config: KaraokeQueueBotConfig) -> None:
+    def __init__(self, bot: commands.Bot, config: KaraokeQueueBotConfig, clock = time.time) -> None:
         super().__init__()
         self.config = config
-        if(self.config.db_path):
-            db_url = f"sqlite+aiosqlite:///{os.path.abspath(self.config.db_path)}"
-        else:
-            db_url = "sqlite+aiosqlite://"
-
-        self.db_engine = sa_async.create_async_engine(db_url, future=True)
-        self.db_sessionmaker = sa_orm.sessionmaker(bind=self.db_engine, expire_on_commit=False, class_=sa_async.AsyncSession, future=True)
         self.bot = bot
+        # Unix time for everything the queues and timers record, swapped out by the benchmarks.
+        self.clock = clock
+        self.metrics = BotMetrics(self.config.metrics.slow_command_ms)
+        sharding = self.config.sharding
+        self.db_router = ShardRouter(self.config.db_path, self.config.storage, sharding.mode, sharding.shard_dir, sharding.shard_count, sharding.max_open_shards)
+        self.db_router.on_open.append(lambda shard: self.metrics.watch_engine(shard.engine))
+        self.queue_cache = QueueCache(self.config.cache_size_mb * 1024 * 1024)
+        self.template_cache = TemplateCache()
+        self.guild_executor = GuildExecutor()
+        dispatch = self.config.dispatch
+        self.dispatcher = OutboundDispatcher(
+            dispatch.global_limit, dispatch.global_period_ms / 1000, dispatch.channel_limit, dispatch.channel_period_ms / 1000,
+            dispatch.max_retries, dispatch.max_in_flight
+        )
+        self.board_updater = BoardUpdater(self.load_board, self.render_board, self.edit_board, self.config.board_debounce_ms / 1000)
+        # Opened by the first search, not at startup.
+        self.song_catalog = SongCatalog(self.config.song_catalog_path) if self.config.song_catalog_path else None
+        self.history = PerformanceHistory(self._write, self.config.history_retention_days)
+        self.scheduler = TimerScheduler(self.clock)
+        # Seconds of /queue auto-advance by guild id, loaded on first use.
+        self.auto_advance = {}
+        # Where each room last had /next run, auto-advances are announced there. Least recently
+        # used first, and forgotten once the room's queue expires.
+        self.announce_channels = collections.OrderedDict()
+        self.auto_advances = 0
+        self.expired_queues = 0
+        self.closed = False
+
+        requeue_cooldown = self.config.requeue_cooldown_minutes * 60
+        if(self.config.storage.queue_backend == "journal"):
+            self.queue_store = JournalQueueStore(self.config.storage.journal_dir, self.config.storage.snapshot_every, self.config.queue_policy, requeue_cooldown, self.clock)
+        else:
+            self.queue_store = SqlQueueStore(self.db_router, self.queue_cache, self._write, self.config.queue_policy, requeue_cooldown, self.clock)
 
-        async def create_tables(engine):
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
+        self._add_metrics_readings()
+        if(self.config.metrics.enabled):
+            self.bot.loop.create_task(self.metrics.serve(
+                self.config.metrics.host, self.config.metrics.port, self.config.metrics.loop_lag_interval_ms / 1000
+            ))
 
-        asyncio.run(create_tables(self.db_engine))
+        # Runs once bot.run() starts the loop, so all database work happens on the bot's loop.
+        self.startup_task = self.bot.loop.create_task(self.start())
 
         self._register_commands()
 
+    async def start(self) -> None:
+        """Opens the storage, then warms the caches and sets the queue timers for the configured
+        guilds.
+
+        Commands that come in before this is done open whatever they need themselves.
+        """
+        start = time.perf_counter()
+        try:
+            await self.queue_store.open()
+            await self.db_router.prepare()
+        except Exception:
+            logging.exception("Failed to open the bot's storage, shutting down.")
+            await self.bot.close()
+            return
+        logging.info(f"Storage ready in {(time.perf_counter() - start) * 1000:.0f}ms.")
+
+        self.scheduler.start()
+        await self.warm_caches()
+        logging.info(f"Caches warmed for {len(self.config.guild_ids)} guilds in {(time.perf_counter() - start) * 1000:.0f}ms.")
+
+    async def warm_caches(self) -> None:
+        for guild_id in self.config.guild_ids:
+            try:
+                await self.get_queue_state(guild_id, MAIN_ROOM_ID)
+                await self.get_nextmsg_templates(guild_id)
+                # Boards may have missed changes while the bot was down.
+                for room_id in await self.get_board_rooms(guild_id):
+                    key = (guild_id, room_id)
+                    await self.guild_executor.run(key, lambda key=key: self.board_updater.changed(key))
+                # Timers aren't kept across restarts, so idle queues count from now.
+                for room_id in await self.queue_store.get_room_ids(guild_id):
+                    await self.schedule_timers(guild_id, room_id)
+            except Exception:
+                logging.exception(f"Failed to warm the caches for guild {guild_id}.")
+
+    async def close(self) -> None:
+        """Stops the timers and board updates, then lets queued messages and history writes
+        finish before closing the storage. Called when the bot closes, see main.py."""
+        if(self.closed):
+            return
+        self.closed = True
+
+        await self.scheduler.close()
+        await self.board_updater.close()
+        await self.dispatcher.close()
+        if(self.song_catalog != None):
+            await self.song_catalog.close()
+        await self.history.close()
+        await self.queue_store.close()
+        await self.db_router.close()
+        await self.metrics.close()
+
+    def _add_metrics_readings(self) -> None:
+        if(isinstance(self.queue_store, JournalQueueStore)):
+            self.metrics.add_reading("karaoke_journal_guilds", "Rooms held in memory by the queue journal.", "gauge", lambda: len(self.queue_store.states))
+            self.metrics.add_reading("karaoke_journal_appends_total", "Records appended to the queue journal.", "counter", lambda: self.queue_store.appends)
+            self.metrics.add_reading("karaoke_journal_fsyncs_total", "Batches of records synced to the queue journal.", "counter", lambda: self.queue_store.batches)
+            self.metrics.add_reading("karaoke_journal_snapshots_total", "Snapshots taken of the queue journal.", "counter", lambda: self.queue_store.snapshots)
+        else:
+            self.metrics.add_reading("karaoke_queue_cache_guilds", "Rooms whose queue is cached.", "gauge", lambda: len(self.queue_cache.states))
+            self.metrics.add_reading("karaoke_queue_cache_bytes", "Estimated size of the queue cache.", "gauge", lambda: self.queue_cache.size)
+            self.metrics.add_reading("karaoke_queue_cache_hits_total", "Queue reads served from the cache.", "counter", lambda: self.queue_cache.hits)
+            self.metrics.add_reading("karaoke_queue_cache_misses_total", "Queue reads that had to load from the database.", "counter", lambda: self.queue_cache.misses)
+            self.metrics.add_reading("karaoke_queue_cache_evictions_total", "Rooms evicted from the queue cache.", "counter", lambda: self.queue_cache.evictions)
+        self.metrics.add_reading("karaoke_template_cache_hits_total", "/next template lookups served from the cache.", "counter", lambda: self.template_cache.hits)
+        self.metrics.add_reading("karaoke_board_changes_total", "Queue changes in rooms with a board.", "counter", lambda: self.board_updater.changes)
+        self.metrics.add_reading("karaoke_board_edits_total", "Board messages edited.", "counter", lambda: self.board_updater.edits)
+        self.metrics.add_reading("karaoke_board_unchanged_total", "Board edits skipped because the board already showed the queue.", "counter", lambda: self.board_updater.unchanged)
+        self.metrics.add_reading("karaoke_dispatch_queued", "Messages waiting for a rate limit token.", "gauge", lambda: self.dispatcher.queued())
+        self.metrics.add_reading("karaoke_dispatch_sent_total", "Messages sent to Discord through the dispatcher.", "counter", lambda: self.dispatcher.sent)
+        self.metrics.add_reading("karaoke_dispatch_merged_total", "Queued edits replaced by a newer edit of the same message.", "counter", lambda: self.dispatcher.merged)
+        self.metrics.add_reading("karaoke_dispatch_rate_limited_total", "Requests Discord answered with a rate limit.", "counter", lambda: self.dispatcher.rate_limited)
+        self.metrics.add_reading("karaoke_template_cache_misses_total", "/next template lookups that had to load from the database.", "counter", lambda: self.template_cache.misses)
+        if(self.config.storage.group_commit_ms > 0):
+            self.metrics.add_reading("karaoke_group_commit_batches_total", "Transactions committed by the group committer.", "counter", lambda: self.db_router.group_commit_stats()[0])
+            self.metrics.add_reading("karaoke_group_commit_operations_total", "Writes committed by the group committer.", "counter", lambda: self.db_router.group_commit_stats()[1])
+        self.metrics.add_reading("karaoke_history_recorded_total", "Performances written to the history.", "counter", lambda: self.history.recorded)
+        self.metrics.add_reading("karaoke_history_compacted_total", "Performances deleted from the history after history_retention_days.", "counter", lambda: self.history.compacted)
+        self.metrics.add_reading("karaoke_timers_pending", "Auto-advance and idle expiry timers waiting to fire.", "gauge", lambda: len(self.scheduler))
+        self.metrics.add_reading("karaoke_timers_fired_total", "Timers that have fired.", "counter", lambda: self.scheduler.fired)
+        self.metrics.add_reading("karaoke_auto_advances_total", "Singers moved on from by auto-advance.", "counter", lambda: self.auto_advances)
+        self.metrics.add_reading("karaoke_expired_queues_total", "Queues cleared after idle_queue_expiry_hours.", "counter", lambda: self.expired_queues)
+        self.metrics.add_reading("karaoke_db_open_shards", "Database files currently open.", "gauge", lambda: len(self.db_router.shards))
+        self.metrics.add_reading("karaoke_db_shard_opens_total", "Database files opened.", "counter", lambda: self.db_router.opens)
+        self.metrics.add_reading("karaoke_db_shard_closes_total", "Idle database files closed to stay under max_open_shards.", "counter", lambda: self.db_router.closes)
+
     # Based on: https://stackoverflow.com/a/74012742
     def _register_commands(self) -> None:
         @self.bot.slash_command(guild_ids=self.config.guild_ids)
@@ -83,391 +253,890 @@ class KaraokeQueueBot():
             pass
 
         @queue.subcommand(name="list", description="Displays the current queue.")
+        @self.metrics.instrument("queue list")
         async def list_queue(
             interaction: nextcord.Interaction, 
-            public: bool = nextcord.SlashOption(description="Display the queue publically.", required=False)
+            public: bool = nextcord.SlashOption(description="Display the queue publically.", required=False),
+            page: int = nextcord.SlashOption(description="Page of the queue to show.", default=1, required=False),
+            room: nextcord.abc.GuildChannel = room_option()
         ) -> None:
-            async with self.db_sessionmaker() as session:
-                queue_res = await self.get_queue(session, interaction.guild_id)
-                queue_res = list(filter(lambda x: x.queue_pos != 0, queue_res))
-
-                current_elem = await self.get_current(session, interaction.guild_id)
-                current_elem_str = f"<@{current_elem.user_id}>" if current_elem != None else "nobody"
-                queue_strs = [
-                    f"Currently Up: {current_elem_str}\n",
-                    "Current Queue:"
-                ]
-                
-            if(not queue_res):
-                queue_strs.append("Queue is empty!")
-            else:
-                for queue_elem in queue_res:
-                    if(queue_elem.song_name is None):
-                        queue_strs.append(f"{queue_elem.queue_pos}. <@{queue_elem.user_id}>")
-                    else:
-                        queue_strs.append(f"{queue_elem.queue_pos}. <@{queue_elem.user_id}> singing {queue_elem.song_name}")
-            
-            await interaction.send("\n".join(queue_strs), ephemeral=not public, allowed_mentions=nextcord.AllowedMentions(replied_user=True, everyone=False, users=[], roles=[]))
+            room_id = get_room_id(interaction, room)
+            content, page, page_count = await self.render_queue_page(interaction.guild_id, room_id, page)
+
+            kwargs = {}
+            if(page_count > 1):
+                view = QueueListView(self, interaction.guild_id, room_id, page)
+                view.previous_page.disabled = page <= 1
+                view.next_page.disabled = page >= page_count
+                kwargs["view"] = view
+
+            await self.reply(interaction, content, ephemeral=not public, allowed_mentions=nextcord.AllowedMentions(replied_user=True, everyone=False, users=[], roles=[]), **kwargs)
 
         @queue.subcommand(description="Add yourself to the end of the queue.")
+        @self.metrics.instrument("queue add")
         async def add(
             interaction: nextcord.Interaction, 
             song: str = nextcord.SlashOption(description="What song you'll sing.", required=False),
-            requeue: bool = nextcord.SlashOption(description="Re-add you to the queue when your turn is over.", default=False, required=False)
+            requeue: bool = nextcord.SlashOption(description="Re-add you to the queue when your turn is over.", default=False, required=False),
+            room: nextcord.abc.GuildChannel = room_option()
         ) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                in_queue = await self.check_in_queue(session, interaction.guild_id, interaction.user.id)
+            room_id = get_room_id(interaction, room)
+
+            async def add_op(txn) -> str:
+                in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, interaction.user.id)
                 if(in_queue):
-                    await interaction.send("You are already in the queue!", ephemeral=True)
-                    return
+                    return "You are already in the queue!"
 
-                await self.add_to_queue(session, interaction.guild_id, interaction.user.id, song, requeue)
-                await session.commit()
-            await interaction.send("You have been added to the queue.", ephemeral=True)
+                await self.queue_store.add_to_queue(txn, interaction.guild_id, room_id, interaction.user.id, song, requeue)
+                return "You have been added to the queue."
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, add_op), ephemeral=True)
 
         @queue.subcommand(name="add-someone", description="Add a user to the end of the queue.")
+        @self.metrics.instrument("queue add-someone")
         async def addsomeone(
             interaction: nextcord.Interaction, 
             user: nextcord.Member = nextcord.SlashOption(description="User to add to the queue.", required=True),
             song: str = nextcord.SlashOption(description="What song the enqueued will sing.", required=False),
-            requeue: bool = nextcord.SlashOption(description="Re-add user to the queue when their turn is over.", default=False, required=False)
+            requeue: bool = nextcord.SlashOption(description="Re-add user to the queue when their turn is over.", default=False, required=False),
+            room: nextcord.abc.GuildChannel = room_option()
         ) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                in_queue = await self.check_in_queue(session, interaction.guild_id, user.id)
+            room_id = get_room_id(interaction, room)
+
+            async def addsomeone_op(txn) -> str:
+                in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, user.id)
                 if(in_queue):
-                    await interaction.send(f"<@{user.id}> is already in the queue!", ephemeral=True)
-                    return
+                    return f"<@{user.id}> is already in the queue!"
+
+                await self.queue_store.add_to_queue(txn, interaction.guild_id, room_id, user.id, song, requeue)
+                return f"Added <@{user.id}> to the queue."
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, addsomeone_op), ephemeral=True)
+
+        @queue.subcommand(name="add-many", description="Add several users to the end of the queue at once.")
+        @self.metrics.instrument("queue add-many")
+        async def addmany(
+            interaction: nextcord.Interaction,
+            users: str = nextcord.SlashOption(description="Mentions in queue order, each optionally followed by a song: @a Song A @b @c Song C", required=True),
+            requeue: bool = nextcord.SlashOption(description="Re-add the users to the queue when their turn is over.", default=False, required=False),
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+            entries = parse_mentions(users)
+            if(not entries):
+                await self.reply(interaction, "No users mentioned!", ephemeral=True)
+                return
+
+            async def addmany_op(txn) -> str:
+                added = await self.queue_store.add_many_to_queue(txn, interaction.guild_id, room_id, entries, requeue)
+                skipped = len(entries) - len(added)
+                msg = f"Added {len(added)} users to the queue."
+                if(skipped):
+                    msg += f" Skipped {skipped} already in the queue or mentioned twice."
+                return msg
 
-                await self.add_to_queue(session, interaction.guild_id, user.id, song, requeue)
-                await session.commit()
-            await interaction.send(f"Added <@{user.id}> to the queue.", ephemeral=True)
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, addmany_op), ephemeral=True)
 
         @queue.subcommand(description="Remove yourself from the queue.")
-        async def remove(interaction: nextcord.Interaction) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                in_queue = await self.check_in_queue(session, interaction.guild_id, interaction.user.id)
+        @self.metrics.instrument("queue remove")
+        async def remove(
+            interaction: nextcord.Interaction,
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+
+            async def remove_op(txn) -> str:
+                in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, interaction.user.id)
                 if(not in_queue):
-                    await interaction.send("You are not in the queue!", ephemeral=True)
-                    return
+                    return "You are not in the queue!"
+
+                await self.queue_store.remove_from_queue(txn, interaction.guild_id, room_id, interaction.user.id)
+                return "You have been removed from the queue."
 
-                await self.remove_from_queue(session, interaction.guild_id, interaction.user.id)
-                await session.commit()
-            await interaction.send("You have been removed from the queue.", ephemeral=True)
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, remove_op), ephemeral=True)
 
         @queue.subcommand(name="remove-someone", description="Remove a user from the queue.")
+        @self.metrics.instrument("queue remove-someone")
         async def removesomeone(
             interaction: nextcord.Interaction, 
-            user: nextcord.Member = nextcord.SlashOption(description="User to add to the queue.", required=True)
+            user: nextcord.Member = nextcord.SlashOption(description="User to add to the queue.", required=True),
+            room: nextcord.abc.GuildChannel = room_option()
         ) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                in_queue = await self.check_in_queue(session, interaction.guild_id, user.id)
+            room_id = get_room_id(interaction, room)
+
+            async def removesomeone_op(txn) -> str:
+                in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, user.id)
                 if(not in_queue):
-                    await interaction.send("<@{user.id}> is not in the queue!", ephemeral=True)
-                    return
+                    return f"<@{user.id}> is not in the queue!"
 
-                await self.remove_from_queue(session, interaction.guild_id, user.id)
-                await session.commit()
-            await interaction.send(f"Removed <@{user.id}> from the queue.", ephemeral=True)
+                await self.queue_store.remove_from_queue(txn, interaction.guild_id, room_id, user.id)
+                return f"Removed <@{user.id}> from the queue."
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, removesomeone_op), ephemeral=True)
 
         @queue.subcommand(description="Move yourself to the bottom of the queue.")
-        async def sink(interaction: nextcord.Interaction) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                in_queue = await self.check_in_queue(session, interaction.guild_id, interaction.user.id)
+        @self.metrics.instrument("queue sink")
+        async def sink(
+            interaction: nextcord.Interaction,
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+
+            async def sink_op(txn) -> str:
+                in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, interaction.user.id)
                 if(not in_queue):
-                    await interaction.send("You are not in the queue!", ephemeral=True)
-                    return
+                    return "You are not in the queue!"
 
-                length = await self.get_queue_length(session, interaction.guild_id)
-                await self.move_queue_elem(session, interaction.guild_id, interaction.user.id, length)
-                await session.commit()
-            await interaction.send("You have been moved to the bottom of the queue.", ephemeral=True)
+                length = await self.queue_store.get_queue_length(txn, interaction.guild_id, room_id)
+                await self.queue_store.move_queue_elem(txn, interaction.guild_id, room_id, interaction.user.id, length)
+                return "You have been moved to the bottom of the queue."
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, sink_op), ephemeral=True)
 
         @queue.subcommand(description="Swap the positions of two people in the queue.")
+        @self.metrics.instrument("queue swap")
         async def swap(
             interaction: nextcord.Interaction,
             user1: nextcord.Member = nextcord.SlashOption(description="First user.", required=True), 
-            user2: nextcord.Member = nextcord.SlashOption(description="Second user.", required=True)
+            user2: nextcord.Member = nextcord.SlashOption(description="Second user.", required=True),
+            room: nextcord.abc.GuildChannel = room_option()
         ) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                u1_in_queue = await self.check_in_queue(session, interaction.guild_id, user1.id)
-                u2_in_queue = await self.check_in_queue(session, interaction.guild_id, user2.id)
+            room_id = get_room_id(interaction, room)
+
+            async def swap_op(txn) -> str:
+                refusal = await self.check_manual_order(txn, interaction.guild_id, room_id)
+                if(refusal != None):
+                    return refusal
+                u1_in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, user1.id)
+                u2_in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, user2.id)
                 if(not u1_in_queue):
-                    await interaction.send("<@{user1.id}> is not in the queue!", ephemeral=True)
-                    return
+                    return f"<@{user1.id}> is not in the queue!"
                 if(not u2_in_queue):
-                    await interaction.send("<@{user2.id}> is not in the queue!", ephemeral=True)
-                    return
-            
-                u1_queue_elem = await self.get_queue_elem(session, interaction.guild_id, user1.id)
-                u2_queue_elem = await self.get_queue_elem(session, interaction.guild_id, user2.id)
-                u1_pos = u1_queue_elem.queue_pos
-                u2_pos = u2_queue_elem.queue_pos
-                await self.move_queue_elem(session, interaction.guild_id, user1.id, u2_pos)
-                await self.move_queue_elem(session, interaction.guild_id, user2.id, u1_pos)
-                await session.commit()
-            await interaction.send(f"Swapped the positions of <@{user1.id}> and <@{user2.id}>.", ephemeral=True)
+                    return f"<@{user2.id}> is not in the queue!"
+
+                await self.queue_store.swap_queue_elems(txn, interaction.guild_id, room_id, user1.id, user2.id)
+                return f"Swapped the positions of <@{user1.id}> and <@{user2.id}>."
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, swap_op), ephemeral=True)
             
         @queue.subcommand(description="Clear the queue.")
-        async def clear(interaction: nextcord.Interaction) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                elems = await self.get_queue(session, interaction.guild_id)
-                
-                for elem in elems:
-                    await session.delete(elem)
+        @self.metrics.instrument("queue clear")
+        async def clear(
+            interaction: nextcord.Interaction,
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+
+            async def clear_op(txn) -> str:
+                await self.queue_store.clear_queue(txn, interaction.guild_id, room_id)
+                return "Queue cleared."
 
-                await session.commit()
-            await interaction.send("Queue cleared.", ephemeral=True)
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, clear_op), ephemeral=True)
 
         @queue.subcommand(name="edit-song", description="Edit your proposed song in the queue.")
+        @self.metrics.instrument("queue edit-song")
         async def editsong(
             interaction: nextcord.Interaction,
-            song: str = nextcord.SlashOption(description="What song you'll sing.", required=True)
+            song: str = nextcord.SlashOption(description="What song you'll sing.", required=True),
+            room: nextcord.abc.GuildChannel = room_option()
         ) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                in_queue = await self.check_in_queue(session, interaction.guild_id, interaction.user.id)
+            room_id = get_room_id(interaction, room)
+
+            async def editsong_op(txn) -> str:
+                in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, interaction.user.id)
                 if(not in_queue):
-                    await interaction.send("You are not in the queue!", ephemeral=True)
-                    return
+                    return "You are not in the queue!"
 
-                elem = await self.get_queue_elem(session, interaction.guild_id, interaction.user.id)
-                elem.song_name = song
-                await session.commit()
+                await self.queue_store.edit_song(txn, interaction.guild_id, room_id, interaction.user.id, song)
+                return f"Song updated to \"{song}\"."
 
-            await interaction.send(f"Song updated to \"{song}\".", ephemeral=True)
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, editsong_op), ephemeral=True)
+
+        if(self.song_catalog != None):
+            @self.metrics.instrument("song autocomplete")
+            async def song_autocomplete(interaction: nextcord.Interaction, song: str) -> None:
+                try:
+                    choices = await self.song_catalog.search(song)
+                except Exception:
+                    logging.exception(f"Song search for {song!r} failed.")
+                    return
+                await self.dispatcher.send(LANE_CONFIRM, lambda: interaction.response.send_autocomplete(choices))
+
+            for command in (add, addsomeone, editsong):
+                command.on_autocomplete("song")(song_autocomplete)
 
         @queue.subcommand(description="Move this user to a specific spot in the queue.")
+        @self.metrics.instrument("queue move")
         async def move(
             interaction: nextcord.Interaction,
             user: nextcord.Member = nextcord.SlashOption(description="User to move.", required=True),
-            position: int = nextcord.SlashOption(description="Position to move user to.", required=True)
+            position: int = nextcord.SlashOption(description="Position to move user to.", required=True),
+            room: nextcord.abc.GuildChannel = room_option()
         ) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                in_queue = await self.check_in_queue(session, interaction.guild_id, user.id)
+            room_id = get_room_id(interaction, room)
+
+            async def move_op(txn) -> str:
+                refusal = await self.check_manual_order(txn, interaction.guild_id, room_id)
+                if(refusal != None):
+                    return refusal
+                in_queue = await self.queue_store.check_in_queue(txn, interaction.guild_id, room_id, user.id)
                 if(not in_queue):
-                    await interaction.send("<@{user.id}> is not in the queue!", ephemeral=True)
-                    return
-                
-                queue_len = await self.get_queue_length(session, interaction.guild_id)
+                    return f"<@{user.id}> is not in the queue!"
+
+                queue_len = await self.queue_store.get_queue_length(txn, interaction.guild_id, room_id)
                 if(position <= 0 or position > queue_len):
-                    await interaction.send(f"{position} is not a valid queue position.", ephemeral=True)
-                    return
-                
-                await self.move_queue_elem(session, interaction.guild_id, user.id, position)
-                await session.commit()
-            await interaction.send(f"Moved <@{user.id}> to {position}.", ephemeral=True)
+                    return f"{position} is not a valid queue position."
 
-        @self.bot.slash_command(description="Advance the queue.", guild_ids=self.config.guild_ids)
-        async def next(interaction: nextcord.Interaction):
-            #<@{current_elem.user_id}> is up next! They'll be singing \"{current_elem.song_name}\"!
-            DEFAULT_WITH_SONG = "{user} is up next! They'll be singing \"{song}\"!"
-            DEFAULT_NO_SONG = "{user} is up next!"
-
-            async with self.db_sessionmaker() as session, session.begin():
-                current_elem = await self.get_current(session, interaction.guild_id)
-                if(current_elem != None and not current_elem.requeue):
-                    await session.delete(current_elem)
-                elif(current_elem != None and current_elem.requeue):
-                    queue_len = await self.get_queue_length(session, interaction.guild_id)
-                    current_elem.queue_pos = queue_len + 1
-
-                queue_len = await self.get_queue_length(session, interaction.guild_id)
-                if(queue_len == 0):
-                    await interaction.send("No one left in the queue!")
-                    return
+                await self.queue_store.move_queue_elem(txn, interaction.guild_id, room_id, user.id, position)
+                return f"Moved <@{user.id}> to {position}."
 
-                await self.decrement_queue_numbers(session, interaction.guild_id, 1)
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, move_op), ephemeral=True)
 
-                current_elem = await self.get_current(session, interaction.guild_id)
-                await session.commit()
+        @queue.subcommand(description="Reorder the queue. Anyone not mentioned keeps their order after those who are.")
+        @self.metrics.instrument("queue reorder")
+        async def reorder(
+            interaction: nextcord.Interaction,
+            order: str = nextcord.SlashOption(description="Mentions in the new queue order.", required=True),
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+            user_ids = [user_id for user_id, song in parse_mentions(order)]
+            if(not user_ids):
+                await self.reply(interaction, "No users mentioned!", ephemeral=True)
+                return
 
-            async with self.db_sessionmaker() as session:
-                current_elem = await self.get_current(session, interaction.guild_id)
-                stmt = sa.select(NextMsgEntry) \
-                    .where(NextMsgEntry.guild_id == interaction.guild_id) \
-                    .where(NextMsgEntry.has_song == bool(current_elem.song_name))
-                stmt_res = await session.execute(stmt)
-                nextmsgs = stmt_res.scalars().all()
-                if(not nextmsgs and not bool(current_elem.song_name)):
-                    template = DEFAULT_NO_SONG
-                elif(not nextmsgs and bool(current_elem.song_name)):
-                    template = DEFAULT_WITH_SONG
+            async def reorder_op(txn) -> str:
+                refusal = await self.check_manual_order(txn, interaction.guild_id, room_id)
+                if(refusal != None):
+                    return refusal
+                waiting = await self.queue_store.get_waiting(txn, interaction.guild_id, room_id)
+                ranks = {}
+                for user_id in user_ids:
+                    ranks.setdefault(user_id, len(ranks))
+                waiting.sort(key=lambda elem: ranks.get(elem.user_id, len(ranks)))
+
+                await self.queue_store.reorder_queue(txn, interaction.guild_id, room_id, waiting)
+                return "Queue reordered."
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, reorder_op), ephemeral=True)
+
+        @queue.subcommand(description="Shuffle everyone waiting in the queue.")
+        @self.metrics.instrument("queue shuffle")
+        async def shuffle(
+            interaction: nextcord.Interaction,
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+
+            async def shuffle_op(txn) -> str:
+                refusal = await self.check_manual_order(txn, interaction.guild_id, room_id)
+                if(refusal != None):
+                    return refusal
+                waiting = await self.queue_store.get_waiting(txn, interaction.guild_id, room_id)
+                random.shuffle(waiting)
+
+                await self.queue_store.reorder_queue(txn, interaction.guild_id, room_id, waiting)
+                return "Queue shuffled."
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, shuffle_op), ephemeral=True)
+
+        @queue.subcommand(name="policy", description="Choose who goes next, or see how it's chosen now.")
+        @self.metrics.instrument("queue policy")
+        async def queuepolicy(
+            interaction: nextcord.Interaction,
+            policy: str = nextcord.SlashOption(
+                description="How to pick who goes next.",
+                choices={f"{name}: {POLICY_DESCRIPTIONS[name]}": name for name in POLICIES},
+                required=False
+            ),
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+            if(policy is None):
+                current_policy = (await self.get_queue_state(interaction.guild_id, room_id)).policy
+                await self.reply(interaction, f"The queue is ordered by \"{current_policy}\": {POLICY_DESCRIPTIONS[current_policy]}.", ephemeral=True)
+                return
+
+            async def queuepolicy_op(txn) -> str:
+                await self.queue_store.set_policy(txn, interaction.guild_id, room_id, policy)
+                return f"The queue is now ordered by \"{policy}\": {POLICY_DESCRIPTIONS[policy]}."
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, queuepolicy_op), ephemeral=True)
+
+        @queue.subcommand(description="Give a user more or fewer turns under the weighted policy.")
+        @self.metrics.instrument("queue weight")
+        async def weight(
+            interaction: nextcord.Interaction,
+            user: nextcord.Member = nextcord.SlashOption(description="User to weigh.", required=True),
+            weight: int = nextcord.SlashOption(description=f"Turns they get for each turn of a user with weight 1, 1 to {MAX_WEIGHT}.", min_value=1, max_value=MAX_WEIGHT, required=True),
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+
+            async def weight_op(txn) -> str:
+                await self.queue_store.set_weight(txn, interaction.guild_id, room_id, user.id, weight)
+                reply = f"<@{user.id}> now has weight {weight}."
+                if(await self.queue_store.get_policy(txn, interaction.guild_id, room_id) != POLICY_WEIGHTED):
+                    reply += f" Weights only count once the queue policy is \"{POLICY_WEIGHTED}\"."
+                return reply
+
+            await self.reply(interaction, await self.run_queue_write(interaction.guild_id, room_id, weight_op), ephemeral=True)
+
+        @queue.subcommand(name="auto-advance", description="Move on from singers who've been up too long, or see when that happens now.")
+        @self.metrics.instrument("queue auto-advance")
+        async def autoadvance(
+            interaction: nextcord.Interaction,
+            minutes: int = nextcord.SlashOption(description="Minutes a singer can be up before the queue moves on, 0 to turn it off.", min_value=0, max_value=AUTO_ADVANCE_MAX_MINUTES, required=False)
+        ) -> None:
+            if(minutes is None):
+                seconds = await self.get_auto_advance(interaction.guild_id)
+                if(not seconds):
+                    await self.reply(interaction, "The queue only moves on with /next.", ephemeral=True)
                 else:
-                    template = random.choice(nextmsgs).msg
+                    await self.reply(interaction, f"The queue moves on after a singer has been up for {describe_duration(seconds)}.", ephemeral=True)
+                return
+
+            seconds = min(max(minutes, 0), AUTO_ADVANCE_MAX_MINUTES) * 60
 
-                template_args = {
-                    "user": f"<@{current_elem.user_id}>",
-                    "song": current_elem.song_name
-                }
+            async def autoadvance_op(session: sa_async.AsyncSession) -> None:
+                await session.merge(GuildSettingsEntry(guild_id=interaction.guild_id, auto_advance_s=seconds))
 
-            await interaction.send(template.format(**template_args))
+            await self.run_write(interaction.guild_id, autoadvance_op)
+            self.auto_advance[interaction.guild_id] = seconds
+            for room_id in await self.queue_store.get_room_ids(interaction.guild_id):
+                await self.schedule_timers(interaction.guild_id, room_id)
+
+            if(not seconds):
+                await self.reply(interaction, "The queue will only move on with /next.", ephemeral=True)
+            else:
+                await self.reply(interaction, f"The queue will move on after a singer has been up for {describe_duration(seconds)}.", ephemeral=True)
+
+        @queue.subcommand(name="export", description="Get a file of every queue and 'next up' message here, to restore later with /queue import.")
+        @self.metrics.instrument("queue export")
+        async def queueexport(interaction: nextcord.Interaction) -> None:
+            # Big guilds can take longer to export than Discord waits for an answer.
+            await interaction.response.defer(ephemeral=True)
+            with tempfile.SpooledTemporaryFile(EXPORT_SPOOL_BYTES) as export_file:
+                counts = await self.export_guild(interaction.guild_id, export_file)
+                export_file.seek(0)
+                try:
+                    await self.reply(
+                        interaction,
+                        f"Exported {counts['queue']} queued singers and {counts['nextmsg']} 'next up' messages.",
+                        file=nextcord.File(export_file, filename=f"queue-{interaction.guild_id}.jsonl.gz"),
+                        ephemeral=True
+                    )
+                except nextcord.HTTPException as e:
+                    logging.warning(f"Failed to send the queue export of guild {interaction.guild_id}: {e}")
+                    await self.reply(interaction, "The export is too big to send here, ask the bot's owner to export it with backup.py.", ephemeral=True)
+
+        @queue.subcommand(name="import", description="Replace every queue and 'next up' message here with a /queue export file.")
+        @self.metrics.instrument("queue import")
+        async def queueimport(
+            interaction: nextcord.Interaction,
+            file: nextcord.Attachment = nextcord.SlashOption(description="A file from /queue export.", required=True)
+        ) -> None:
+            await interaction.response.defer(ephemeral=True)
+            with tempfile.SpooledTemporaryFile(EXPORT_SPOOL_BYTES) as export_file:
+                await file.save(export_file)
+                try:
+                    counts = await self.restore_guild(interaction.guild_id, export_file)
+                except ExportError as e:
+                    await self.reply(interaction, f"That file can't be imported: {e}", ephemeral=True)
+                    return
+            await self.reply(
+                interaction,
+                f"Imported {counts['queue']} queued singers and {counts['nextmsg']} 'next up' messages.",
+                ephemeral=True
+            )
+
+        @self.bot.slash_command(description="Advance the queue.", guild_ids=self.config.guild_ids)
+        @self.metrics.instrument("next")
+        async def next(
+            interaction: nextcord.Interaction,
+            room: nextcord.abc.GuildChannel = room_option()
+        ):
+            room_id = get_room_id(interaction, room)
+            self.set_announce_channel(interaction.guild_id, room_id, interaction.channel)
+
+            msg, coalesced = await self.guild_executor.run_coalesced(
+                (interaction.guild_id, room_id), "next", self.config.next_coalesce_ms / 1000, lambda: self.advance(interaction.guild_id, room_id)
+            )
+
+            if(coalesced):
+                await self.reply(interaction, "The queue was just advanced, skipping this one.", ephemeral=True)
+                return
+
+            if(msg == None):
+                await self.reply(interaction, self.describe_nobody_up(await self.get_queue_state(interaction.guild_id, room_id)), LANE_ANNOUNCE)
+                return
+
+            await self.reply(interaction, msg, LANE_ANNOUNCE)
 
         @self.bot.slash_command(description="See who's currently up.", guild_ids=self.config.guild_ids)
-        async def current(interaction: nextcord.Interaction):
-            async with self.db_sessionmaker() as session:
-                current_elem = await self.get_current(session, interaction.guild_id)
+        @self.metrics.instrument("current")
+        async def current(
+            interaction: nextcord.Interaction,
+            room: nextcord.abc.GuildChannel = room_option()
+        ):
+            room_id = get_room_id(interaction, room)
+            state = await self.get_queue_state(interaction.guild_id, room_id)
+            current_elem = state.get_current()
             if(current_elem == None):
-                await interaction.send("No one is up!")
+                await self.reply(interaction, "No one is up!")
             else:
-                await interaction.send(f"<@{current_elem.user_id}> is currently up!", allowed_mentions=nextcord.AllowedMentions(replied_user=True, everyone=False, users=[], roles=[]))
+                await self.reply(interaction, f"<@{current_elem.user_id}> is currently up!", allowed_mentions=nextcord.AllowedMentions(replied_user=True, everyone=False, users=[], roles=[]))
+
+        @self.bot.slash_command(description="See who and what has been sung the most.", guild_ids=self.config.guild_ids)
+        @self.metrics.instrument("stats")
+        async def stats(
+            interaction: nextcord.Interaction,
+            user: nextcord.Member = nextcord.SlashOption(description="Just this singer's stats.", required=False)
+        ) -> None:
+            async with self.db_router.session(interaction.guild_id) as session:
+                if(user != None):
+                    singer_stats = await self.history.get_singer_stats(session, interaction.guild_id, user.id)
+                else:
+                    guild_stats = await self.history.get_guild_stats(session, interaction.guild_id, STATS_TOP_SIZE)
+
+            if(user != None):
+                if(not singer_stats.performances):
+                    await self.reply(interaction, f"<@{user.id}> hasn't sung yet!", ephemeral=True)
+                    return
+                stats_strs = [f"<@{user.id}> has sung {singer_stats.performances} time{'s' if singer_stats.performances != 1 else ''}."]
+                if(singer_stats.average_seconds != None):
+                    stats_strs.append(f"Average turn: {describe_duration(singer_stats.average_seconds)}")
+                await self.reply(interaction, "\n".join(stats_strs), ephemeral=True)
+                return
+
+            if(not guild_stats.performances):
+                await self.reply(interaction, "No one has sung yet!", ephemeral=True)
+                return
+            stats_strs = [f"Songs sung: {guild_stats.performances}"]
+            if(guild_stats.average_seconds != None):
+                stats_strs.append(f"Average turn: {describe_duration(guild_stats.average_seconds)}")
+            if(guild_stats.top_singers):
+                stats_strs.append("\nTop Singers:")
+                stats_strs.extend(f"{pos}. <@{user_id}> ({performances})" for pos, (user_id, performances) in enumerate(guild_stats.top_singers, 1))
+            if(guild_stats.top_songs):
+                stats_strs.append("\nTop Songs:")
+                stats_strs.extend(f"{pos}. {describe_song_name(song_name)} ({performances})" for pos, (song_name, performances) in enumerate(guild_stats.top_songs, 1))
+            await self.reply(interaction, "\n".join(stats_strs), ephemeral=True)
                 
         @self.bot.slash_command(guild_ids=self.config.guild_ids)
         async def nextmsg(interaction: nextcord.Interaction) -> None:
             pass
 
         @nextmsg.subcommand(name="list", description="Displays all the templates for the 'next up' messages.")
+        @self.metrics.instrument("nextmsg list")
         async def nextmsglist(interaction: nextcord.Interaction) -> None:
-            async with self.db_sessionmaker() as session:
+            async with self.db_router.session(interaction.guild_id) as session:
                 stmt = sa.select(NextMsgEntry).where(NextMsgEntry.guild_id == interaction.guild_id)
                 stmt_res = await session.execute(stmt)
                 nextmsgs = stmt_res.scalars().all()
             
             if(not nextmsgs):
-                await interaction.send("No custom 'up next' messages defined!", ephemeral=True)
+                await self.reply(interaction, "No custom 'up next' messages defined!", ephemeral=True)
                 return
             
             nextmsg_list = ["'Up Next' Custom Messages"] + [f"{i.name}: \"{i.msg}\"" for i in nextmsgs]
 
-            await interaction.send("\n".join(nextmsg_list), ephemeral=True)
+            await self.reply(interaction, "\n".join(nextmsg_list), ephemeral=True)
         
         @nextmsg.subcommand(name="add", description="Add a new 'next up' message template.")
+        @self.metrics.instrument("nextmsg add")
         async def nextmsgadd(
             interaction: nextcord.Interaction,
             template: str = nextcord.SlashOption(description="The template message. Placeholders: {user} = username; {song} = song name.", required=True),
             name: str = nextcord.SlashOption(description="The name of this template message.", required=False)
         ) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
-                name_in_db = True
+            async def nextmsgadd_op(session: sa_async.AsyncSession) -> str:
+                try:
+                    compiled = NextMsgTemplate(template)
+                except ValueError as e:
+                    return f"Invalid template: {e}"
+
+                template_name = name
+                if(template_name and await self.check_nextmsg_name(session, interaction.guild_id, template_name)):
+                    return f"A template with name \"{template_name}\" already exists!"
+
+                name_in_db = not template_name
                 while(name_in_db):
-                    name = name if name else "".join(random.choices(string.ascii_lowercase + string.digits, k = 8))
-                    stmt = sa.select(sa.func.count(NextMsgEntry.id)).where(NextMsgEntry.name == name)
-                    stmt_res = await session.execute(stmt)
-                    name_in_db = stmt_res.scalar_one() > 0
+                    template_name = "".join(random.choices(string.ascii_lowercase + string.digits, k = 8))
+                    name_in_db = await self.check_nextmsg_name(session, interaction.guild_id, template_name)
 
                 session.add(NextMsgEntry(
                     guild_id=interaction.guild_id,
                     msg=template,
-                    has_song="{song}" in template,
-                    name=name
+                    has_song="song" in compiled.fields,
+                    name=template_name
                 ))
+                self.template_cache.invalidate(interaction.guild_id)
 
-                await session.commit()
+                return f"Added template with name \"{template_name}\"."
 
-            await interaction.send(f"Added template with name \"{name}\".", ephemeral=True)
+            reply = await self.run_write(interaction.guild_id, nextmsgadd_op)
+            self.template_cache.invalidate(interaction.guild_id)
+            await self.reply(interaction, reply, ephemeral=True)
 
         @nextmsg.subcommand(name="remove", description="Removes a 'next up' message template.")
+        @self.metrics.instrument("nextmsg remove")
         async def nextmsgremove(
             interaction: nextcord.Interaction,
             name: str = nextcord.SlashOption(description="The name of the template message to remove.", required=False)
         ) -> None:
-            async with self.db_sessionmaker() as session, session.begin():
+            async def nextmsgremove_op(session: sa_async.AsyncSession) -> str:
                 stmt = sa.select(NextMsgEntry) \
                         .where(NextMsgEntry.guild_id == interaction.guild_id) \
                         .where(NextMsgEntry.name == name)
                 stmt_res = await session.execute(stmt)
                 nextmsg = stmt_res.scalar_one_or_none()
-            
-            if(not nextmsg):
-                await interaction.send(f"Could not find 'up next' message with name \"{nextmsg.name}\"!")
-                return
-            
-            await session.delete(nextmsg)
-            await session.commit()
-            
-            await interaction.send(f"Removed template with name \"{name}\".", ephemeral=True)
 
-    async def get_queue(self, session: sa_async.AsyncSession, guild_id: int) -> list:
-        stmt = sa_future.select(QueueEntry).where(QueueEntry.guild_id == guild_id).order_by(QueueEntry.queue_pos)
-        result = await session.execute(stmt)
-        return result.scalars().all()
-
-    async def get_queue_length(self, session: sa_async.AsyncSession, guild_id: int) -> int:
-        stmt = sa_future.select(sa.func.count(QueueEntry.id)) \
-            .where(QueueEntry.guild_id == guild_id) \
-            .where(QueueEntry.queue_pos != 0)
-        result = await session.execute(stmt)
-        return result.scalar_one()
+                if(not nextmsg):
+                    return f"Could not find 'up next' message with name \"{name}\"!"
 
-    async def get_queue_elem(self, session: sa_async.AsyncSession, guild_id: int, user_id: int) -> QueueEntry:
-        stmt = sa_future.select(QueueEntry) \
-            .where(QueueEntry.guild_id == guild_id) \
-            .where(QueueEntry.user_id == user_id)
-        result = await session.execute(stmt)
-        return result.scalar_one()
+                await session.delete(nextmsg)
+                self.template_cache.invalidate(interaction.guild_id)
+                return f"Removed template with name \"{name}\"."
 
-    async def check_in_queue(self, session: sa_async.AsyncSession, guild_id: int, user_id: int) -> bool:
-        stmt = sa_future.select(sa.func.count(QueueEntry.id)) \
-            .where(QueueEntry.guild_id == guild_id) \
-            .where(QueueEntry.user_id == user_id)
-        result = await session.execute(stmt)
-        return result.scalar_one() > 0
+            reply = await self.run_write(interaction.guild_id, nextmsgremove_op)
+            self.template_cache.invalidate(interaction.guild_id)
+            await self.reply(interaction, reply, ephemeral=True)
 
-    async def get_current(self, session: sa_async.AsyncSession, guild_id: int) -> QueueEntry:
-        stmt = sa_future.select(QueueEntry) \
-            .where(QueueEntry.guild_id == guild_id) \
-            .where(QueueEntry.queue_pos == 0)
-        result = await session.execute(stmt)
-        return result.scalar_one_or_none()
+        @self.bot.slash_command(guild_ids=self.config.guild_ids)
+        async def board(interaction: nextcord.Interaction) -> None:
+            pass
 
-    async def decrement_queue_numbers(self, session: sa_async.AsyncSession, guild_id: int, queue_num: int, queue_num_end = -1) -> None:
-        stmt = sa_future.select(QueueEntry) \
-            .where(QueueEntry.guild_id == guild_id) \
-            .where(QueueEntry.queue_pos >= queue_num)
+        @board.subcommand(name="show", description="Post a message here showing who's up and who's next, kept up to date.")
+        @self.metrics.instrument("board show")
+        async def boardshow(
+            interaction: nextcord.Interaction,
+            size: int = nextcord.SlashOption(description="How many waiting singers to show.", default=BOARD_DEFAULT_SIZE, required=False, min_value=1, max_value=QUEUE_PAGE_SIZE),
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+            size = min(max(size, 1), QUEUE_PAGE_SIZE)
+            content = self._render_board(await self.get_queue_state(interaction.guild_id, room_id), size)
+            try:
+                message = await self.dispatcher.send(
+                    LANE_CONFIRM,
+                    lambda: interaction.channel.send(content, allowed_mentions=nextcord.AllowedMentions(replied_user=True, everyone=False, users=[], roles=[])),
+                    interaction.channel.id
+                )
+            except nextcord.Forbidden:
+                await self.reply(interaction, "I can't post in this channel!", ephemeral=True)
+                return
 
-        if(queue_num_end != -1):
-            stmt = stmt.where(QueueEntry.queue_pos <= queue_num_end)
+            async def boardshow_op(session: sa_async.AsyncSession) -> str:
+                replaced = await session.get(BoardEntry, (interaction.guild_id, room_id)) != None
+                await session.merge(BoardEntry(guild_id=interaction.guild_id, room_id=room_id, channel_id=message.channel.id, message_id=message.id, size=size))
+                board = Board(interaction.guild_id, room_id, message.channel.id, message.id, size)
+                board.content = content
+                self.board_updater.set_board((interaction.guild_id, room_id), board)
+                if(replaced):
+                    return "Board posted. The previous one won't be updated anymore."
+                return "Board posted."
+
+            await self.reply(interaction, await self.run_room_write(interaction.guild_id, room_id, boardshow_op), ephemeral=True)
+            # Catches anything that changed while the board was being posted.
+            await self.board_updater.changed((interaction.guild_id, room_id))
+
+        @board.subcommand(name="remove", description="Stop updating the board message.")
+        @self.metrics.instrument("board remove")
+        async def boardremove(
+            interaction: nextcord.Interaction,
+            room: nextcord.abc.GuildChannel = room_option()
+        ) -> None:
+            room_id = get_room_id(interaction, room)
+
+            async def boardremove_op(session: sa_async.AsyncSession) -> str:
+                if(not await self.delete_board(session, interaction.guild_id, room_id)):
+                    return "There's no board to remove!"
+                return "The board won't be updated anymore."
+
+            await self.reply(interaction, await self.run_room_write(interaction.guild_id, room_id, boardremove_op), ephemeral=True)
+
+    async def reply(self, interaction: nextcord.Interaction, content: str, lane: int = LANE_CONFIRM, **kwargs) -> None:
+        """Answers the interaction through the dispatcher, see OutboundDispatcher."""
+        await self.dispatcher.send(lane, lambda: interaction.send(content, **kwargs))
+
+    async def run_write(self, guild_id: int, op):
+        """Runs op(session) in its own transaction, after every write already queued for the guild."""
+        return await self.guild_executor.run(guild_id, lambda: self._write(guild_id, op))
+
+    async def run_room_write(self, guild_id: int, room_id: int, op):
+        """Like run_write, but ordered after the writes already queued for the room instead.
+
+        Each room has its own executor so rooms in one guild don't wait on each other.
+        """
+        return await self.guild_executor.run((guild_id, room_id), lambda: self._write(guild_id, op))
+
+    async def run_queue_write(self, guild_id: int, room_id: int, op):
+        """Like run_room_write, but op(txn) gets a transaction on the queue store."""
+        return await self.guild_executor.run((guild_id, room_id), lambda: self._queue_write(guild_id, room_id, op))
+
+    async def _queue_write(self, guild_id: int, room_id: int, op, activity: bool = True):
+        # Writes made by the room's own timers pass activity=False, so they don't keep an
+        # abandoned queue from expiring.
+        result = await self.queue_store.write(guild_id, op)
+        await self.board_updater.changed((guild_id, room_id))
+        await self.schedule_timers(guild_id, room_id, activity)
+        return result
+
+    async def advance(self, guild_id: int, room_id: int, activity: bool = True) -> str:
+        """Moves the room on to its next singer and returns the message announcing them, None if
+        nobody is up now. Runs on the room's executor."""
+        state = await self.get_queue_state(guild_id, room_id)
+        finished_elem = state.get_current()
+        finished_since = state.current_since
+        current_elem = await self._queue_write(guild_id, room_id, lambda txn: self.queue_store.advance_queue(txn, guild_id, room_id), activity)
+        if(finished_elem != None):
+            self.history.record(guild_id, finished_elem.user_id, finished_elem.song_name, finished_since, self.clock())
+        if(current_elem == None):
+            return None
+
+        templates = await self.get_nextmsg_templates(guild_id)
+        template = templates.choose(bool(current_elem.song_name))
+        return template.render(f"<@{current_elem.user_id}>", current_elem.song_name)
+
+    async def export_guild(self, guild_id: int, fileobj) -> dict:
+        """Writes the guild's queues and templates to fileobj, see KaraokeQueueBotBackup.
+        Returns how many rows of each kind were exported."""
+        return await export_guild(fileobj, guild_id, self.queue_store, self.db_router, self.clock())
+
+    async def restore_guild(self, guild_id: int, fileobj) -> dict:
+        """Replaces the guild's queues and templates with the export in fileobj, then brings
+        the boards and timers of every room it changed up to date. Raises ExportError if the
+        export can't be read, in which case nothing is changed. No other writes to the guild's
+        queues run alongside it."""
+        counts, room_ids = await self.guild_executor.run_exclusive(guild_id, lambda: import_guild(fileobj, guild_id, self.queue_store, self._write))
+        self.template_cache.invalidate(guild_id)
+        for room_id in room_ids:
+            await self.board_updater.changed((guild_id, room_id))
+            await self.schedule_timers(guild_id, room_id)
+        logging.info(f"Imported {sum(counts.values())} rows into guild {guild_id}, {len(room_ids)} rooms changed.")
+        return counts
+
+    async def get_auto_advance(self, guild_id: int) -> int:
+        """Seconds a singer can be up in the guild before the queue moves on, 0 for never."""
+        seconds = self.auto_advance.get(guild_id)
+        if(seconds is None):
+            async with self.db_router.session(guild_id) as session:
+                entry = await session.get(GuildSettingsEntry, guild_id)
+            if(entry != None and entry.auto_advance_s != None):
+                seconds = entry.auto_advance_s
+            else:
+                seconds = round(self.config.auto_advance_minutes * 60)
+            self.auto_advance[guild_id] = seconds
+        return seconds
+
+    def describe_nobody_up(self, state: GuildQueueState) -> str:
+        eligible_at = state.next_eligible_at(self.clock())
+        if(eligible_at != None):
+            return f"No one can sing yet, the next singer is back up in {describe_duration(eligible_at - self.clock())}."
+        return "No one left in the queue!"
+
+    async def schedule_timers(self, guild_id: int, room_id: int, activity: bool = True) -> None:
+        """Points the room's timers at its queue as it is now, called after every write to it.
+
+        The "advance" timer moves on from the current singer once they've been up for the
+        guild's auto-advance, or puts the next singer up once their cooldown ends if the room
+        stalled because everyone waiting was cooling down. The "expire" timer clears the queue
+        once it has gone idle_queue_expiry_hours without any activity.
+        """
+        key = (guild_id, room_id)
+        auto_advance = await self.get_auto_advance(guild_id)
+        idle_expiry = self.config.idle_queue_expiry_hours * 3600
+        if(not auto_advance and not idle_expiry):
+            self.scheduler.cancel(("advance",) + key)
+            self.scheduler.cancel(("expire",) + key)
+            return
 
-        result = await session.execute(stmt)
-        queue_elems = result.scalars().all()
+        state = await self.get_queue_state(guild_id, room_id)
+        now = self.clock()
+        deadline = None
+        if(auto_advance and state.current_id != None):
+            deadline = (state.current_since if state.current_since != None else now) + auto_advance
+        elif(auto_advance and state.get_queue_length()):
+            deadline = state.next_eligible_at(now)
+        if(deadline != None):
+            current_id, current_since = state.current_id, state.current_since
+            self.scheduler.schedule(("advance",) + key, deadline, lambda: self.auto_advance_room(guild_id, room_id, current_id, current_since))
+        else:
+            self.scheduler.cancel(("advance",) + key)
 
-        for elem in queue_elems:
-            elem.queue_pos -= 1
+        if(idle_expiry and state.entries):
+            if(activity):
+                self.scheduler.schedule(("expire",) + key, now + idle_expiry, lambda: self.expire_room(guild_id, room_id))
+        else:
+            self.scheduler.cancel(("expire",) + key)
+
+    def set_announce_channel(self, guild_id: int, room_id: int, channel) -> None:
+        key = (guild_id, room_id)
+        self.announce_channels[key] = channel
+        self.announce_channels.move_to_end(key)
+        while(len(self.announce_channels) > ANNOUNCE_CHANNELS_MAX):
+            self.announce_channels.popitem(last=False)
+
+    async def auto_advance_room(self, guild_id: int, room_id: int, current_id: int, current_since: float) -> None:
+        async def auto_advance_job() -> tuple:
+            # Whoever the timer was set for may already be gone.
+            state = await self.get_queue_state(guild_id, room_id)
+            if(state.current_id != current_id or state.current_since != current_since):
+                return (False, None, None)
+            finished_elem = state.get_current()
+            self.auto_advances += 1
+            msg = await self.advance(guild_id, room_id, activity=False)
+            if(msg == None and finished_elem != None):
+                msg = self.describe_nobody_up(await self.get_queue_state(guild_id, room_id))
+            return (True, finished_elem, msg)
+
+        advanced, finished_elem, msg = await self.guild_executor.run((guild_id, room_id), auto_advance_job)
+        channel = self.announce_channels.get((guild_id, room_id))
+        if(not advanced or channel == None or msg == None):
+            return
 
-    async def increment_queue_numbers(self, session: sa_async.AsyncSession, guild_id: int, queue_num: int, queue_num_end = -1) -> None:
-        stmt = sa_future.select(QueueEntry) \
-            .where(QueueEntry.guild_id == guild_id) \
-            .where(QueueEntry.queue_pos >= queue_num)
+        if(finished_elem != None):
+            msg = f"Time's up for <@{finished_elem.user_id}>! {msg}"
+        await self.dispatcher.send(LANE_ANNOUNCE, lambda: channel.send(msg), channel.id)
 
-        if(queue_num_end != -1):
-            stmt = stmt.where(QueueEntry.queue_pos <= queue_num_end)
-        
-        result = await session.execute(stmt)
-        queue_elems = result.scalars().all()
-
-        for elem in queue_elems:
-            elem.queue_pos += 1
-    
-    async def add_to_queue(self, session: sa_async.AsyncSession, guild_id: int, user_id: int, song: str = None, requeue = False) -> None:
-        queue_pos = await self.get_queue_length(session, guild_id)
-        queue_pos += 1
-        session.add(
-            QueueEntry(
-                guild_id=guild_id,
-                user_id=user_id,
-                song_name=song,
-                queue_pos=queue_pos,
-                requeue=requeue
+    async def expire_room(self, guild_id: int, room_id: int) -> None:
+        async def expire_job() -> None:
+            # A write that was already waiting on the room set a newer timer.
+            if(self.scheduler.pending(("expire", guild_id, room_id)) != None):
+                return
+            await self._queue_write(guild_id, room_id, lambda txn: self.queue_store.clear_queue(txn, guild_id, room_id), activity=False)
+            self.expired_queues += 1
+            # The room may well be a voice channel that's since been deleted.
+            self.announce_channels.pop((guild_id, room_id), None)
+            logging.info(f"Cleared the idle queue of room {room_id} in guild {guild_id}.")
+
+        await self.guild_executor.run((guild_id, room_id), expire_job)
+
+    async def _write(self, guild_id: int, op):
+        async with self.db_router.use(guild_id) as shard:
+            if(shard.group_committer != None):
+                return await shard.group_committer.submit(lambda session: self._write_in_savepoint(session, op))
+
+            async with shard.write_lock, shard.sessionmaker() as session, session.begin():
+                await begin_write(session)
+                return await op(session)
+
+    async def _write_in_savepoint(self, session: sa_async.AsyncSession, op):
+        # The group committer rolls back just this op's savepoint if it fails, so forget
+        # whatever it staged for the cache too.
+        checkpoint = self.queue_cache.checkpoint(session.sync_session)
+        try:
+            return await op(session)
+        except Exception:
+            self.queue_cache.rollback_to(session.sync_session, checkpoint)
+            raise
+
+    async def check_manual_order(self, txn, guild_id: int, room_id: int) -> str:
+        """Why the queue can't be put in order by hand, or None if it can."""
+        policy = await self.queue_store.get_policy(txn, guild_id, room_id)
+        if(policy == POLICY_FIFO):
+            return None
+        return f"The queue is ordered by \"{policy}\" ({POLICY_DESCRIPTIONS[policy]}), switch to \"{POLICY_FIFO}\" with /queue policy to order it by hand."
+
+    async def get_queue_state(self, guild_id: int, room_id: int) -> GuildQueueState:
+        return await self.queue_store.get_state(guild_id, room_id)
+
+    async def render_queue_page(self, guild_id: int, room_id: int, page: int) -> tuple:
+        """Returns (content, page, page_count) for one page of the room's queue, clamping page
+        into range. Pages are rendered once per change to the queue."""
+        state = await self.get_queue_state(guild_id, room_id)
+        page_count = get_page_count(state.get_queue_length())
+        page = min(max(page, 1), page_count)
+        return (state.get_rendered_page(page, self._render_queue_page), page, page_count)
+
+    def _render_queue_page(self, state: GuildQueueState, page: int) -> str:
+        current_elem = state.get_current()
+        current_elem_str = f"<@{current_elem.user_id}>" if current_elem != None else "nobody"
+        queue_strs = [
+            f"Currently Up: {current_elem_str}\n",
+            "Current Queue:" if state.policy == POLICY_FIFO else f"Current Queue ({POLICY_DESCRIPTIONS[state.policy]}):"
+        ]
+
+        waiting = state.get_waiting()
+        start = (page - 1) * QUEUE_PAGE_SIZE
+        if(not waiting):
+            queue_strs.append("Queue is empty!")
+        else:
+            for queue_pos in range(start + 1, min(start + QUEUE_PAGE_SIZE, len(waiting)) + 1):
+                queue_strs.append(f"{queue_pos}. {describe_entry(waiting[queue_pos - 1])}")
+
+        page_count = get_page_count(len(waiting))
+        if(page_count > 1):
+            queue_strs.append(f"\nPage {page}/{page_count}")
+        return "\n".join(queue_strs)
+
+    async def load_board(self, key: tuple) -> Board:
+        guild_id, room_id = key
+        async with self.db_router.session(guild_id) as session:
+            entry = await session.get(BoardEntry, key)
+        if(entry == None):
+            return None
+        return Board(entry.guild_id, entry.room_id, entry.channel_id, entry.message_id, entry.size)
+
+    async def get_board_rooms(self, guild_id: int) -> list:
+        async with self.db_router.session(guild_id) as session:
+            result = await session.execute(sa_future.select(BoardEntry.room_id).where(BoardEntry.guild_id == guild_id))
+            return result.scalars().all()
+
+    async def delete_board(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, message_id: int = None) -> bool:
+        """Deletes the room's board, if it's still the one with message_id when that's given."""
+        entry = await session.get(BoardEntry, (guild_id, room_id))
+        if(entry == None or (message_id != None and entry.message_id != message_id)):
+            return False
+        await session.delete(entry)
+        self.board_updater.set_board((guild_id, room_id), None)
+        return True
+
+    async def render_board(self, board: Board) -> str:
+        return self._render_board(await self.get_queue_state(board.guild_id, board.room_id), board.size)
+
+    def _render_board(self, state: GuildQueueState, size: int) -> str:
+        current_elem = state.get_current()
+        board_strs = [
+            f"Now Singing: {describe_entry(current_elem) if current_elem != None else 'nobody'}\n",
+            "Up Next:" if state.policy == POLICY_FIFO else f"Up Next ({POLICY_DESCRIPTIONS[state.policy]}):"
+        ]
+
+        waiting = state.get_waiting()
+        if(not waiting):
+            board_strs.append("Queue is empty!")
+        for queue_pos, queue_elem in enumerate(waiting[:size], 1):
+            board_strs.append(f"{queue_pos}. {describe_entry(queue_elem)}")
+        if(len(waiting) > size):
+            board_strs.append(f"\n...and {len(waiting) - size} more.")
+        return "\n".join(board_strs)
+
+    async def edit_board(self, board: Board, content: str) -> None:
+        message = self.bot.get_partial_messageable(board.channel_id).get_partial_message(board.message_id)
+        try:
+            await self.dispatcher.send(
+                LANE_EDIT,
+                lambda: message.edit(content=content, allowed_mentions=nextcord.AllowedMentions(replied_user=True, everyone=False, users=[], roles=[])),
+                board.channel_id,
+                ("board", board.message_id)
             )
-        )
-
-    async def remove_from_queue(self, session: sa_async.AsyncSession, guild_id: int, user_id: int) -> None:
-        stmt = sa_future.select(QueueEntry) \
-            .where(QueueEntry.guild_id == guild_id) \
-            .where(QueueEntry.user_id == user_id)
+        except nextcord.NotFound:
+            logging.info(f"The board message of room {board.room_id} in guild {board.guild_id} was deleted, no longer updating it.")
+            await self.run_room_write(board.guild_id, board.room_id, lambda session: self.delete_board(session, board.guild_id, board.room_id, board.message_id))
+
+    async def get_nextmsg_templates(self, guild_id: int) -> GuildTemplates:
+        async def load_templates(guild_id: int) -> GuildTemplates:
+            stmt = sa_future.select(NextMsgEntry).where(NextMsgEntry.guild_id == guild_id)
+            async with self.db_router.session(guild_id) as session:
+                result = await session.execute(stmt)
+                return GuildTemplates(guild_id, result.scalars().all())
+
+        return await self.template_cache.get(guild_id, load_templates)
+
+    async def check_nextmsg_name(self, session: sa_async.AsyncSession, guild_id: int, name: str) -> bool:
+        stmt = sa_future.select(sa.func.count(NextMsgEntry.id)) \
+            .where(NextMsgEntry.guild_id == guild_id) \
+            .where(NextMsgEntry.name == name)
         result = await session.execute(stmt)
-        elem = result.scalar_one()
-        
-        await session.delete(elem)
-
-        await self.decrement_queue_numbers(session, guild_id, elem.queue_pos)
-
-    async def move_queue_elem(self, session: sa_async.AsyncSession, guild_id: int, user_id: int, new_queue_pos: int) -> None:
-        elem = await self.get_queue_elem(session, guild_id, user_id)
-
-        if(elem.queue_pos == new_queue_pos):
-            return
-        elif(elem.queue_pos > new_queue_pos):
-            await self.increment_queue_numbers(session, guild_id, new_queue_pos, elem.queue_pos)
-        elif(elem.queue_pos < new_queue_pos):
-            await self.decrement_queue_numbers(session, guild_id, elem.queue_pos, new_queue_pos)
-
-        elem.queue_pos = new_queue_pos
\ No newline at end of file
+        return result.scalar_one() > 0
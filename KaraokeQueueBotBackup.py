@@ -0,0 +1,207 @@
+import gzip
+import json
+import os
+import sqlite3
+import zlib
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
+import sqlalchemy.future as sa_future
+
+from KaraokeQueueBotObjects import NextMsgEntry
+from KaraokeQueueBotStore import BULK_STATEMENT_ROWS, SqlQueueStore
+from KaraokeQueueBotTemplates import NextMsgTemplate
+
+# An export is gzipped JSON lines: a header object, then one array per row starting with its
+# kind, then ["end", rows] so a file that was cut short is caught before anything is imported.
+# Rows are:
+#   ["nextmsg", name, template]
+#   ["room", room_id, current user_id or null, policy or null for the default, current_since]
+#   ["singer", room_id, user_id, turns, weight]
+#   ["queue", room_id, user_id, song_name, sort_key, requeue, eligible_at]
+# Entry ids aren't exported, an import gives them new ones, so an export can be imported into
+# any guild on any database.
+EXPORT_FORMAT = "karaoke-queue-export"
+EXPORT_VERSION = 1
+EXPORT_FIELDS = {"nextmsg": 2, "room": 4, "singer": 4, "queue": 6}
+QUEUE_KINDS = ("room", "singer", "queue")
+
+# Rows held in memory at once while exporting or importing.
+EXPORT_BATCH_ROWS = BULK_STATEMENT_ROWS
+
+# Pages copied per step of a backup of a database that isn't in WAL mode. The source is only
+# locked during a step, so writers get a turn in between.
+BACKUP_STEP_PAGES = 1024
+BACKUP_STEP_SLEEP_S = 0.005
+
+class ExportError(Exception):
+    pass
+
+async def export_guild(fileobj, guild_id: int, queue_store, db_router, exported_at: float) -> dict:
+    """Writes the guild's queues and 'next up' templates to fileobj, a binary file, a batch of
+    rows at a time. Returns how many rows of each kind were written."""
+    counts = dict.fromkeys(EXPORT_FIELDS, 0)
+    header = {"format": EXPORT_FORMAT, "version": EXPORT_VERSION, "guild_id": guild_id, "exported_at": exported_at}
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=6) as f:
+        f.write(encode_row(header))
+        for batches in (export_templates(db_router, guild_id, EXPORT_BATCH_ROWS), queue_store.export_guild(guild_id, EXPORT_BATCH_ROWS)):
+            async for batch in batches:
+                f.write(b"".join(encode_row(row) for row in batch))
+                for row in batch:
+                    counts[row[0]] += 1
+        f.write(encode_row(["end", sum(counts.values())]))
+    return counts
+
+async def export_templates(db_router, guild_id: int, batch_rows: int):
+    async with db_router.session(guild_id) as session:
+        stmt = sa_future.select(NextMsgEntry.name, NextMsgEntry.msg) \
+            .where(NextMsgEntry.guild_id == guild_id) \
+            .order_by(NextMsgEntry.id)
+        result = await session.stream(stmt)
+        async for partition in result.partitions(batch_rows):
+            yield [["nextmsg", *row] for row in partition]
+
+def encode_row(row) -> bytes:
+    return json.dumps(row, separators=(",", ":")).encode("utf-8") + b"\n"
+
+def read_export(fileobj, kinds = tuple(EXPORT_FIELDS)):
+    """Yields the export's rows of the given kinds in lists of up to EXPORT_BATCH_ROWS.
+
+    Raises ExportError for anything that isn't a whole export this version can read, which may
+    be after some batches have already been handed out.
+    """
+    try:
+        with gzip.GzipFile(fileobj=fileobj, mode="rb") as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = None
+            if(not isinstance(header, dict) or header.get("format") != EXPORT_FORMAT):
+                raise ExportError("Not a queue export.")
+            if(header.get("version", 0) > EXPORT_VERSION):
+                raise ExportError(f"The export is format version {header['version']}, this bot only reads up to {EXPORT_VERSION}.")
+
+            # Rows of other kinds are only counted, as exported they start with their kind so
+            # they don't need decoding.
+            skipped = tuple(encode_row([kind])[:-2] + b"," for kind in EXPORT_FIELDS if kind not in kinds)
+            batch = []
+            rows = 0
+            ended = False
+            for line_no, line in enumerate(f, start=2):
+                if(skipped and line.startswith(skipped) and not ended):
+                    rows += 1
+                    continue
+                row = decode_row(line, line_no)
+                if(ended):
+                    raise ExportError(f"Line {line_no} comes after the end of the export.")
+                if(row[0] == "end"):
+                    if(len(row) != 2 or row[1] != rows):
+                        raise ExportError(f"The export ends after {rows} rows but says it has {row[1:]}.")
+                    ended = True
+                    continue
+                if(len(row) != EXPORT_FIELDS.get(row[0], -1) + 1):
+                    raise ExportError(f"Line {line_no} isn't a row of a known kind.")
+
+                rows += 1
+                if(row[0] in kinds):
+                    batch.append(row)
+                    if(len(batch) >= EXPORT_BATCH_ROWS):
+                        yield batch
+                        batch = []
+            if(not ended):
+                raise ExportError(f"The export is cut short after {rows} rows.")
+            if(batch):
+                yield batch
+    except (OSError, EOFError, zlib.error) as e:
+        raise ExportError(f"The export can't be read: {e}") from e
+
+def decode_row(line: bytes, line_no: int) -> list:
+    try:
+        row = json.loads(line)
+    except ValueError:
+        raise ExportError(f"Line {line_no} is corrupt.")
+    if(not isinstance(row, list) or not row):
+        raise ExportError(f"Line {line_no} isn't a row.")
+    return row
+
+def check_export(fileobj) -> dict:
+    """Reads the whole export, without keeping it, and returns how many rows of each kind it has.
+    Leaves fileobj back at the start."""
+    counts = dict.fromkeys(EXPORT_FIELDS, 0)
+    fileobj.seek(0)
+    for batch in read_export(fileobj):
+        for row in batch:
+            counts[row[0]] += 1
+    fileobj.seek(0)
+    return counts
+
+async def import_guild(fileobj, guild_id: int, queue_store, write) -> tuple:
+    """Replaces the guild's queues and 'next up' templates with the export in fileobj, which
+    has to be seekable. Returns (rows of each kind, ids of the rooms changed).
+
+    The export is checked all the way through first, then read again a batch at a time while
+    it's bulk inserted. With the SQL queue store the templates and queues are replaced in the
+    one transaction. The journal keeps the queues apart from the database, so there the
+    templates are replaced first and the queues in a journal write of their own.
+
+    write(guild_id, op) runs op(session) in a write transaction on the guild's shard.
+    """
+    counts = check_export(fileobj)
+
+    def read(kinds: tuple):
+        fileobj.seek(0)
+        return read_export(fileobj, kinds)
+
+    if(isinstance(queue_store, SqlQueueStore)):
+        async def import_op(session: sa_async.AsyncSession) -> list:
+            await import_templates(session, guild_id, read(("nextmsg",)))
+            return await queue_store.import_guild(session, guild_id, read(QUEUE_KINDS))
+        room_ids = await write(guild_id, import_op)
+    else:
+        await write(guild_id, lambda session: import_templates(session, guild_id, read(("nextmsg",))))
+        room_ids = await queue_store.write(guild_id, lambda txn: queue_store.import_guild(txn, guild_id, read(QUEUE_KINDS)))
+    return (counts, room_ids)
+
+async def import_templates(session: sa_async.AsyncSession, guild_id: int, batches) -> None:
+    stmt = sa.delete(NextMsgEntry) \
+        .where(NextMsgEntry.guild_id == guild_id) \
+        .execution_options(synchronize_session=False)
+    await session.execute(stmt)
+
+    for batch in batches:
+        rows = []
+        for _, name, template in batch:
+            try:
+                compiled = NextMsgTemplate(template)
+            except (TypeError, ValueError) as e:
+                raise ExportError(f"Template \"{name}\" is invalid: {e}")
+            rows.append({"guild_id": guild_id, "msg": template, "has_song": "song" in compiled.fields, "name": name})
+        await session.execute(sa.insert(NextMsgEntry), rows)
+
+def backup_database(source_path: str, dest_path: str, busy_timeout_ms: int = 5000) -> int:
+    """Copies a database that may be in use to dest_path with SQLite's online backup API, and
+    returns how many pages were copied. Blocks, so run it on a worker thread from the loop.
+
+    In WAL mode the copy is taken from a single read transaction, which writers don't wait for.
+    Otherwise it's copied BACKUP_STEP_PAGES at a time, letting go of the source between steps;
+    a write in between restarts the copy. The backup is written next to dest_path and only
+    renamed into place once it's whole.
+    """
+    tmp_path = dest_path + ".tmp"
+    if(os.path.exists(tmp_path)):
+        os.remove(tmp_path)
+
+    source = sqlite3.connect(source_path, timeout=busy_timeout_ms / 1000)
+    try:
+        wal = source.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+        dest = sqlite3.connect(tmp_path)
+        try:
+            source.backup(dest, pages=-1 if wal else BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP_S)
+            pages = dest.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            dest.close()
+    finally:
+        source.close()
+
+    os.replace(tmp_path, dest_path)
+    return pages
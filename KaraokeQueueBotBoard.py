@@ -0,0 +1,119 @@
+import asyncio
+import collections
+import logging
+
+class Board():
+    """Where a room's board message is and how many waiting singers it shows."""
+
+    def __init__(self, guild_id: int, room_id: int, channel_id: int, message_id: int, size: int) -> None:
+        self.guild_id = guild_id
+        self.room_id = room_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.size = size
+        # What the message was last edited to, None until the first edit.
+        self.content = None
+
+class BoardUpdater():
+    """Keeps each room's board message in step with its queue.
+
+    Rooms are keyed by (guild_id, room_id). A change to a room's queue schedules an edit for
+    once the queue has gone debounce seconds without another change, so a burst of changes is
+    covered by one edit at its end however long it goes on for, up to max_delay seconds after
+    the first change. Changes made while the edit is being sent get another edit, again once
+    the queue has been quiet for debounce seconds. An edit that wouldn't change the message is
+    skipped.
+
+    load(key) returns the room's Board or None, render(board) the message content and
+    edit(board, content) sends it. Whether a room has a board is remembered for the most
+    recently changed max_rooms rooms, so queue changes in rooms without one cost nothing.
+    """
+
+    def __init__(self, load, render, edit, debounce: float, max_rooms: int = 1024, max_delay: float = None) -> None:
+        self.load = load
+        self.render = render
+        self.edit = edit
+        self.debounce = debounce
+        # A room that never goes quiet still sees its board edited this often.
+        self.max_delay = max_delay if max_delay != None else debounce * 10
+        self.max_rooms = max_rooms
+        self.boards = collections.OrderedDict()
+        self.changes = 0
+        self.edits = 0
+        self.unchanged = 0
+        self._dirty = set()
+        # Loop time of each dirty room's latest change.
+        self._changed_at = {}
+        self._updating = {}
+
+    async def changed(self, key: tuple) -> None:
+        """Called after every change to the room's queue, from the room's executor."""
+        board = await self._get(key)
+        if(board is None):
+            return
+
+        self.changes += 1
+        self._dirty.add(key)
+        self._changed_at[key] = asyncio.get_running_loop().time()
+        if(key not in self._updating):
+            self._updating[key] = asyncio.ensure_future(self._update(key))
+
+    def set_board(self, key: tuple, board: Board) -> None:
+        """Records a new or removed (None) board, from the write that stores it."""
+        self.boards[key] = board
+        self.boards.move_to_end(key)
+        self._evict()
+
+    async def _get(self, key: tuple) -> Board:
+        if(key in self.boards):
+            self.boards.move_to_end(key)
+            return self.boards[key]
+
+        board = await self.load(key)
+        self.boards[key] = board
+        self._evict()
+        return board
+
+    def _evict(self) -> None:
+        while(len(self.boards) > self.max_rooms):
+            self.boards.popitem(last=False)
+
+    async def _wait_until_quiet(self, key: tuple) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while(True):
+            now = loop.time()
+            wait = min(self._changed_at[key] + self.debounce, deadline) - now
+            if(wait <= 0):
+                return
+            await asyncio.sleep(wait)
+
+    async def _update(self, key: tuple) -> None:
+        try:
+            while(key in self._dirty):
+                await self._wait_until_quiet(key)
+                self._dirty.discard(key)
+
+                board = await self._get(key)
+                if(board is None):
+                    break
+                content = await self.render(board)
+                if(content == board.content):
+                    self.unchanged += 1
+                    continue
+                try:
+                    await self.edit(board, content)
+                except Exception:
+                    logging.exception(f"Failed to update the board of room {key[1]} in guild {key[0]}.")
+                    continue
+                board.content = content
+                self.edits += 1
+        finally:
+            del self._updating[key]
+            self._changed_at.pop(key, None)
+
+    async def close(self) -> None:
+        tasks = list(self._updating.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,327 @@
+import collections
+import logging
+
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from KaraokeQueueBotObjects import MAIN_ROOM_ID
+from KaraokeQueueBotPolicies import DEFAULT_WEIGHT, POLICY_FIFO, WaitingHeap, order_key
+
+# Rough per-entry cost of a cached queue entry (slots object, dict slots, ints), used to keep
+# the cache inside its memory budget without walking every object with sys.getsizeof.
+ENTRY_SIZE_ESTIMATE = 256
+
+class CachedQueueEntry():
+    # Detached copy of a QueueEntry row. Has the same attribute names so it can be rendered
+    # by the same code as an ORM object.
+    __slots__ = ("id", "guild_id", "room_id", "user_id", "song_name", "sort_key", "requeue", "eligible_at")
+
+    def __init__(self, elem) -> None:
+        self.id = elem.id
+        self.guild_id = elem.guild_id
+        self.room_id = elem.room_id
+        self.user_id = elem.user_id
+        self.song_name = elem.song_name
+        self.sort_key = elem.sort_key
+        self.requeue = elem.requeue
+        self.eligible_at = elem.eligible_at
+
+    def size(self) -> int:
+        return ENTRY_SIZE_ESTIMATE + (len(self.song_name) if self.song_name else 0)
+
+class GuildQueueState():
+    # The queue of one of a guild's rooms.
+    def __init__(self, guild_id: int, entries: list, current_id: int, policy: str = POLICY_FIFO, singers: list = (), current_since: float = None, room_id: int = MAIN_ROOM_ID) -> None:
+        self.guild_id = guild_id
+        self.room_id = room_id
+        self.entries = {}
+        self.user_ids = {}
+        self.current_id = None
+        # Unix time the current singer went up, if known.
+        self.current_since = None
+        self.size = 0
+        self.policy = policy
+        # Turns sung since the queue was last cleared, and weights other than the default, by
+        # user id. Users who left the queue keep theirs.
+        self.turns = {}
+        self.weights = {}
+        # Bumped on every change, rendered pages are only reused while it stays the same.
+        self.version = 0
+        self._waiting = None
+        # Built by the first peek_next(), then kept up to date.
+        self._heap = None
+        # eligible_at of entries with one, some of which may have passed already.
+        self._cooling = {}
+        self._pages = {}
+        self._pages_version = 0
+
+        for user_id, turns, weight in singers:
+            self.set_turns(user_id, turns)
+            self.set_weight(user_id, weight)
+        for elem in entries:
+            self.put(elem)
+        self.set_current(current_id, current_since)
+
+    def get_current(self) -> CachedQueueEntry:
+        return self.entries.get(self.current_id)
+
+    def order_key(self, elem) -> tuple:
+        return order_key(self.policy, elem, self.turns.get(elem.user_id, 0), self.weights.get(elem.user_id, DEFAULT_WEIGHT))
+
+    def get_waiting(self) -> list:
+        # In the order the guild's policy takes them. Sorted lazily, so a burst of writes
+        # costs one sort on the next read.
+        if(self._waiting is None):
+            self._waiting = sorted(
+                (elem for elem in self.entries.values() if elem.id != self.current_id),
+                key=self.order_key
+            )
+        return self._waiting
+
+    def peek_next(self, exclude_ids: set = frozenset(), now: float = None) -> CachedQueueEntry:
+        """Whoever the policy has up next, leaving out exclude_ids, without sorting the queue.
+
+        Given now, singers still cooling down after a requeue are left out too.
+        """
+        if(self._heap is None):
+            self._heap = WaitingHeap({elem.id: self.order_key(elem) for elem in self.entries.values()})
+        return self.entries.get(self._heap.peek(exclude_ids | {self.current_id} | self.get_cooling(now)))
+
+    def get_cooling(self, now: float) -> set:
+        """Ids of the entries that can't be up yet at now, none if now is None."""
+        if(now is None or not self._cooling):
+            return set()
+        for elem_id in [elem_id for elem_id, eligible_at in self._cooling.items() if eligible_at <= now]:
+            del self._cooling[elem_id]
+        return set(self._cooling)
+
+    def next_eligible_at(self, now: float) -> float:
+        """When the first waiting singer still cooling down at now can be up, None if nobody is."""
+        return min((eligible_at for elem_id, eligible_at in self._cooling.items() if eligible_at > now and elem_id != self.current_id), default=None)
+
+    def get_queue_length(self) -> int:
+        return len(self.entries) - (1 if self.current_id in self.entries else 0)
+
+    def check_in_queue(self, user_id: int) -> bool:
+        return user_id in self.user_ids
+
+    def get_rendered_page(self, page: int, render) -> str:
+        # render(state, page) is only called if the queue changed since the page was last rendered.
+        if(self._pages_version != self.version):
+            self._pages.clear()
+            self._pages_version = self.version
+
+        rendered = self._pages.get(page)
+        if(rendered is None):
+            rendered = self._pages[page] = render(self, page)
+        return rendered
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._waiting = None
+
+    def _reorder_user(self, user_id: int) -> None:
+        elem_id = self.user_ids.get(user_id)
+        if(self._heap is not None and elem_id is not None):
+            self._heap.push(elem_id, self.order_key(self.entries[elem_id]))
+        self._changed()
+
+    def put(self, elem) -> None:
+        # Replacing an entry keeps it as the current singer if it was one.
+        current_id, current_since = self.current_id, self.current_since
+        self.remove(elem.id)
+        self.current_id, self.current_since = current_id, current_since
+        cached_elem = CachedQueueEntry(elem)
+        self.entries[cached_elem.id] = cached_elem
+        self.user_ids[cached_elem.user_id] = cached_elem.id
+        self.size += cached_elem.size()
+        if(cached_elem.eligible_at is not None):
+            self._cooling[cached_elem.id] = cached_elem.eligible_at
+        if(self._heap is not None):
+            self._heap.push(cached_elem.id, self.order_key(cached_elem))
+        self._changed()
+
+    def remove(self, elem_id: int) -> None:
+        cached_elem = self.entries.pop(elem_id, None)
+        if(cached_elem is None):
+            return
+
+        if(self.user_ids.get(cached_elem.user_id) == elem_id):
+            del self.user_ids[cached_elem.user_id]
+        if(self.current_id == elem_id):
+            self.current_id = None
+            self.current_since = None
+        self.size -= cached_elem.size()
+        self._cooling.pop(elem_id, None)
+        if(self._heap is not None):
+            self._heap.discard(elem_id)
+        self._changed()
+
+    def set_current(self, elem_id: int, since: float = None) -> None:
+        self.current_id = elem_id
+        self.current_since = since if elem_id != None else None
+        self._changed()
+
+    def set_policy(self, policy: str) -> None:
+        self.policy = policy
+        self._heap = None
+        self._changed()
+
+    def get_turns(self, user_id: int) -> int:
+        return self.turns.get(user_id, 0)
+
+    def set_turns(self, user_id: int, turns: int) -> None:
+        if(turns):
+            self.turns[user_id] = turns
+        else:
+            self.turns.pop(user_id, None)
+        self._reorder_user(user_id)
+
+    def add_turn(self, user_id: int) -> None:
+        self.set_turns(user_id, self.get_turns(user_id) + 1)
+
+    def get_weight(self, user_id: int) -> int:
+        return self.weights.get(user_id, DEFAULT_WEIGHT)
+
+    def set_weight(self, user_id: int, weight: int) -> None:
+        if(weight != DEFAULT_WEIGHT):
+            self.weights[user_id] = weight
+        else:
+            self.weights.pop(user_id, None)
+        self._reorder_user(user_id)
+
+    def clear(self) -> None:
+        # A cleared queue starts a new night, so everyone's turns start over too.
+        self.entries.clear()
+        self.user_ids.clear()
+        self.current_id = None
+        self.current_since = None
+        self.size = 0
+        self.turns.clear()
+        self._cooling.clear()
+        self._heap = None
+        self._changed()
+
+class QueueCache():
+    """In-memory copy of each room's queue, kept in step with the database.
+
+    States are keyed by (guild_id, room_id), so a busy room never evicts or invalidates its
+    neighbours' queues. Mutations stage changes against the session that writes them; the
+    changes are applied to the cached state once that session commits and dropped if it rolls
+    back. Rooms that haven't been touched recently are evicted once the cache grows past its
+    memory budget.
+    """
+
+    def __init__(self, memory_budget: int) -> None:
+        self.memory_budget = memory_budget
+        self.states = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generations = collections.defaultdict(int)
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self.states),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    async def get(self, key: tuple, loader) -> GuildQueueState:
+        state = self.states.get(key)
+        if(state is not None):
+            self.hits += 1
+            self.states.move_to_end(key)
+            return state
+
+        self.misses += 1
+        generation = self._generations[key]
+        state = await loader(key)
+
+        # A commit for this room landed while we were reading, so what we read may already
+        # be stale. Hand it back for this read but don't keep it.
+        if(generation != self._generations[key] or key in self.states):
+            return state
+
+        self.states[key] = state
+        self.size += state.size
+        self._evict(key)
+        return state
+
+    def peek(self, key: tuple) -> GuildQueueState:
+        """The room's cached state if there is one, without loading it or counting a hit."""
+        return self.states.get(key)
+
+    def invalidate(self, key: tuple) -> None:
+        self._generations[key] += 1
+        state = self.states.pop(key, None)
+        if(state is not None):
+            self.size -= state.size
+
+    def stage(self, session: sa_orm.Session, key: tuple, op) -> None:
+        pending = session.info.get("queue_cache_pending")
+        if(pending is None):
+            pending = session.info["queue_cache_pending"] = []
+            sa.event.listen(session, "after_commit", self._apply_pending)
+            sa.event.listen(session, "after_rollback", self._discard_pending)
+        pending.append((key, op))
+
+    def stage_invalidate(self, session: sa_orm.Session, key: tuple) -> None:
+        """Drops the room's cached state once the session commits, for changes too big to
+        replay onto it."""
+        self.stage(session, key, None)
+
+    def checkpoint(self, session: sa_orm.Session) -> int:
+        return len(session.info.get("queue_cache_pending", []))
+
+    def rollback_to(self, session: sa_orm.Session, checkpoint: int) -> None:
+        del session.info.get("queue_cache_pending", [])[checkpoint:]
+
+    def _apply_pending(self, session: sa_orm.Session) -> None:
+        # Releasing a savepoint fires after_commit too, wait for the real commit.
+        if(session.in_nested_transaction()):
+            return
+
+        pending = session.info.get("queue_cache_pending", [])
+        touched = set()
+        for key, op in pending:
+            touched.add(key)
+            state = self.states.get(key)
+            if(state is None):
+                continue
+
+            self.size -= state.size
+            if(op is None):
+                self.states.pop(key)
+                continue
+            try:
+                op(state)
+            except Exception:
+                logging.exception(f"Failed to update cached queue for guild {key[0]} room {key[1]}, dropping it.")
+                self.states.pop(key)
+                continue
+            self.size += state.size
+
+        for key in touched:
+            self._generations[key] += 1
+        pending.clear()
+        self._evict()
+
+    def _discard_pending(self, session: sa_orm.Session) -> None:
+        # Savepoint rollbacks are handled with checkpoint() and rollback_to().
+        if(session.in_nested_transaction()):
+            return
+
+        session.info.get("queue_cache_pending", []).clear()
+
+    def _evict(self, keep_key: tuple = None) -> None:
+        while(self.size > self.memory_budget and self.states):
+            key, state = next(iter(self.states.items()))
+            if(key == keep_key):
+                break
+            self.states.popitem(last=False)
+            self.size -= state.size
+            self.evictions += 1
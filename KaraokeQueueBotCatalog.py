@@ -0,0 +1,243 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import os.path
+import re
+import unicodedata
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
+import sqlalchemy.future as sa_future
+import sqlalchemy.pool as sa_pool
+
+# Stored in the catalog's user_version, catalogs built for another version have to be imported
+# again with import_catalog.py.
+CATALOG_VERSION = 1
+
+# The first SQLite with FTS5's trigram tokenizer, which the catalog's search index uses.
+MIN_SQLITE_VERSION = (3, 34, 0)
+
+# Discord shows at most 25 autocomplete choices, each at most 100 characters long.
+MAX_CHOICES = 25
+CHOICE_MAX_CHARS = 100
+
+# Column names accepted for a track's title and artist in imported files.
+TITLE_COLUMNS = ["title", "song", "song_name", "name"]
+ARTIST_COLUMNS = ["artist", "singer", "performer", "band"]
+
+IMPORT_BATCH_SIZE = 5000
+
+# Apostrophes are dropped rather than split on, so "dont" finds "Don't".
+APOSTROPHE_RE = re.compile(r"['\u2019]")
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+metadata = sa.MetaData()
+
+songs = sa.Table(
+    "song", metadata,
+    sa.Column("id", sa.Integer, primary_key = True),
+    sa.Column("title", sa.String, nullable = False),
+    sa.Column("artist", sa.String, nullable = True),
+    # normalize_song(title + artist), the same song spelled differently gets the same key.
+    sa.Column("search_key", sa.String, nullable = False),
+    sa.Index("ux_song_search_key", "search_key", unique = True)
+)
+
+class CatalogError(Exception):
+    pass
+
+def normalize_song(text: str) -> str:
+    """Lower case words without accents or punctuation: "Beyoncé - Halo!" -> "beyonce halo"."""
+    text = unicodedata.normalize("NFKD", APOSTROPHE_RE.sub("", text))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(NON_WORD_RE.sub(" ", text.casefold()).split())
+
+def describe_song(title: str, artist: str) -> str:
+    name = f"{title} - {artist}" if artist else title
+    if(len(name) > CHOICE_MAX_CHARS):
+        name = name[:CHOICE_MAX_CHARS - 1] + "\u2026"
+    return name
+
+def read_tracks(path: str):
+    """Yields (title, artist) from a CSV file with a header row, a JSON list of objects or a
+    file of JSON objects, one per line. Tracks without a title are skipped."""
+    def get_field(row: dict, names: list) -> str:
+        for name in names:
+            value = row.get(name)
+            if(value != None and str(value).strip()):
+                return str(value).strip()
+        return None
+
+    def from_rows(rows):
+        for row in rows:
+            row = {str(key).strip().lower(): value for key, value in row.items() if key != None}
+            title = get_field(row, TITLE_COLUMNS)
+            if(title != None):
+                yield (title, get_field(row, ARTIST_COLUMNS))
+
+    if(path.lower().endswith(".csv")):
+        with open(path, "r", encoding="UTF-8-sig", newline="") as csv_file:
+            yield from from_rows(csv.DictReader(csv_file))
+        return
+
+    with open(path, "r", encoding="UTF-8-sig") as json_file:
+        first = json_file.read(1)
+        while(first.isspace()):
+            first = json_file.read(1)
+        json_file.seek(0)
+        if(first == "["):
+            yield from from_rows(json.load(json_file))
+        else:
+            yield from from_rows(json.loads(line) for line in json_file if line.strip())
+
+def _create_schema(sync_conn) -> None:
+    metadata.create_all(sync_conn)
+    # Trigrams find a word anywhere in a title or artist, content= keeps the text in song only.
+    sync_conn.exec_driver_sql("CREATE VIRTUAL TABLE song_fts USING fts5(search_key, content='song', content_rowid='id', tokenize='trigram')")
+
+async def build_catalog(path: str, tracks) -> tuple:
+    """Writes the (title, artist) pairs from tracks into a new catalog at path.
+
+    The catalog is built next to path and moved over it once complete, so a bot reading the old
+    one never sees half an import, and removed again if the import fails. Returns (songs
+    imported, duplicates skipped).
+    """
+    tmp_path = f"{path}.importing"
+    if(os.path.exists(tmp_path)):
+        os.remove(tmp_path)
+    engine = sa_async.create_async_engine(f"sqlite+aiosqlite:///{os.path.abspath(tmp_path)}", future=True)
+    imported = 0
+    seen = 0
+    built = False
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(_create_schema)
+
+            insert = sa.insert(songs).prefix_with("OR IGNORE")
+            batch = []
+            for title, artist in tracks:
+                batch.append({"title": title, "artist": artist, "search_key": normalize_song(f"{title} {artist if artist else ''}")})
+                if(len(batch) >= IMPORT_BATCH_SIZE):
+                    seen += len(batch)
+                    await conn.execute(insert, batch)
+                    batch = []
+            if(batch):
+                seen += len(batch)
+                await conn.execute(insert, batch)
+
+            imported = (await conn.execute(sa.select(sa.func.count()).select_from(songs))).scalar_one()
+            await conn.exec_driver_sql("INSERT INTO song_fts(song_fts) VALUES ('rebuild')")
+            await conn.exec_driver_sql("INSERT INTO song_fts(song_fts) VALUES ('optimize')")
+            await conn.exec_driver_sql(f"PRAGMA user_version = {CATALOG_VERSION:d}")
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("ANALYZE")
+        built = True
+    finally:
+        await engine.dispose()
+        if(not built and os.path.exists(tmp_path)):
+            os.remove(tmp_path)
+
+    os.replace(tmp_path, path)
+    return (imported, seen - imported)
+
+class SongCatalog():
+    """Searches a catalog built by import_catalog.py, to autocomplete song options.
+
+    The catalog is a read-only SQLite file, opened on the first search and memory-mapped, so it
+    costs nothing at startup and its pages are shared with the OS page cache instead of being
+    copied into the bot. Songs whose title starts with what was typed come first, then songs
+    with every typed word of three or more letters anywhere in their title or artist.
+    """
+
+    def __init__(self, path: str, mmap_size_mb: int = 256, cache_size_mb: int = 2, pool_size: int = 4) -> None:
+        self.path = path
+        self.mmap_size_mb = mmap_size_mb
+        self.cache_size_mb = cache_size_mb
+        self.pool_size = pool_size
+        self.searches = 0
+        self._engine = None
+        self._error = None
+        self._open_lock = asyncio.Lock()
+
+    async def search(self, text: str, limit: int = MAX_CHOICES) -> list:
+        """Up to limit song names matching text, an empty list if the catalog can't be used."""
+        query = normalize_song(text if text else "")
+        if(not query):
+            return []
+        engine = await self._get_engine()
+        if(engine is None):
+            return []
+
+        self.searches += 1
+        async with engine.connect() as conn:
+            # A range on the key is served by its index, LIKE 'typed%' wouldn't be.
+            stmt = sa_future.select(songs.c.id, songs.c.title, songs.c.artist) \
+                .where(songs.c.search_key >= query) \
+                .where(songs.c.search_key < query + "\U0010ffff") \
+                .order_by(songs.c.search_key) \
+                .limit(limit)
+            rows = (await conn.execute(stmt)).all()
+
+            words = [word for word in query.split() if len(word) >= 3]
+            if(len(rows) < limit and words):
+                match = " ".join(f"\"{word}\"" for word in words)
+                matching_ids = sa.text("SELECT rowid FROM song_fts WHERE song_fts MATCH :match LIMIT :limit") \
+                    .bindparams(match=match, limit=limit + len(rows)) \
+                    .columns(sa.column("rowid"))
+                stmt = sa_future.select(songs.c.id, songs.c.title, songs.c.artist) \
+                    .where(songs.c.id.in_(matching_ids))
+                found = set(row.id for row in rows)
+                rows.extend(row for row in (await conn.execute(stmt)).all() if row.id not in found)
+
+        return [describe_song(row.title, row.artist) for row in rows[:limit]]
+
+    async def _get_engine(self) -> sa_async.AsyncEngine:
+        if(self._engine is not None or self._error is not None):
+            return self._engine
+
+        async with self._open_lock:
+            if(self._engine is None and self._error is None):
+                try:
+                    self._engine = await self._open()
+                except Exception as e:
+                    # Logged once, song options just go without suggestions from then on.
+                    self._error = e
+                    logging.error(f"Song catalog {self.path} can't be used, song options won't be autocompleted: {e}")
+        return self._engine
+
+    async def _open(self) -> sa_async.AsyncEngine:
+        if(not os.path.exists(self.path)):
+            raise CatalogError("File not found. Build one with import_catalog.py.")
+
+        engine = sa_async.create_async_engine(
+            f"sqlite+aiosqlite:///file:{os.path.abspath(self.path)}?mode=ro&uri=true",
+            future=True,
+            poolclass=sa_pool.AsyncAdaptedQueuePool,
+            pool_size=self.pool_size,
+            max_overflow=0
+        )
+
+        @sa.event.listens_for(engine.sync_engine, "connect")
+        def set_pragmas(dbapi_conn, conn_record) -> None:
+            cursor = dbapi_conn.cursor()
+            cursor.execute(f"PRAGMA mmap_size = {self.mmap_size_mb * 1024 * 1024:d}")
+            cursor.execute(f"PRAGMA cache_size = {-self.cache_size_mb * 1024:d}")
+            cursor.close()
+
+        try:
+            async with engine.connect() as conn:
+                version = (await conn.exec_driver_sql("PRAGMA user_version")).scalar_one()
+        except Exception:
+            await engine.dispose()
+            raise
+        if(version != CATALOG_VERSION):
+            await engine.dispose()
+            raise CatalogError(f"Catalog version {version} isn't {CATALOG_VERSION}. Import it again with import_catalog.py.")
+        return engine
+
+    async def close(self) -> None:
+        if(self._engine is not None):
+            await self._engine.dispose()
+            self._engine = None
@@ -0,0 +1,200 @@
+import logging
+import os.path
+
+from KaraokeQueueBotPolicies import POLICIES, POLICY_FIFO
+
+# Kept free of nextcord and SQLAlchemy imports so the config can be checked without loading them.
+
+SHARD_MODES = ["off", "guild", "fixed"]
+
+class KaraokeQueueBotConfigError(Exception):
+    pass
+
+class KaraokeQueueBotStorageConfig():
+    JOURNAL_MODES = ["delete", "truncate", "persist", "memory", "wal", "off"]
+    SYNCHRONOUS_MODES = ["off", "normal", "full", "extra"]
+    QUEUE_BACKENDS = ["sqlite", "journal"]
+
+    def __init__(self, journal_mode: str = "wal", synchronous: str = "normal", busy_timeout_ms: int = 5000, mmap_size_mb: int = 64, cache_size_mb: int = 8, pool_size: int = 5, group_commit_ms: int = 0, queue_backend: str = "sqlite", journal_dir: str = None, snapshot_every: int = 10000):
+        if(journal_mode.lower() not in self.JOURNAL_MODES):
+            raise KaraokeQueueBotConfigError(f"Unknown journal mode \"{journal_mode}\", expected one of {', '.join(self.JOURNAL_MODES)}.")
+        if(synchronous.lower() not in self.SYNCHRONOUS_MODES):
+            raise KaraokeQueueBotConfigError(f"Unknown synchronous mode \"{synchronous}\", expected one of {', '.join(self.SYNCHRONOUS_MODES)}.")
+        if(pool_size < 1):
+            raise KaraokeQueueBotConfigError("The connection pool needs at least one connection.")
+        if(queue_backend.lower() not in self.QUEUE_BACKENDS):
+            raise KaraokeQueueBotConfigError(f"Unknown queue backend \"{queue_backend}\", expected one of {', '.join(self.QUEUE_BACKENDS)}.")
+        if(queue_backend.lower() == "journal" and not journal_dir):
+            raise KaraokeQueueBotConfigError("The journal queue backend needs a journal_dir.")
+        if(snapshot_every < 1):
+            raise KaraokeQueueBotConfigError("snapshot_every has to be at least 1.")
+
+        self.journal_mode = journal_mode.lower()
+        self.synchronous = synchronous.lower()
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size_mb = mmap_size_mb
+        self.cache_size_mb = cache_size_mb
+        self.pool_size = pool_size
+        self.group_commit_ms = group_commit_ms
+        self.queue_backend = queue_backend.lower()
+        self.journal_dir = journal_dir
+        self.snapshot_every = snapshot_every
+
+    @classmethod
+    def from_yaml_data(cls, data: dict):
+        # Anything left out keeps its default, so older config files still load.
+        return cls(**(data or {}))
+
+class KaraokeQueueBotMetricsConfig():
+    def __init__(self, enabled: bool = False, host: str = "127.0.0.1", port: int = 9108, slow_command_ms: int = 500, loop_lag_interval_ms: int = 500):
+        if(not 0 < port < 65536):
+            raise KaraokeQueueBotConfigError(f"Invalid metrics port {port}.")
+        if(loop_lag_interval_ms <= 0):
+            raise KaraokeQueueBotConfigError("The event loop lag interval has to be positive.")
+
+        self.enabled = enabled
+        self.host = host
+        self.port = port
+        self.slow_command_ms = slow_command_ms
+        self.loop_lag_interval_ms = loop_lag_interval_ms
+
+    @classmethod
+    def from_yaml_data(cls, data: dict):
+        return cls(**(data or {}))
+
+class KaraokeQueueBotShardingConfig():
+    def __init__(self, mode: str = "off", shard_dir: str = None, shard_count: int = 16, max_open_shards: int = 64):
+        if(mode.lower() not in SHARD_MODES):
+            raise KaraokeQueueBotConfigError(f"Unknown sharding mode \"{mode}\", expected one of {', '.join(SHARD_MODES)}.")
+        if(mode.lower() != "off" and not shard_dir):
+            raise KaraokeQueueBotConfigError("Sharding needs a shard_dir to keep the shard files in.")
+        if(shard_count < 1):
+            raise KaraokeQueueBotConfigError("shard_count has to be at least 1.")
+        if(max_open_shards < 1):
+            raise KaraokeQueueBotConfigError("max_open_shards has to be at least 1.")
+
+        self.mode = mode.lower()
+        self.shard_dir = shard_dir
+        self.shard_count = shard_count
+        self.max_open_shards = max_open_shards
+
+    @classmethod
+    def from_yaml_data(cls, data: dict):
+        return cls(**(data or {}))
+
+class KaraokeQueueBotDispatchConfig():
+    def __init__(self, global_limit: int = 50, global_period_ms: int = 1000, channel_limit: int = 5, channel_period_ms: int = 5000, max_retries: int = 3, max_in_flight: int = 4):
+        if(global_limit < 1 or channel_limit < 1):
+            raise KaraokeQueueBotConfigError("Rate limits have to allow at least one request.")
+        if(global_period_ms <= 0 or channel_period_ms <= 0):
+            raise KaraokeQueueBotConfigError("Rate limit periods have to be positive.")
+        if(max_retries < 0):
+            raise KaraokeQueueBotConfigError("max_retries can't be negative.")
+        if(max_in_flight < 1):
+            raise KaraokeQueueBotConfigError("max_in_flight has to be at least 1.")
+
+        self.global_limit = global_limit
+        self.global_period_ms = global_period_ms
+        self.channel_limit = channel_limit
+        self.channel_period_ms = channel_period_ms
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+
+    @classmethod
+    def from_yaml_data(cls, data: dict):
+        return cls(**(data or {}))
+
+class KaraokeQueueBotConfig():
+    def __init__(self, log_path: str, db_path: str, log_level: int, guild_ids: list, cache_size_mb: int = 16, next_coalesce_ms: int = 0, storage: KaraokeQueueBotStorageConfig = None, metrics: KaraokeQueueBotMetricsConfig = None, sharding: KaraokeQueueBotShardingConfig = None, board_debounce_ms: int = 2000, dispatch: KaraokeQueueBotDispatchConfig = None, song_catalog_path: str = None, queue_policy: str = POLICY_FIFO, history_retention_days: int = 0, auto_advance_minutes: float = 0, idle_queue_expiry_hours: float = 0, requeue_cooldown_minutes: float = 0):
+        if(board_debounce_ms < 0):
+            raise KaraokeQueueBotConfigError("board_debounce_ms can't be negative.")
+        if(queue_policy.lower() not in POLICIES):
+            raise KaraokeQueueBotConfigError(f"Unknown queue policy \"{queue_policy}\", expected one of {', '.join(POLICIES)}.")
+        if(history_retention_days < 0):
+            raise KaraokeQueueBotConfigError("history_retention_days can't be negative.")
+        for name, value in (("auto_advance_minutes", auto_advance_minutes), ("idle_queue_expiry_hours", idle_queue_expiry_hours), ("requeue_cooldown_minutes", requeue_cooldown_minutes)):
+            if(value < 0):
+                raise KaraokeQueueBotConfigError(f"{name} can't be negative.")
+
+        self.log_path = log_path
+        self.db_path = db_path
+        self.log_level = log_level
+        self.guild_ids = guild_ids
+        self.cache_size_mb = cache_size_mb
+        self.next_coalesce_ms = next_coalesce_ms
+        self.storage = storage if storage else KaraokeQueueBotStorageConfig()
+        self.metrics = metrics if metrics else KaraokeQueueBotMetricsConfig()
+        self.sharding = sharding if sharding else KaraokeQueueBotShardingConfig()
+        self.board_debounce_ms = board_debounce_ms
+        self.dispatch = dispatch if dispatch else KaraokeQueueBotDispatchConfig()
+        self.song_catalog_path = song_catalog_path if song_catalog_path else None
+        self.queue_policy = queue_policy.lower()
+        self.history_retention_days = history_retention_days
+        self.auto_advance_minutes = auto_advance_minutes
+        self.idle_queue_expiry_hours = idle_queue_expiry_hours
+        self.requeue_cooldown_minutes = requeue_cooldown_minutes
+
+    @classmethod
+    def default(cls, base_dir: str, guild_ids = []):
+        return cls(
+            os.path.join(base_dir, "KaraokeQueueBot.log"),
+            os.path.join(base_dir, "KaraokeQueueBot_data.db"),
+            logging.INFO,
+            guild_ids
+        )
+
+    @classmethod
+    def from_yaml_data(cls, in_data: dict) -> None:
+        log_str_map = {
+            "critical": logging.CRITICAL,
+            "error": logging.ERROR,
+            "warning": logging.WARNING,
+            "info": logging.INFO,
+            "debug": logging.DEBUG
+        }
+
+        try:
+            data = in_data["config"]
+            
+            log_path = data["log_path"]
+            db_path = data["sqlite_database_path"]
+            
+            log_level = log_str_map.get(data["logging_level"].lower(), logging.INFO)
+
+            guild_ids = data["guild_ids"]
+        except KeyError as e:
+            raise KaraokeQueueBotConfigError(f"Missing setting {e.args[0]}.")
+        except (TypeError, AttributeError):
+            raise KaraokeQueueBotConfigError("Expected a \"config:\" section with the settings shown in sample_config.yaml.")
+
+        cache_size_mb = data.get("queue_cache_size_mb", 16)
+        next_coalesce_ms = data.get("next_coalesce_ms", 0)
+        board_debounce_ms = data.get("board_debounce_ms", 2000)
+        song_catalog_path = data.get("song_catalog_path")
+        queue_policy = data.get("queue_policy", POLICY_FIFO)
+        history_retention_days = data.get("history_retention_days", 0)
+        auto_advance_minutes = data.get("auto_advance_minutes", 0)
+        idle_queue_expiry_hours = data.get("idle_queue_expiry_hours", 0)
+        requeue_cooldown_minutes = data.get("requeue_cooldown_minutes", 0)
+
+        try:
+            storage = KaraokeQueueBotStorageConfig.from_yaml_data(data.get("storage"))
+        except TypeError as e:
+            raise KaraokeQueueBotConfigError(f"Invalid storage settings: {e}")
+
+        try:
+            metrics = KaraokeQueueBotMetricsConfig.from_yaml_data(data.get("metrics"))
+        except TypeError as e:
+            raise KaraokeQueueBotConfigError(f"Invalid metrics settings: {e}")
+
+        try:
+            sharding = KaraokeQueueBotShardingConfig.from_yaml_data(data.get("sharding"))
+        except TypeError as e:
+            raise KaraokeQueueBotConfigError(f"Invalid sharding settings: {e}")
+
+        try:
+            dispatch = KaraokeQueueBotDispatchConfig.from_yaml_data(data.get("dispatch"))
+        except TypeError as e:
+            raise KaraokeQueueBotConfigError(f"Invalid dispatch settings: {e}")
+
+        return cls(log_path, db_path, log_level, guild_ids, cache_size_mb, next_coalesce_ms, storage, metrics, sharding, board_debounce_ms, dispatch, song_catalog_path, queue_policy, history_retention_days, auto_advance_minutes, idle_queue_expiry_hours, requeue_cooldown_minutes)
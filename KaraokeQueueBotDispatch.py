@@ -0,0 +1,240 @@
+import asyncio
+import collections
+import logging
+import time
+
+import nextcord
+
+# Lanes in the order they're served. Ephemeral replies go before board edits since Discord
+# drops an interaction that isn't answered within 3 seconds, a board can always catch up.
+LANE_ANNOUNCE = 0
+LANE_CONFIRM = 1
+LANE_EDIT = 2
+LANE_COUNT = 3
+
+class TokenBucket():
+    """Allows limit requests per period seconds, in bursts of up to limit."""
+
+    def __init__(self, limit: int, period: float, clock = time.monotonic) -> None:
+        self.limit = limit
+        self.rate = limit / period
+        self.clock = clock
+        self.tokens = float(limit)
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def wait_time(self) -> float:
+        """Seconds until a request may be sent, 0 if one may be sent now."""
+        now = self.clock()
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, self.paused_until - now)
+        if(self.tokens < 1):
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Holds off every request for the next seconds, after Discord said to retry then."""
+        self.wait_time()
+        self.tokens = min(self.tokens, 0.0)
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+class OutboundRequest():
+    def __init__(self, lane: int, send, channel_id: int, merge_key) -> None:
+        self.lane = lane
+        self.send = send
+        self.channel_id = channel_id
+        self.merge_key = merge_key
+        self.future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+
+def get_retry_after(e: nextcord.HTTPException) -> tuple:
+    """(seconds, is_global) from a 429's headers, falling back on a second."""
+    headers = e.response.headers
+    try:
+        retry_after = float(headers.get("Retry-After", 1))
+    except ValueError:
+        retry_after = 1.0
+    return (retry_after, headers.get("X-RateLimit-Global", "").lower() == "true")
+
+class OutboundDispatcher():
+    """Sends the bot's messages to Discord in priority order, staying under its rate limits.
+
+    Requests for a channel's messages take a token from the global bucket and one from the
+    channel's. Interaction responses (no channel_id) take neither, Discord doesn't count them
+    against the global limit. At most max_in_flight requests per channel are handed to nextcord
+    at once: it sends each channel's requests through one bucket lock, one at a time, so
+    anything past that would just wait in its queue in arrival order. Interaction responses
+    aren't held back at all, each one answers a different interaction and has to be sent
+    within Discord's 3 seconds, so one guild's replies mustn't wait on another's. Requests
+    waiting for a token or a free slot wait in their lane and the first lane with a request
+    that may go is served first, so a board edit doesn't hold up a channel's announcement.
+
+    A request with the same merge_key as one still waiting replaces it, both callers get the
+    result of the one that's sent, and requests with the same merge_key are never in flight
+    together so they land in order. A 429 that nextcord hands back pauses the bucket it hit for
+    as long as Discord asked and the request is retried, up to max_retries times.
+    """
+
+    def __init__(self, global_limit: int = 50, global_period: float = 1.0, channel_limit: int = 5, channel_period: float = 5.0, max_retries: int = 3, max_in_flight: int = 4, max_channels: int = 1024) -> None:
+        self.global_bucket = TokenBucket(global_limit, global_period)
+        self.channel_limit = channel_limit
+        self.channel_period = channel_period
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+        self.max_channels = max_channels
+        self.channel_buckets = collections.OrderedDict()
+        # Interaction responses have no bucket of their own, but a 429 still holds them off.
+        self.interactions_paused_until = 0.0
+        self.lanes = [collections.deque() for lane in range(LANE_COUNT)]
+        self.sent = 0
+        self.merged = 0
+        self.rate_limited = 0
+        self._waiting = {}
+        self._in_flight = set()
+        # Requests being sent per channel, None counts interaction responses.
+        self._sending = collections.Counter()
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+
+    def queued(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    async def send(self, lane: int, send, channel_id: int = None, merge_key = None):
+        """Queues send(), which should make a single request, and returns what it returns."""
+        if(merge_key != None and merge_key in self._waiting):
+            request = self._waiting[merge_key]
+            request.send = send
+            self.merged += 1
+            return await asyncio.shield(request.future)
+
+        request = OutboundRequest(lane, send, channel_id, merge_key)
+        if(merge_key != None):
+            self._waiting[merge_key] = request
+        self.lanes[lane].append(request)
+        if(self._worker is None):
+            self._worker = asyncio.ensure_future(self._run())
+        self._wakeup.set()
+        return await asyncio.shield(request.future)
+
+    def _channel_bucket(self, channel_id: int) -> TokenBucket:
+        bucket = self.channel_buckets.get(channel_id)
+        if(bucket is None):
+            bucket = self.channel_buckets[channel_id] = TokenBucket(self.channel_limit, self.channel_period)
+            # A bucket that's been idle for a whole period is full again, nothing is lost.
+            while(len(self.channel_buckets) > self.max_channels):
+                self.channel_buckets.popitem(last=False)
+        self.channel_buckets.move_to_end(channel_id)
+        return bucket
+
+    def _next_request(self) -> tuple:
+        """(request, None) for the request to send now, or (None, seconds to wait)."""
+        global_wait = self.global_bucket.wait_time()
+        interaction_wait = max(0.0, self.interactions_paused_until - time.monotonic())
+        wait = None
+        for lane in self.lanes:
+            for i, request in enumerate(lane):
+                if(request.merge_key != None and request.merge_key in self._in_flight):
+                    continue
+                if(request.channel_id != None and self._sending[request.channel_id] >= self.max_in_flight):
+                    continue
+                if(request.channel_id is None):
+                    request_wait = interaction_wait
+                else:
+                    request_wait = max(global_wait, self._channel_bucket(request.channel_id).wait_time())
+                if(request_wait > 0):
+                    wait = request_wait if wait is None else min(wait, request_wait)
+                    continue
+                del lane[i]
+                return (request, None)
+        return (None, wait)
+
+    async def _run(self) -> None:
+        while(True):
+            self._wakeup.clear()
+            request, wait = self._next_request()
+            if(request is None):
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if(request.channel_id != None):
+                self.global_bucket.take()
+                self._channel_bucket(request.channel_id).take()
+            if(request.merge_key != None):
+                del self._waiting[request.merge_key]
+                self._in_flight.add(request.merge_key)
+            self._sending[request.channel_id] += 1
+            task = asyncio.ensure_future(self._send(request))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, request: OutboundRequest) -> None:
+        try:
+            result = await request.send()
+        except nextcord.HTTPException as e:
+            if(e.status == 429 and request.attempts < self.max_retries):
+                self._retry_later(request, e)
+            else:
+                request.future.set_exception(e)
+        except Exception as e:
+            request.future.set_exception(e)
+        else:
+            self.sent += 1
+            request.future.set_result(result)
+        finally:
+            self._in_flight.discard(request.merge_key)
+            self._sending[request.channel_id] -= 1
+            if(not self._sending[request.channel_id]):
+                del self._sending[request.channel_id]
+            self._wakeup.set()
+
+    def _retry_later(self, request: OutboundRequest, e: nextcord.HTTPException) -> None:
+        self.rate_limited += 1
+        request.attempts += 1
+        retry_after, is_global = get_retry_after(e)
+        if(request.channel_id is None):
+            self.interactions_paused_until = max(self.interactions_paused_until, time.monotonic() + retry_after)
+        elif(is_global):
+            self.global_bucket.pause(retry_after)
+        else:
+            self._channel_bucket(request.channel_id).pause(retry_after)
+        if(request.channel_id is None):
+            scope = "interactions"
+        else:
+            scope = "global" if is_global else f"channel {request.channel_id}"
+        logging.warning(f"Rate limited, retrying in {retry_after:.2f}s ({scope}).")
+
+        newer = self._waiting.get(request.merge_key) if request.merge_key != None else None
+        if(newer is not None):
+            # Something newer is already waiting to replace what this would have sent.
+            newer.future.add_done_callback(lambda future: self._copy_result(future, request.future))
+            return
+        if(request.merge_key != None):
+            self._waiting[request.merge_key] = request
+        self.lanes[request.lane].appendleft(request)
+
+    def _copy_result(self, source: asyncio.Future, target: asyncio.Future) -> None:
+        if(source.cancelled()):
+            target.cancel()
+        elif(source.exception() != None):
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+    async def close(self) -> None:
+        if(self._worker is not None):
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+        # Let whatever was already sent finish, anything still queued is dropped.
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for lane in self.lanes:
+            for request in lane:
+                request.future.cancel()
+            lane.clear()
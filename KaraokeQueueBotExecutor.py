@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import contextvars
+import logging
+
+def run_in_context(context: contextvars.Context, job) -> asyncio.Task:
+    # Tasks copy the context that's current when they're created.
+    return context.run(asyncio.ensure_future, job())
+
+class GuildExecutor():
+    """Runs jobs one at a time per guild, in the order they were submitted.
+
+    Each guild with pending work gets a worker task that drains its mailbox and exits once
+    the mailbox is empty, so jobs for different guilds still run concurrently. A job is an
+    async callable taking no arguments; its return value (or exception) is handed back to
+    whoever submitted it. Jobs run in a copy of their submitter's context variables.
+
+    A "guild" here is any hashable key; queue work is keyed by (guild_id, room_id) so rooms
+    in one guild don't wait on each other. run_exclusive() runs a job on a guild's own key
+    with none of its rooms' jobs running alongside.
+    """
+
+    def __init__(self) -> None:
+        self._mailboxes = collections.defaultdict(collections.deque)
+        self._workers = {}
+        self._coalesced = {}
+        # Guilds with an exclusive job running or waiting to run, mapped to a future that's
+        # done once it has finished. Their rooms' workers hold off until then.
+        self._gates = {}
+        # Jobs of each guild's rooms that are running right now, and a future for the
+        # exclusive job waiting for them to finish.
+        self._room_jobs = collections.Counter()
+        self._idle = {}
+
+    def pending(self, guild_id: int) -> int:
+        return len(self._mailboxes.get(guild_id, ()))
+
+    async def run(self, guild_id: int, job):
+        return await self._enqueue(guild_id, job)
+
+    async def run_exclusive(self, guild_id: int, job):
+        """Like run, but also waits for the jobs of the guild's rooms that are already running,
+        and holds off any others until job is done."""
+        async def exclusive_job():
+            loop = asyncio.get_running_loop()
+            gate = self._gates[guild_id] = loop.create_future()
+            try:
+                if(self._room_jobs[guild_id]):
+                    self._idle[guild_id] = loop.create_future()
+                    await self._idle[guild_id]
+                return await job()
+            finally:
+                del self._gates[guild_id]
+                gate.set_result(None)
+
+        return await self._enqueue(guild_id, exclusive_job)
+
+    async def run_coalesced(self, guild_id: int, key: str, window: float, job) -> tuple:
+        """Runs job unless another job with the same key was submitted for this guild less than
+        window seconds ago, in which case that job's result is shared instead.
+
+        Returns (result, coalesced).
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        previous = self._coalesced.get((guild_id, key))
+        if(previous is not None and now - previous[0] < window):
+            return (await asyncio.shield(previous[1]), True)
+
+        future = self._enqueue(guild_id, job)
+        self._coalesced[(guild_id, key)] = (now, future)
+        future.add_done_callback(lambda _: loop.call_later(window, self._expire_coalesced, guild_id, key, future))
+        return (await future, False)
+
+    def _expire_coalesced(self, guild_id: int, key: str, future: asyncio.Future) -> None:
+        previous = self._coalesced.get((guild_id, key))
+        if(previous is not None and previous[1] is future):
+            del self._coalesced[(guild_id, key)]
+
+    def _enqueue(self, guild_id: int, job) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._mailboxes[guild_id].append((job, future, contextvars.copy_context()))
+
+        if(guild_id not in self._workers):
+            self._workers[guild_id] = asyncio.create_task(self._drain(guild_id))
+        return future
+
+    def _finish_room_job(self, guild_id: int) -> None:
+        self._room_jobs[guild_id] -= 1
+        if(self._room_jobs[guild_id]):
+            return
+        del self._room_jobs[guild_id]
+        idle = self._idle.pop(guild_id, None)
+        if(idle is not None and not idle.done()):
+            idle.set_result(None)
+
+    async def _drain(self, guild_id: int) -> None:
+        mailbox = self._mailboxes[guild_id]
+        # Room keys are (guild_id, room_id), see run_exclusive.
+        parent = guild_id[0] if isinstance(guild_id, tuple) else None
+        try:
+            while(mailbox):
+                gate = self._gates.get(parent) if parent != None else None
+                if(gate is not None):
+                    await asyncio.shield(gate)
+                    continue
+
+                job, future, context = mailbox.popleft()
+                if(future.cancelled()):
+                    continue
+
+                if(parent != None):
+                    self._room_jobs[parent] += 1
+                try:
+                    result = await run_in_context(context, job)
+                except Exception as e:
+                    if(not future.cancelled()):
+                        future.set_exception(e)
+                else:
+                    if(not future.cancelled()):
+                        future.set_result(result)
+                finally:
+                    if(parent != None):
+                        self._finish_room_job(parent)
+        except asyncio.CancelledError:
+            logging.warning(f"Executor for guild {guild_id} cancelled with {len(mailbox)} jobs pending.")
+            for job, future, context in mailbox:
+                future.cancel()
+            mailbox.clear()
+            raise
+        finally:
+            del self._workers[guild_id]
+            if(not mailbox):
+                self._mailboxes.pop(guild_id, None)
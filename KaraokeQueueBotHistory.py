@@ -0,0 +1,185 @@
+import asyncio
+import collections
+import logging
+
+import sqlalchemy as sa
+import sqlalchemy.dialects.sqlite as sa_sqlite
+import sqlalchemy.ext.asyncio as sa_async
+import sqlalchemy.future as sa_future
+
+from KaraokeQueueBotObjects import PerformanceEntry, SingerStatsEntry, SongStatsEntry, GuildStatsEntry
+from KaraokeQueueBotCatalog import normalize_song
+
+# Old performances deleted per write at most, so catching up on a long backlog doesn't hold
+# the write lock for long.
+COMPACT_BATCH_ROWS = 1000
+# Seconds a finished turn waits before it's written, so the turns of a guild with several rooms
+# going at once share a write instead of each taking the write lock between the rooms' /next.
+WRITE_DELAY_S = 0.5
+
+class GuildStats():
+    """What /stats shows for a guild, read from the summary tables."""
+
+    def __init__(self, guild: GuildStatsEntry, top_songs: list, top_singers: list) -> None:
+        self.performances = guild.performances if guild != None else 0
+        self.average_seconds = guild.total_seconds / guild.timed_performances if guild != None and guild.timed_performances else None
+        # (song_name, performances) and (user_id, performances), most performed first.
+        self.top_songs = top_songs
+        self.top_singers = top_singers
+
+class SingerStats():
+    def __init__(self, singer: SingerStatsEntry) -> None:
+        self.performances = singer.performances if singer != None else 0
+        self.average_seconds = singer.total_seconds / singer.timed_performances if singer != None and singer.timed_performances else None
+
+class PerformanceHistory():
+    """Records every finished turn and keeps per singer, per song and per guild totals.
+
+    Performances are written after /next has answered, in the background, and the totals are
+    updated in the same transaction, so /stats only ever reads a handful of summary rows no
+    matter how long the history is. A guild's performances are written write_delay seconds
+    after the first of them is recorded, together with any recorded in the meantime or while
+    the last batch was being written. A batch costs the same handful of statements however
+    many performances it holds.
+
+    write(guild_id, op) runs op(session) in a write transaction on the guild's shard. With
+    retention_days set, each write also deletes up to COMPACT_BATCH_ROWS of the guild's
+    performances that ended longer ago than that. The totals keep counting them.
+    """
+
+    def __init__(self, write, retention_days: int = 0, write_delay: float = WRITE_DELAY_S) -> None:
+        self.write = write
+        self.retention_seconds = retention_days * 24 * 60 * 60
+        self.write_delay = write_delay
+        self.recorded = 0
+        self.compacted = 0
+        self._pending = collections.defaultdict(list)
+        self._writing = {}
+        # Set while flush() is waiting, so nothing is held back.
+        self._flushing = asyncio.Event()
+
+    def record(self, guild_id: int, user_id: int, song_name: str, started_at: float, ended_at: float) -> None:
+        self._pending[guild_id].append({
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "song_name": song_name,
+            "started_at": started_at,
+            "ended_at": ended_at
+        })
+        if(guild_id not in self._writing):
+            self._writing[guild_id] = asyncio.ensure_future(self._write_pending(guild_id))
+
+    async def _write_pending(self, guild_id: int) -> None:
+        try:
+            try:
+                await asyncio.wait_for(self._flushing.wait(), self.write_delay)
+            except asyncio.TimeoutError:
+                pass
+            while(guild_id in self._pending):
+                rows = self._pending.pop(guild_id)
+                try:
+                    await self.write(guild_id, lambda session: self.write_performances(session, guild_id, rows))
+                except Exception:
+                    logging.exception(f"Failed to record {len(rows)} performances in guild {guild_id}.")
+                    continue
+                self.recorded += len(rows)
+        finally:
+            del self._writing[guild_id]
+
+    async def write_performances(self, session: sa_async.AsyncSession, guild_id: int, rows: list) -> None:
+        """Appends rows to the history and adds them to the totals."""
+        singers = collections.defaultdict(lambda: [0, 0, 0.0])
+        songs = {}
+        for row in rows:
+            totals = singers[row["user_id"]]
+            totals[0] += 1
+            if(row["started_at"] != None and row["ended_at"] >= row["started_at"]):
+                totals[1] += 1
+                totals[2] += row["ended_at"] - row["started_at"]
+            song_key = normalize_song(row["song_name"]) if row["song_name"] else ""
+            if(song_key):
+                song_name, count = songs.get(song_key, (None, 0))
+                songs[song_key] = (row["song_name"], count + 1)
+
+        await session.execute(sa.insert(PerformanceEntry), rows)
+
+        # Each table's totals are added to in one executemany, whatever the size of the batch.
+        stmt = sa_sqlite.insert(SingerStatsEntry)
+        stmt = stmt.on_conflict_do_update(index_elements=[SingerStatsEntry.guild_id, SingerStatsEntry.user_id], set_={
+            "performances": SingerStatsEntry.performances + stmt.excluded.performances,
+            "timed_performances": SingerStatsEntry.timed_performances + stmt.excluded.timed_performances,
+            "total_seconds": SingerStatsEntry.total_seconds + stmt.excluded.total_seconds
+        })
+        await session.execute(stmt, [
+            {"guild_id": guild_id, "user_id": user_id, "performances": performances, "timed_performances": timed_performances, "total_seconds": total_seconds}
+            for user_id, (performances, timed_performances, total_seconds) in singers.items()
+        ])
+
+        if(songs):
+            stmt = sa_sqlite.insert(SongStatsEntry)
+            stmt = stmt.on_conflict_do_update(index_elements=[SongStatsEntry.guild_id, SongStatsEntry.song_key], set_={
+                "song_name": stmt.excluded.song_name,
+                "performances": SongStatsEntry.performances + stmt.excluded.performances
+            })
+            await session.execute(stmt, [
+                {"guild_id": guild_id, "song_key": song_key, "song_name": song_name, "performances": performances}
+                for song_key, (song_name, performances) in songs.items()
+            ])
+
+        performances = sum(totals[0] for totals in singers.values())
+        timed_performances = sum(totals[1] for totals in singers.values())
+        total_seconds = sum(totals[2] for totals in singers.values())
+        stmt = sa_sqlite.insert(GuildStatsEntry) \
+            .values(guild_id=guild_id, performances=performances, timed_performances=timed_performances, total_seconds=total_seconds) \
+            .on_conflict_do_update(index_elements=[GuildStatsEntry.guild_id], set_={
+                "performances": GuildStatsEntry.performances + performances,
+                "timed_performances": GuildStatsEntry.timed_performances + timed_performances,
+                "total_seconds": GuildStatsEntry.total_seconds + total_seconds
+            })
+        await session.execute(stmt)
+
+        if(self.retention_seconds > 0):
+            await self.compact(session, guild_id, max(row["ended_at"] for row in rows) - self.retention_seconds)
+
+    async def compact(self, session: sa_async.AsyncSession, guild_id: int, before: float) -> int:
+        """Deletes up to COMPACT_BATCH_ROWS of the guild's performances that ended before before."""
+        old_ids = sa_future.select(PerformanceEntry.id) \
+            .where(PerformanceEntry.guild_id == guild_id) \
+            .where(PerformanceEntry.ended_at < before) \
+            .limit(COMPACT_BATCH_ROWS) \
+            .scalar_subquery()
+        stmt = sa.delete(PerformanceEntry) \
+            .where(PerformanceEntry.id.in_(old_ids)) \
+            .execution_options(synchronize_session=False)
+        deleted = (await session.execute(stmt)).rowcount
+        self.compacted += deleted
+        return deleted
+
+    async def get_guild_stats(self, session: sa_async.AsyncSession, guild_id: int, top: int) -> GuildStats:
+        guild = await session.get(GuildStatsEntry, guild_id)
+        stmt = sa_future.select(SongStatsEntry.song_name, SongStatsEntry.performances) \
+            .where(SongStatsEntry.guild_id == guild_id) \
+            .order_by(SongStatsEntry.performances.desc()) \
+            .limit(top)
+        top_songs = (await session.execute(stmt)).all()
+        stmt = sa_future.select(SingerStatsEntry.user_id, SingerStatsEntry.performances) \
+            .where(SingerStatsEntry.guild_id == guild_id) \
+            .order_by(SingerStatsEntry.performances.desc()) \
+            .limit(top)
+        top_singers = (await session.execute(stmt)).all()
+        return GuildStats(guild, top_songs, top_singers)
+
+    async def get_singer_stats(self, session: sa_async.AsyncSession, guild_id: int, user_id: int) -> SingerStats:
+        return SingerStats(await session.get(SingerStatsEntry, (guild_id, user_id)))
+
+    async def flush(self) -> None:
+        """Writes everything recorded so far right away, and waits until it's written."""
+        self._flushing.set()
+        try:
+            while(self._writing):
+                await asyncio.gather(*self._writing.values(), return_exceptions=True)
+        finally:
+            self._flushing.clear()
+
+    async def close(self) -> None:
+        await self.flush()
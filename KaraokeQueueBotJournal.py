@@ -0,0 +1,658 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import os.path
+import time
+import zlib
+
+from KaraokeQueueBotObjects import MAIN_ROOM_ID, QUEUE_KEY_GAP
+from KaraokeQueueBotCache import CachedQueueEntry, GuildQueueState
+from KaraokeQueueBotPolicies import POLICY_FIFO
+
+SNAPSHOT_NAME = "snapshot.json"
+SEGMENT_PATTERN = "journal-*.log"
+
+class JournalError(Exception):
+    pass
+
+class JournalEntry():
+    # Same attributes as a QueueEntry row, so the rest of the bot can't tell them apart.
+    __slots__ = ("id", "guild_id", "room_id", "user_id", "song_name", "sort_key", "requeue", "eligible_at")
+
+    def __init__(self, id: int, guild_id: int, user_id: int, song_name: str, sort_key: int, requeue: bool, room_id: int = MAIN_ROOM_ID, eligible_at: float = None) -> None:
+        self.id = id
+        self.guild_id = guild_id
+        self.room_id = room_id
+        self.user_id = user_id
+        self.song_name = song_name
+        self.sort_key = sort_key
+        self.requeue = requeue
+        self.eligible_at = eligible_at
+
+def with_changes(elem, **changes) -> JournalEntry:
+    fields = {name: getattr(elem, name) for name in JournalEntry.__slots__}
+    fields.update(changes)
+    return JournalEntry(**fields)
+
+def encode_room(guild_id: int, room_id: int):
+    # How events name the queue they change: just the guild for its main queue, which is all
+    # records from before rooms ever name, [guild_id, room_id] for the others.
+    return guild_id if room_id == MAIN_ROOM_ID else [guild_id, room_id]
+
+def decode_room(room) -> tuple:
+    return (room, MAIN_ROOM_ID) if isinstance(room, int) else (room[0], room[1])
+
+def encode_record(record: dict) -> bytes:
+    payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+def decode_record(line: bytes) -> dict:
+    # Returns None for anything that isn't a whole, intact record.
+    if(not line.endswith(b"\n") or len(line) < 10 or line[8:9] != b" "):
+        return None
+    payload = line[9:-1]
+    try:
+        if(int(line[:8], 16) != zlib.crc32(payload)):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+def fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class JournalTransaction():
+    """What one write() did: the events to append and how to take them back."""
+
+    def __init__(self) -> None:
+        self.events = []
+        self.undo = []
+
+    def rollback(self) -> None:
+        for undo in reversed(self.undo):
+            undo()
+        self.events.clear()
+        self.undo.clear()
+
+class JournalQueueStore():
+    """Queues kept in memory and made durable by an append-only journal.
+
+    Every write() appends one checksummed line holding all of its events and fsyncs it before
+    returning, so a mutation costs one sequential append. Appends that arrive while an fsync is
+    in progress are written together by the next one. Every snapshot_every records the whole
+    state is written to a snapshot and the journal starts a new segment; older segments are
+    deleted once the snapshot is on disk. Recovery loads the snapshot and replays the records
+    after it, so startup never replays more than about snapshot_every records. Recovery runs on
+    a worker thread the first time the store is opened.
+
+    Every room of every guild is held in memory, keyed by (guild_id, room_id), there's no
+    cache to miss.
+    """
+
+    def __init__(self, journal_dir: str, snapshot_every: int = 10000, default_policy: str = POLICY_FIFO, requeue_cooldown: float = 0, clock = time.time) -> None:
+        self.journal_dir = journal_dir
+        self.snapshot_every = snapshot_every
+        self.default_policy = default_policy
+        self.requeue_cooldown = requeue_cooldown
+        self.clock = clock
+        self.states = {}
+        # Policies rooms have chosen, the rest follow default_policy.
+        self.policies = {}
+        self.next_id = 1
+        self.seq = 0
+        self.appends = 0
+        self.batches = 0
+        self.snapshots = 0
+        self.replayed = 0
+        self._records_since_snapshot = 0
+        self._fd = None
+        self._segment_size = 0
+        self._pending = []
+        self._flush_task = None
+        self._snapshot_task = None
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._writes_open = asyncio.Event()
+        self._writes_open.set()
+        self._ready = False
+        self._opening = None
+
+    def _segment_path(self, first_seq: int) -> str:
+        return os.path.join(self.journal_dir, f"journal-{first_seq:020d}.log")
+
+    def _segments(self) -> list:
+        return sorted(glob.glob(os.path.join(self.journal_dir, SEGMENT_PATTERN)))
+
+    async def open(self) -> None:
+        if(self._opening is None):
+            self._opening = asyncio.get_running_loop().run_in_executor(None, self._recover)
+        await asyncio.shield(self._opening)
+
+    def _recover(self) -> None:
+        os.makedirs(self.journal_dir, exist_ok=True)
+        snapshot_path = os.path.join(self.journal_dir, SNAPSHOT_NAME)
+        if(os.path.exists(snapshot_path)):
+            with open(snapshot_path, "rb") as f:
+                snapshot = json.load(f)
+            self.seq = snapshot["seq"]
+            self.next_id = snapshot["next_id"]
+            for guild in snapshot["guilds"]:
+                # Older snapshots leave out the fields added since.
+                guild_id, current_id, entries = guild[:3]
+                policy, singers = guild[3:5] if len(guild) > 3 else (None, [])
+                current_since = guild[5] if len(guild) > 5 else None
+                room_id = guild[6] if len(guild) > 6 else MAIN_ROOM_ID
+                if(policy != None):
+                    self.policies[(guild_id, room_id)] = policy
+                self.states[(guild_id, room_id)] = GuildQueueState(
+                    guild_id,
+                    [JournalEntry(elem[0], guild_id, *elem[1:5], room_id=room_id, eligible_at=elem[5] if len(elem) > 5 else None) for elem in entries],
+                    current_id,
+                    self.policies.get((guild_id, room_id), self.default_policy),
+                    singers,
+                    current_since,
+                    room_id
+                )
+
+        segments = self._segments()
+        for i, path in enumerate(segments):
+            with open(path, "rb") as f:
+                data = f.read()
+
+            offset = 0
+            for line in data.splitlines(keepends=True):
+                record = decode_record(line)
+                if(record is None):
+                    if(i != len(segments) - 1 or offset + len(line) != len(data)):
+                        raise JournalError(f"Corrupt record at byte {offset} of {path}.")
+                    # A write that was cut short by a crash, it was never acknowledged.
+                    logging.warning(f"Dropping torn record at the end of {path}.")
+                    os.truncate(path, offset)
+                    break
+
+                offset += len(line)
+                if(record["seq"] <= self.seq):
+                    continue
+                self._apply(record["events"])
+                self.seq = record["seq"]
+                self.replayed += 1
+
+        self._records_since_snapshot = self.replayed
+        path = segments[-1] if segments else self._segment_path(self.seq + 1)
+        self._open_segment(path)
+        self._ready = True
+        logging.info(f"Recovered {len(self.states)} rooms from {self.journal_dir}, replayed {self.replayed} records.")
+
+    def _open_segment(self, path: str) -> None:
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment_size = os.fstat(self._fd).st_size
+        fsync_dir(self.journal_dir)
+
+    def _apply(self, events: list) -> None:
+        for event in events:
+            key = decode_room(event[1])
+            state = self._state(*key)
+            if(event[0] == "put"):
+                elem = JournalEntry(event[2], key[0], *event[3:7], room_id=key[1], eligible_at=event[7] if len(event) > 7 else None)
+                state.put(elem)
+                self.next_id = max(self.next_id, elem.id + 1)
+            elif(event[0] == "del"):
+                state.remove(event[2])
+            elif(event[0] == "cur"):
+                state.set_current(event[2], event[3] if len(event) > 3 else None)
+            elif(event[0] == "clr"):
+                state.clear()
+            elif(event[0] == "pol"):
+                self.policies[key] = event[2]
+                state.set_policy(event[2])
+            elif(event[0] == "turn"):
+                state.set_turns(event[2], event[3])
+            elif(event[0] == "wgt"):
+                state.set_weight(event[2], event[3])
+            else:
+                raise JournalError(f"Unknown journal event {event[0]!r}.")
+
+    def _state(self, guild_id: int, room_id: int) -> GuildQueueState:
+        key = (guild_id, room_id)
+        state = self.states.get(key)
+        if(state is None):
+            state = self.states[key] = GuildQueueState(guild_id, [], None, self.policies.get(key, self.default_policy), room_id=room_id)
+        return state
+
+    async def write(self, guild_id: int, op):
+        if(not self._ready):
+            await self.open()
+        await self._writes_open.wait()
+        self._active += 1
+        self._idle.clear()
+        txn = JournalTransaction()
+        try:
+            try:
+                result = await op(txn)
+            except BaseException:
+                txn.rollback()
+                raise
+
+            if(txn.events):
+                self.seq += 1
+                try:
+                    await self._append(encode_record({"seq": self.seq, "events": txn.events}))
+                except Exception:
+                    txn.rollback()
+                    raise
+                self._records_since_snapshot += 1
+            return result
+        finally:
+            self._active -= 1
+            if(self._active == 0):
+                self._idle.set()
+            if(self._records_since_snapshot >= self.snapshot_every and self._snapshot_task is None):
+                self._snapshot_task = asyncio.create_task(self._snapshot_later())
+
+    async def _append(self, line: bytes) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((line, future))
+        if(self._flush_task is None):
+            self._flush_task = asyncio.create_task(self._flush())
+        await future
+
+    async def _flush(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while(self._pending):
+                batch, self._pending = self._pending, []
+                data = b"".join(line for line, future in batch)
+                try:
+                    await loop.run_in_executor(None, self._write_batch, data)
+                except Exception as e:
+                    logging.exception(f"Failed to append {len(batch)} records to the queue journal.")
+                    for line, future in batch:
+                        future.set_exception(e)
+                    continue
+
+                self.appends += len(batch)
+                self.batches += 1
+                for line, future in batch:
+                    future.set_result(None)
+        finally:
+            self._flush_task = None
+
+    def _write_batch(self, data: bytes) -> None:
+        try:
+            written = 0
+            while(written < len(data)):
+                written += os.write(self._fd, data[written:])
+            os.fsync(self._fd)
+        except OSError:
+            # Don't leave half a batch behind for recovery to replay.
+            os.ftruncate(self._fd, self._segment_size)
+            raise
+        self._segment_size += len(data)
+
+    async def _snapshot_later(self) -> None:
+        try:
+            await self.snapshot()
+        except Exception:
+            logging.exception("Failed to snapshot the queue journal.")
+        finally:
+            self._snapshot_task = None
+
+    async def snapshot(self) -> None:
+        # Writes are held back only while the state is copied, not while it's written out.
+        self._writes_open.clear()
+        try:
+            while(self._active):
+                await self._idle.wait()
+            snapshot = self._snapshot_data()
+            segment_path = self._segment_path(self.seq + 1)
+            old_segments = [path for path in self._segments() if path != segment_path]
+            if(old_segments):
+                os.close(self._fd)
+                self._open_segment(segment_path)
+            self._records_since_snapshot = 0
+        finally:
+            self._writes_open.set()
+
+        await asyncio.get_running_loop().run_in_executor(None, self._write_snapshot, snapshot, old_segments)
+        self.snapshots += 1
+
+    def _snapshot_data(self) -> dict:
+        guilds = []
+        for key, state in self.states.items():
+            if(state.entries or state.current_id != None or state.turns or state.weights or key in self.policies):
+                entries = [[elem.id, elem.user_id, elem.song_name, elem.sort_key, elem.requeue, elem.eligible_at] for elem in state.entries.values()]
+                singers = [[user_id, state.get_turns(user_id), state.get_weight(user_id)] for user_id in state.turns.keys() | state.weights.keys()]
+                guilds.append([state.guild_id, state.current_id, entries, self.policies.get(key), singers, state.current_since, state.room_id])
+        return {"seq": self.seq, "next_id": self.next_id, "guilds": guilds}
+
+    def _write_snapshot(self, snapshot: dict, old_segments: list) -> None:
+        path = os.path.join(self.journal_dir, SNAPSHOT_NAME)
+        with open(path + ".tmp", "wb") as f:
+            f.write(json.dumps(snapshot, separators=(",", ":")).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        fsync_dir(self.journal_dir)
+        # Everything in these is covered by the snapshot now.
+        for segment in old_segments:
+            os.remove(segment)
+
+    async def close(self) -> None:
+        if(not self._ready):
+            return
+        if(self._snapshot_task is not None):
+            await self._snapshot_task
+        if(self._records_since_snapshot):
+            await self.snapshot()
+        if(self._fd is not None):
+            os.close(self._fd)
+            self._fd = None
+
+    async def get_room_ids(self, guild_id: int) -> list:
+        if(not self._ready):
+            await self.open()
+        return [key[1] for key, state in self.states.items() if key[0] == guild_id and state.entries]
+
+    async def export_guild(self, guild_id: int, batch_rows: int):
+        if(not self._ready):
+            await self.open()
+
+        # Entries are replaced rather than changed, so holding on to the ones there are now is
+        # enough to keep writes that land between batches out of the export.
+        rooms, singers, queues = [], [], []
+        for key, state in self.states.items():
+            if(key[0] != guild_id):
+                continue
+            current_elem = state.get_current()
+            if(current_elem != None or key in self.policies):
+                rooms.append(["room", key[1], current_elem.user_id if current_elem != None else None, self.policies.get(key), state.current_since])
+            for user_id in state.turns.keys() | state.weights.keys():
+                singers.append(["singer", key[1], user_id, state.get_turns(user_id), state.get_weight(user_id)])
+            if(state.entries):
+                queues.append((key[1], sorted(state.entries.values(), key=lambda elem: elem.sort_key)))
+
+        for records in (rooms, singers):
+            for i in range(0, len(records), batch_rows):
+                yield records[i:i + batch_rows]
+        for room_id, entries in queues:
+            for i in range(0, len(entries), batch_rows):
+                yield [["queue", room_id, elem.user_id, elem.song_name, elem.sort_key, elem.requeue, elem.eligible_at] for elem in entries[i:i + batch_rows]]
+
+    async def import_guild(self, txn: JournalTransaction, guild_id: int, batches) -> list:
+        room_ids = set()
+        for key, state in list(self.states.items()):
+            if(key[0] == guild_id and (state.entries or state.current_id != None or state.turns)):
+                self._clear(txn, state)
+                room_ids.add(key[1])
+
+        rooms = []
+        for batch in batches:
+            for record in batch:
+                state = self._state(guild_id, record[1])
+                room_ids.add(record[1])
+                if(record[0] == "room"):
+                    rooms.append(record)
+                elif(record[0] == "singer"):
+                    self._set_turns(txn, state, record[2], record[3])
+                    await self.set_weight(txn, guild_id, record[1], record[2], record[4])
+                elif(record[0] == "queue"):
+                    elem = self._new_entry(guild_id, record[1], record[2], record[3], record[4], record[5])
+                    elem.eligible_at = record[6]
+                    self._put(txn, state, elem)
+
+        # Current singers are pointed at by user, so only once every entry is in.
+        for _, room_id, user_id, policy, since in rooms:
+            state = self._state(guild_id, room_id)
+            if(policy != None or (guild_id, room_id) in self.policies):
+                await self.set_policy(txn, guild_id, room_id, policy if policy != None else self.default_policy)
+            if(user_id != None and user_id in state.user_ids):
+                self._set_current(txn, state, self._get_elem(state, user_id), since)
+        return sorted(room_ids)
+
+    async def get_state(self, guild_id: int, room_id: int) -> GuildQueueState:
+        if(not self._ready):
+            await self.open()
+        return self._state(guild_id, room_id)
+
+    async def load_state(self, guild_id: int, room_id: int) -> GuildQueueState:
+        return await self.get_state(guild_id, room_id)
+
+    def _put(self, txn: JournalTransaction, state: GuildQueueState, elem: JournalEntry) -> JournalEntry:
+        previous = state.entries.get(elem.id)
+        state.put(elem)
+        event = ["put", encode_room(state.guild_id, state.room_id), elem.id, elem.user_id, elem.song_name, elem.sort_key, elem.requeue]
+        if(elem.eligible_at != None):
+            event.append(elem.eligible_at)
+        txn.events.append(event)
+        txn.undo.append(lambda: state.put(previous) if previous is not None else state.remove(elem.id))
+        return state.entries[elem.id]
+
+    def _remove(self, txn: JournalTransaction, state: GuildQueueState, elem_id: int) -> None:
+        previous = state.entries[elem_id]
+        was_current, previous_since = state.current_id == elem_id, state.current_since
+        state.remove(elem_id)
+        txn.events.append(["del", encode_room(state.guild_id, state.room_id), elem_id])
+
+        def undo() -> None:
+            state.put(previous)
+            if(was_current):
+                state.set_current(elem_id, previous_since)
+        txn.undo.append(undo)
+
+    def _set_current(self, txn: JournalTransaction, state: GuildQueueState, elem, since: float = None) -> None:
+        # since defaults to now.
+        previous, previous_since = state.current_id, state.current_since
+        if(elem != None and since is None):
+            since = self.clock()
+        state.set_current(elem.id if elem != None else None, since if elem != None else None)
+        txn.events.append(["cur", encode_room(state.guild_id, state.room_id), state.current_id, state.current_since])
+        txn.undo.append(lambda: state.set_current(previous, previous_since))
+
+    def _clear(self, txn: JournalTransaction, state: GuildQueueState) -> None:
+        previous, previous_current, previous_since = list(state.entries.values()), state.current_id, state.current_since
+        previous_turns = dict(state.turns)
+        state.clear()
+        txn.events.append(["clr", encode_room(state.guild_id, state.room_id)])
+
+        def undo() -> None:
+            for user_id, turns in previous_turns.items():
+                state.set_turns(user_id, turns)
+            for elem in previous:
+                state.put(elem)
+            state.set_current(previous_current, previous_since)
+        txn.undo.append(undo)
+
+    def _set_turns(self, txn: JournalTransaction, state: GuildQueueState, user_id: int, turns: int) -> None:
+        # Absolute counts rather than increments, so a record replayed twice does no harm.
+        previous = state.get_turns(user_id)
+        state.set_turns(user_id, turns)
+        txn.events.append(["turn", encode_room(state.guild_id, state.room_id), user_id, turns])
+        txn.undo.append(lambda: state.set_turns(user_id, previous))
+
+    def _new_entry(self, guild_id: int, room_id: int, user_id: int, song: str, sort_key: int, requeue: bool) -> JournalEntry:
+        elem = JournalEntry(self.next_id, guild_id, user_id, song, sort_key, bool(requeue), room_id)
+        self.next_id += 1
+        return elem
+
+    def _get_elem(self, state: GuildQueueState, user_id: int) -> CachedQueueEntry:
+        elem_id = state.user_ids.get(user_id)
+        if(elem_id is None):
+            raise LookupError(f"User {user_id} is not in the queue of guild {state.guild_id} room {state.room_id}.")
+        return state.entries[elem_id]
+
+    def _last_key(self, state: GuildQueueState) -> int:
+        return max((elem.sort_key for elem in state.entries.values()), default=0)
+
+    def _by_key(self, state: GuildQueueState) -> list:
+        # Waiting entries in sort key order, like the SQL store returns them, whatever the policy.
+        if(state.policy == POLICY_FIFO):
+            return state.get_waiting()
+        return sorted(state.get_waiting(), key=lambda elem: elem.sort_key)
+
+    async def get_queue(self, txn: JournalTransaction, guild_id: int, room_id: int) -> list:
+        state = self._state(guild_id, room_id)
+        current_elem = state.get_current()
+        return ([current_elem] if current_elem != None else []) + self._by_key(state)
+
+    async def get_waiting(self, txn: JournalTransaction, guild_id: int, room_id: int) -> list:
+        # A copy, callers sort and shuffle what they get back.
+        return list(self._by_key(self._state(guild_id, room_id)))
+
+    async def get_queue_length(self, txn: JournalTransaction, guild_id: int, room_id: int) -> int:
+        return self._state(guild_id, room_id).get_queue_length()
+
+    async def check_in_queue(self, txn: JournalTransaction, guild_id: int, room_id: int, user_id: int) -> bool:
+        return self._state(guild_id, room_id).check_in_queue(user_id)
+
+    async def get_current(self, txn: JournalTransaction, guild_id: int, room_id: int) -> CachedQueueEntry:
+        return self._state(guild_id, room_id).get_current()
+
+    async def add_to_queue(self, txn: JournalTransaction, guild_id: int, room_id: int, user_id: int, song: str = None, requeue = False) -> None:
+        state = self._state(guild_id, room_id)
+        self._put(txn, state, self._new_entry(guild_id, room_id, user_id, song, self._last_key(state) + QUEUE_KEY_GAP, requeue))
+
+    async def add_many_to_queue(self, txn: JournalTransaction, guild_id: int, room_id: int, entries: list, requeue = False) -> list:
+        state = self._state(guild_id, room_id)
+        seen = set(state.user_ids)
+        added = []
+        for user_id, song in entries:
+            if(user_id not in seen):
+                seen.add(user_id)
+                added.append((user_id, song))
+
+        last_key = self._last_key(state)
+        for i, (user_id, song) in enumerate(added, start=1):
+            self._put(txn, state, self._new_entry(guild_id, room_id, user_id, song, last_key + i * QUEUE_KEY_GAP, requeue))
+        return added
+
+    async def reorder_queue(self, txn: JournalTransaction, guild_id: int, room_id: int, elems: list) -> None:
+        state = self._state(guild_id, room_id)
+        for queue_pos, elem in enumerate(elems, start=1):
+            self._put(txn, state, with_changes(state.entries[elem.id], sort_key=queue_pos * QUEUE_KEY_GAP))
+
+    async def remove_from_queue(self, txn: JournalTransaction, guild_id: int, room_id: int, user_id: int) -> None:
+        state = self._state(guild_id, room_id)
+        elem = self._get_elem(state, user_id)
+        was_current = state.current_id == elem.id
+
+        self._remove(txn, state, elem.id)
+        if(was_current):
+            await self.promote_head(txn, guild_id, room_id)
+
+    async def promote_head(self, txn: JournalTransaction, guild_id: int, room_id: int, exclude_id: int = 0) -> CachedQueueEntry:
+        state = self._state(guild_id, room_id)
+        self._set_current(txn, state, None)
+        head = state.peek_next({exclude_id}, self.clock())
+        self._set_current(txn, state, head)
+        if(head != None):
+            self._set_turns(txn, state, head.user_id, state.get_turns(head.user_id) + 1)
+        return head
+
+    async def advance_queue(self, txn: JournalTransaction, guild_id: int, room_id: int) -> CachedQueueEntry:
+        state = self._state(guild_id, room_id)
+        current_elem = state.get_current()
+        now = self.clock()
+        head = state.peek_next(now=now)
+
+        if(current_elem != None and not current_elem.requeue):
+            self._remove(txn, state, current_elem.id)
+        elif(current_elem != None and current_elem.requeue):
+            eligible_at = now + self.requeue_cooldown if self.requeue_cooldown else None
+            current_elem = self._put(txn, state, with_changes(current_elem, sort_key=self._last_key(state) + QUEUE_KEY_GAP, eligible_at=eligible_at))
+            # A requeued singer with nobody else waiting goes straight back up, unless they
+            # have to cool down first.
+            if(head == None and eligible_at == None):
+                head = current_elem
+
+        self._set_current(txn, state, head)
+        if(head != None):
+            self._set_turns(txn, state, head.user_id, state.get_turns(head.user_id) + 1)
+        return head
+
+    def _neighbour_keys(self, state: GuildQueueState, exclude_id: int, queue_pos: int) -> tuple:
+        keys = [elem.sort_key for elem in self._by_key(state) if elem.id != exclude_id]
+        if(queue_pos <= 1):
+            return (None, keys[0] if keys else None)
+        return (
+            keys[queue_pos - 2] if len(keys) > queue_pos - 2 else None,
+            keys[queue_pos - 1] if len(keys) > queue_pos - 1 else None
+        )
+
+    async def move_queue_elem(self, txn: JournalTransaction, guild_id: int, room_id: int, user_id: int, new_queue_pos: int) -> None:
+        if(new_queue_pos < 1):
+            return
+
+        state = self._state(guild_id, room_id)
+        elem = self._get_elem(state, user_id)
+        if(state.current_id == elem.id):
+            await self.promote_head(txn, guild_id, room_id, elem.id)
+
+        prev_key, next_key = self._neighbour_keys(state, elem.id, new_queue_pos)
+        if(prev_key != None and next_key != None and next_key - prev_key < 2):
+            await self.reorder_queue(txn, guild_id, room_id, self._by_key(state))
+            prev_key, next_key = self._neighbour_keys(state, elem.id, new_queue_pos)
+
+        if(prev_key == None and next_key == None):
+            sort_key = QUEUE_KEY_GAP
+        elif(prev_key == None):
+            sort_key = next_key - QUEUE_KEY_GAP
+        elif(next_key == None):
+            sort_key = prev_key + QUEUE_KEY_GAP
+        else:
+            sort_key = (prev_key + next_key) // 2
+        self._put(txn, state, with_changes(state.entries[elem.id], sort_key=sort_key))
+
+    async def swap_queue_elems(self, txn: JournalTransaction, guild_id: int, room_id: int, user1_id: int, user2_id: int) -> None:
+        state = self._state(guild_id, room_id)
+        elem1 = self._get_elem(state, user1_id)
+        elem2 = self._get_elem(state, user2_id)
+        current_id = state.current_id
+
+        elem1, elem2 = (
+            self._put(txn, state, with_changes(elem1, sort_key=elem2.sort_key)),
+            self._put(txn, state, with_changes(elem2, sort_key=elem1.sort_key))
+        )
+        if(current_id == elem1.id):
+            self._set_current(txn, state, elem2)
+        elif(current_id == elem2.id):
+            self._set_current(txn, state, elem1)
+
+    async def edit_song(self, txn: JournalTransaction, guild_id: int, room_id: int, user_id: int, song: str) -> None:
+        state = self._state(guild_id, room_id)
+        self._put(txn, state, with_changes(self._get_elem(state, user_id), song_name=song))
+
+    async def clear_queue(self, txn: JournalTransaction, guild_id: int, room_id: int) -> None:
+        state = self._state(guild_id, room_id)
+        self._clear(txn, state)
+
+    async def get_policy(self, txn: JournalTransaction, guild_id: int, room_id: int) -> str:
+        return self._state(guild_id, room_id).policy
+
+    async def set_policy(self, txn: JournalTransaction, guild_id: int, room_id: int, policy: str) -> None:
+        state = self._state(guild_id, room_id)
+        key = (guild_id, room_id)
+        previous, previous_policy = self.policies.get(key), state.policy
+        self.policies[key] = policy
+        state.set_policy(policy)
+        txn.events.append(["pol", encode_room(guild_id, room_id), policy])
+
+        def undo() -> None:
+            if(previous is None):
+                self.policies.pop(key, None)
+            else:
+                self.policies[key] = previous
+            state.set_policy(previous_policy)
+        txn.undo.append(undo)
+
+    async def set_weight(self, txn: JournalTransaction, guild_id: int, room_id: int, user_id: int, weight: int) -> None:
+        state = self._state(guild_id, room_id)
+        previous = state.get_weight(user_id)
+        state.set_weight(user_id, weight)
+        txn.events.append(["wgt", encode_room(guild_id, room_id), user_id, weight])
+        txn.undo.append(lambda: state.set_weight(user_id, previous))
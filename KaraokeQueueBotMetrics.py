@@ -0,0 +1,186 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+
+import sqlalchemy as sa
+
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+class InteractionStats():
+    __slots__ = ("command", "queries", "query_time")
+
+    def __init__(self, command: str) -> None:
+        self.command = command
+        self.queries = 0
+        self.query_time = 0.0
+
+# Stats of the command being handled. The guild executor and group committer run jobs in
+# their submitter's context, so queries issued on a command's behalf are counted for it.
+current_interaction = contextvars.ContextVar("current_interaction", default=None)
+
+def format_label(name: str, value) -> str:
+    escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return f"{name}=\"{escaped}\""
+
+class Histogram():
+    def __init__(self, name: str, help_text: str, buckets: tuple, label_name: str = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_name = label_name
+        # label value -> [per-bucket counts..., +Inf count, sum]
+        self.series = {}
+
+    def observe(self, value: float, label: str = None) -> None:
+        series = self.series.get(label)
+        if(series is None):
+            series = self.series[label] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if(value <= bound):
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label, series in sorted(self.series.items(), key=lambda item: str(item[0])):
+            labels = [format_label(self.label_name, label)] if self.label_name else []
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{{{','.join(labels + [format_label('le', bound)])}}} {cumulative}")
+            label_str = f"{{{','.join(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{label_str} {series[-1]}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+class Counter():
+    def __init__(self, name: str, help_text: str, label_name: str = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.values = {}
+
+    def inc(self, label: str = None, amount: float = 1) -> None:
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            label_str = f"{{{format_label(self.label_name, label)}}}" if self.label_name else ""
+            lines.append(f"{self.name}{label_str} {value}")
+        return lines
+
+class BotMetrics():
+    """Command timings, query counts, event loop lag and whatever else registers a reading,
+    rendered in the Prometheus text format.
+
+    Collection is always on since it's a few dict updates per command. The HTTP endpoint and
+    the loop lag monitor only run when started with serve().
+    """
+
+    def __init__(self, slow_command_ms: int = 0) -> None:
+        self.slow_command_ms = slow_command_ms
+        self.command_duration = Histogram("karaoke_command_duration_seconds", "Time taken to handle a command.", LATENCY_BUCKETS, "command")
+        self.command_queries = Histogram("karaoke_command_queries", "SQL statements issued while handling a command.", QUERY_COUNT_BUCKETS, "command")
+        self.command_query_time = Counter("karaoke_command_query_seconds_total", "Time spent in SQL statements issued by a command.", "command")
+        self.command_errors = Counter("karaoke_command_errors_total", "Commands that raised an exception.", "command")
+        self.query_duration = Histogram("karaoke_db_query_duration_seconds", "Time taken by each SQL statement.", LATENCY_BUCKETS)
+        self.loop_lag = Histogram("karaoke_event_loop_lag_seconds", "How late the event loop woke up a sleeping task.", LATENCY_BUCKETS)
+        self.readings = []
+        self._runner = None
+        self._lag_task = None
+
+    def add_reading(self, name: str, help_text: str, metric_type: str, read) -> None:
+        # read() is called on every scrape and returns the current value.
+        self.readings.append((name, help_text, metric_type, read))
+
+    def instrument(self, command: str):
+        """Decorator for command callbacks, times them and counts the queries they cause."""
+        def decorator(callback):
+            @functools.wraps(callback)
+            async def wrapper(*args, **kwargs):
+                stats = InteractionStats(command)
+                token = current_interaction.set(stats)
+                start = time.perf_counter()
+                try:
+                    return await callback(*args, **kwargs)
+                except Exception:
+                    self.command_errors.inc(command)
+                    raise
+                finally:
+                    current_interaction.reset(token)
+                    self.record_command(stats, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def record_command(self, stats: InteractionStats, duration: float) -> None:
+        self.command_duration.observe(duration, stats.command)
+        self.command_queries.observe(stats.queries, stats.command)
+        self.command_query_time.inc(stats.command, stats.query_time)
+        if(self.slow_command_ms > 0 and duration * 1000 >= self.slow_command_ms):
+            logging.warning(
+                f"Slow command {stats.command}: {duration * 1000:.0f}ms, "
+                f"{stats.queries} queries taking {stats.query_time * 1000:.0f}ms"
+            )
+
+    def watch_engine(self, engine) -> None:
+        @sa.event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+            conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+        @sa.event.listens_for(engine.sync_engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+            duration = time.perf_counter() - conn.info["metrics_query_start"].pop()
+            self.query_duration.observe(duration)
+            stats = current_interaction.get()
+            if(stats is not None):
+                stats.queries += 1
+                stats.query_time += duration
+
+        @sa.event.listens_for(engine.sync_engine, "handle_error")
+        def handle_error(exception_context) -> None:
+            # after_cursor_execute doesn't fire for a failed statement.
+            conn = exception_context.connection
+            if(conn is not None and conn.info.get("metrics_query_start")):
+                conn.info["metrics_query_start"].pop()
+
+    async def monitor_loop_lag(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while(True):
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, loop.time() - start - interval))
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.command_duration, self.command_queries, self.command_query_time, self.command_errors, self.query_duration, self.loop_lag):
+            lines += metric.render()
+        for name, help_text, metric_type, read in self.readings:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int, loop_lag_interval: float) -> None:
+        async def handle_metrics(request: web.Request) -> web.Response:
+            return web.Response(body=self.render().encode("utf-8"), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._lag_task = asyncio.create_task(self.monitor_loop_lag(loop_lag_interval))
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def close(self) -> None:
+        if(self._lag_task is not None):
+            self._lag_task.cancel()
+        if(self._runner is not None):
+            await self._runner.cleanup()
@@ -0,0 +1,226 @@
+import logging
+
+import sqlalchemy as sa
+
+from KaraokeQueueBotObjects import Base, QUEUE_KEY_GAP
+
+# Migrations are written against the schema as it was when they were added, not against the
+# current models, so that an old database can always be walked forward one step at a time.
+# Each one is applied inside the startup transaction and recorded in PRAGMA user_version.
+
+def migrate_queue_ordering(conn: sa.engine.Connection) -> None:
+    # Databases created before sort keys were introduced store dense 0..N positions in
+    # queue_pos, with 0 marking the current singer. Rebuild the table with gapped sort keys
+    # and move the current singer into the guild table.
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS guild ("
+        "guild_id BIGINT NOT NULL, "
+        "current_id INTEGER, "
+        "PRIMARY KEY (guild_id))"
+    )
+
+    columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(queue)")]
+    if("queue_pos" not in columns):
+        return
+
+    conn.exec_driver_sql("ALTER TABLE queue RENAME TO queue_old")
+    conn.exec_driver_sql(
+        "CREATE TABLE queue ("
+        "id INTEGER NOT NULL, "
+        "guild_id BIGINT NOT NULL, "
+        "user_id BIGINT NOT NULL, "
+        "song_name VARCHAR, "
+        "sort_key BIGINT NOT NULL, "
+        "requeue BOOLEAN NOT NULL, "
+        "PRIMARY KEY (id))"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO queue (id, guild_id, user_id, song_name, sort_key, requeue) "
+        "SELECT id, guild_id, user_id, song_name, queue_pos * ?, requeue FROM queue_old",
+        (QUEUE_KEY_GAP,)
+    )
+    conn.exec_driver_sql(
+        "INSERT OR IGNORE INTO guild (guild_id, current_id) "
+        "SELECT guild_id, id FROM queue_old WHERE queue_pos = 0"
+    )
+    conn.exec_driver_sql("DROP TABLE queue_old")
+
+def migrate_add_indexes(conn: sa.engine.Connection) -> None:
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_queue_guild_sort ON queue (guild_id, sort_key)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_queue_guild_user ON queue (guild_id, user_id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_nextmsg_guild_has_song ON nextmsg (guild_id, has_song)")
+
+    # Template names used to be checked for uniqueness by hand, so older databases can hold
+    # duplicates within a guild. Keep the oldest name as is and suffix the rest with their id.
+    conn.exec_driver_sql(
+        "UPDATE nextmsg SET name = name || '-' || id "
+        "WHERE id NOT IN (SELECT MIN(id) FROM nextmsg GROUP BY guild_id, name)"
+    )
+    conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ux_nextmsg_guild_name ON nextmsg (guild_id, name)")
+
+def migrate_add_board(conn: sa.engine.Connection) -> None:
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS board ("
+        "guild_id BIGINT NOT NULL, "
+        "channel_id BIGINT NOT NULL, "
+        "message_id BIGINT NOT NULL, "
+        "size INTEGER NOT NULL, "
+        "PRIMARY KEY (guild_id))"
+    )
+
+def migrate_add_policies(conn: sa.engine.Connection) -> None:
+    columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(guild)")]
+    if("policy" not in columns):
+        conn.exec_driver_sql("ALTER TABLE guild ADD COLUMN policy VARCHAR")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS singer ("
+        "guild_id BIGINT NOT NULL, "
+        "user_id BIGINT NOT NULL, "
+        "turns INTEGER NOT NULL, "
+        "weight INTEGER NOT NULL, "
+        "PRIMARY KEY (guild_id, user_id))"
+    )
+
+def migrate_add_history(conn: sa.engine.Connection) -> None:
+    columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(guild)")]
+    if("current_since" not in columns):
+        conn.exec_driver_sql("ALTER TABLE guild ADD COLUMN current_since FLOAT")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS performance ("
+        "id INTEGER NOT NULL, "
+        "guild_id BIGINT NOT NULL, "
+        "user_id BIGINT NOT NULL, "
+        "song_name VARCHAR, "
+        "started_at FLOAT, "
+        "ended_at FLOAT NOT NULL, "
+        "PRIMARY KEY (id))"
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_performance_guild_ended ON performance (guild_id, ended_at)")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS singer_stats ("
+        "guild_id BIGINT NOT NULL, "
+        "user_id BIGINT NOT NULL, "
+        "performances INTEGER NOT NULL, "
+        "timed_performances INTEGER NOT NULL, "
+        "total_seconds FLOAT NOT NULL, "
+        "PRIMARY KEY (guild_id, user_id))"
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_singer_stats_guild_performances ON singer_stats (guild_id, performances)")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS song_stats ("
+        "guild_id BIGINT NOT NULL, "
+        "song_key VARCHAR NOT NULL, "
+        "song_name VARCHAR NOT NULL, "
+        "performances INTEGER NOT NULL, "
+        "PRIMARY KEY (guild_id, song_key))"
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_song_stats_guild_performances ON song_stats (guild_id, performances)")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS guild_stats ("
+        "guild_id BIGINT NOT NULL, "
+        "performances INTEGER NOT NULL, "
+        "timed_performances INTEGER NOT NULL, "
+        "total_seconds FLOAT NOT NULL, "
+        "PRIMARY KEY (guild_id))"
+    )
+
+def migrate_add_rooms(conn: sa.engine.Connection) -> None:
+    # Everything queued so far belongs to each guild's main queue, room 0. Commands get at it from
+    # outside voice, or by picking a text channel as their room.
+    conn.exec_driver_sql("ALTER TABLE queue ADD COLUMN room_id BIGINT NOT NULL DEFAULT 0")
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_queue_guild_sort")
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_queue_guild_user")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_queue_room_sort ON queue (guild_id, room_id, sort_key)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_queue_room_user ON queue (guild_id, room_id, user_id)")
+
+    conn.exec_driver_sql(
+        "CREATE TABLE room ("
+        "guild_id BIGINT NOT NULL, "
+        "room_id BIGINT NOT NULL, "
+        "current_id INTEGER, "
+        "policy VARCHAR, "
+        "current_since FLOAT, "
+        "PRIMARY KEY (guild_id, room_id))"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO room (guild_id, room_id, current_id, policy, current_since) "
+        "SELECT guild_id, 0, current_id, policy, current_since FROM guild"
+    )
+    conn.exec_driver_sql("DROP TABLE guild")
+
+    # SQLite can't change a primary key in place, so these are rebuilt.
+    conn.exec_driver_sql("ALTER TABLE singer RENAME TO singer_old")
+    conn.exec_driver_sql(
+        "CREATE TABLE singer ("
+        "guild_id BIGINT NOT NULL, "
+        "room_id BIGINT NOT NULL, "
+        "user_id BIGINT NOT NULL, "
+        "turns INTEGER NOT NULL, "
+        "weight INTEGER NOT NULL, "
+        "PRIMARY KEY (guild_id, room_id, user_id))"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO singer (guild_id, room_id, user_id, turns, weight) "
+        "SELECT guild_id, 0, user_id, turns, weight FROM singer_old"
+    )
+    conn.exec_driver_sql("DROP TABLE singer_old")
+
+    conn.exec_driver_sql("ALTER TABLE board RENAME TO board_old")
+    conn.exec_driver_sql(
+        "CREATE TABLE board ("
+        "guild_id BIGINT NOT NULL, "
+        "room_id BIGINT NOT NULL, "
+        "channel_id BIGINT NOT NULL, "
+        "message_id BIGINT NOT NULL, "
+        "size INTEGER NOT NULL, "
+        "PRIMARY KEY (guild_id, room_id))"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO board (guild_id, room_id, channel_id, message_id, size) "
+        "SELECT guild_id, 0, channel_id, message_id, size FROM board_old"
+    )
+    conn.exec_driver_sql("DROP TABLE board_old")
+
+def migrate_add_timers(conn: sa.engine.Connection) -> None:
+    columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(queue)")]
+    if("eligible_at" not in columns):
+        conn.exec_driver_sql("ALTER TABLE queue ADD COLUMN eligible_at FLOAT")
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS guild_settings ("
+        "guild_id BIGINT NOT NULL, "
+        "auto_advance_s INTEGER, "
+        "PRIMARY KEY (guild_id))"
+    )
+
+MIGRATIONS = [
+    migrate_queue_ordering,
+    migrate_add_indexes,
+    migrate_add_board,
+    migrate_add_policies,
+    migrate_add_history,
+    migrate_add_rooms,
+    migrate_add_timers,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn: sa.engine.Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar_one()
+
+def run_migrations(conn: sa.engine.Connection) -> None:
+    version = get_schema_version(conn)
+    if(version >= SCHEMA_VERSION):
+        return
+
+    tables = sa.inspect(conn).get_table_names()
+
+    if("queue" not in tables):
+        # Brand new database, the models already describe the latest schema.
+        Base.metadata.create_all(conn)
+    else:
+        for i in range(version, SCHEMA_VERSION):
+            logging.info(f"Applying database migration {i + 1}: {MIGRATIONS[i].__name__}")
+            MIGRATIONS[i](conn)
+
+    # PRAGMA statements can't take bound parameters.
+    conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION:d}")
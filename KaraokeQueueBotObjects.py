@@ -3,21 +3,80 @@ import sqlalchemy.orm as sa_orm
 
 Base = sa_orm.declarative_base()
 
+# Spacing between the sort keys of neighbouring queue entries. Moves pick the midpoint
+# of their new neighbours, so a guild only needs rebalancing once a gap is used up.
+QUEUE_KEY_GAP = 1 << 20
+
+# Room of a guild's main queue, for commands run outside a voice channel. Every other room is
+# the id of the voice channel its queue belongs to.
+MAIN_ROOM_ID = 0
+
 class QueueEntry(Base):
     __tablename__ = "queue"
+    __table_args__ = (
+        sa.Index("ix_queue_room_sort", "guild_id", "room_id", "sort_key"),
+        sa.Index("ix_queue_room_user", "guild_id", "room_id", "user_id"),
+    )
 
     id = sa.Column(sa.Integer, primary_key = True)
     guild_id = sa.Column(sa.BigInteger, nullable = False)
+    room_id = sa.Column(sa.BigInteger, nullable = False)
     user_id = sa.Column(sa.BigInteger, nullable = False)
     song_name = sa.Column(sa.String, nullable = True)
-    queue_pos = sa.Column(sa.Integer, nullable = False)
+    sort_key = sa.Column(sa.BigInteger, nullable = False)
     requeue = sa.Column(sa.Boolean, nullable = False)
+    # Unix time a requeued singer can be up again after their cooldown, None if they already can.
+    eligible_at = sa.Column(sa.Float, nullable = True)
+
+    def __repr__(self) -> str:
+        return f"QueueEntry: Guild={self.guild_id!r}, Room={self.room_id!r}, User={self.user_id!r}, Song={self.song_name!r}, SortKey={self.sort_key!r}, EligibleAt={self.eligible_at!r}"
+
+class RoomEntry(Base):
+    # One row per queue that has had a current singer or a policy set.
+    __tablename__ = "room"
+
+    guild_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    room_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    current_id = sa.Column(sa.Integer, nullable = True)
+    # One of KaraokeQueueBotPolicies.POLICIES, None for the configured default.
+    policy = sa.Column(sa.String, nullable = True)
+    # Unix time the current singer went up, None if nobody is up or it isn't known.
+    current_since = sa.Column(sa.Float, nullable = True)
+
+    def __repr__(self) -> str:
+        return f"RoomEntry: Guild={self.guild_id!r}, Room={self.room_id!r}, Current={self.current_id!r}, Policy={self.policy!r}, Since={self.current_since!r}"
+
+class GuildSettingsEntry(Base):
+    # Settings a guild has changed from the configured defaults.
+    __tablename__ = "guild_settings"
+
+    guild_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    # Seconds before the current singer is advanced past automatically, 0 for never, None
+    # for the configured auto_advance_minutes.
+    auto_advance_s = sa.Column(sa.Integer, nullable = True)
 
     def __repr__(self) -> str:
-        return f"QueueEntry: Guild={self.guild_id!r}, User={self.user_id!r}, Song={self.song_name!r}, QueuePos={self.queue_pos!r}"
+        return f"GuildSettingsEntry: Guild={self.guild_id!r}, AutoAdvance={self.auto_advance_s!r}"
+
+class SingerEntry(Base):
+    __tablename__ = "singer"
+
+    guild_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    room_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    user_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    # Turns sung since the room's queue was last cleared.
+    turns = sa.Column(sa.Integer, nullable = False, default = 0)
+    weight = sa.Column(sa.Integer, nullable = False, default = 1)
+
+    def __repr__(self) -> str:
+        return f"SingerEntry: Guild={self.guild_id!r}, Room={self.room_id!r}, User={self.user_id!r}, Turns={self.turns!r}, Weight={self.weight!r}"
 
 class NextMsgEntry(Base):
     __tablename__ = "nextmsg"
+    __table_args__ = (
+        sa.Index("ix_nextmsg_guild_has_song", "guild_id", "has_song"),
+        sa.Index("ux_nextmsg_guild_name", "guild_id", "name", unique = True),
+    )
 
     id = sa.Column(sa.Integer, primary_key = True)
     guild_id = sa.Column(sa.BigInteger, nullable = False)
@@ -26,4 +85,78 @@ class NextMsgEntry(Base):
     name = sa.Column(sa.String, nullable = False)
 
     def __repr__(self) -> str:
-        return f"NextMsgEntry: Guild={self.guild_id!r}, Message={self.msg!r}, HasSongElem={self.has_song!r}"
\ No newline at end of file
+        return f"NextMsgEntry: Guild={self.guild_id!r}, Message={self.msg!r}, HasSongElem={self.has_song!r}"
+
+class BoardEntry(Base):
+    __tablename__ = "board"
+
+    guild_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    room_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    channel_id = sa.Column(sa.BigInteger, nullable = False)
+    message_id = sa.Column(sa.BigInteger, nullable = False)
+    size = sa.Column(sa.Integer, nullable = False)
+
+    def __repr__(self) -> str:
+        return f"BoardEntry: Guild={self.guild_id!r}, Room={self.room_id!r}, Channel={self.channel_id!r}, Message={self.message_id!r}, Size={self.size!r}"
+
+class PerformanceEntry(Base):
+    # Append-only, one row per finished turn. Only ever read by compaction, /stats reads the
+    # summary tables below.
+    __tablename__ = "performance"
+    __table_args__ = (
+        sa.Index("ix_performance_guild_ended", "guild_id", "ended_at"),
+    )
+
+    id = sa.Column(sa.Integer, primary_key = True)
+    guild_id = sa.Column(sa.BigInteger, nullable = False)
+    user_id = sa.Column(sa.BigInteger, nullable = False)
+    song_name = sa.Column(sa.String, nullable = True)
+    # Unix times, started_at is None for turns that began before it was being recorded.
+    started_at = sa.Column(sa.Float, nullable = True)
+    ended_at = sa.Column(sa.Float, nullable = False)
+
+    def __repr__(self) -> str:
+        return f"PerformanceEntry: Guild={self.guild_id!r}, User={self.user_id!r}, Song={self.song_name!r}, Started={self.started_at!r}, Ended={self.ended_at!r}"
+
+class SingerStatsEntry(Base):
+    __tablename__ = "singer_stats"
+    __table_args__ = (
+        sa.Index("ix_singer_stats_guild_performances", "guild_id", "performances"),
+    )
+
+    guild_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    user_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    performances = sa.Column(sa.Integer, nullable = False)
+    # Performances with a known start, and how long they took in total.
+    timed_performances = sa.Column(sa.Integer, nullable = False)
+    total_seconds = sa.Column(sa.Float, nullable = False)
+
+    def __repr__(self) -> str:
+        return f"SingerStatsEntry: Guild={self.guild_id!r}, User={self.user_id!r}, Performances={self.performances!r}"
+
+class SongStatsEntry(Base):
+    __tablename__ = "song_stats"
+    __table_args__ = (
+        sa.Index("ix_song_stats_guild_performances", "guild_id", "performances"),
+    )
+
+    guild_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    # KaraokeQueueBotCatalog.normalize_song of the name, so spellings of a song count together.
+    song_key = sa.Column(sa.String, primary_key = True)
+    # The name as it was last sung.
+    song_name = sa.Column(sa.String, nullable = False)
+    performances = sa.Column(sa.Integer, nullable = False)
+
+    def __repr__(self) -> str:
+        return f"SongStatsEntry: Guild={self.guild_id!r}, Song={self.song_name!r}, Performances={self.performances!r}"
+
+class GuildStatsEntry(Base):
+    __tablename__ = "guild_stats"
+
+    guild_id = sa.Column(sa.BigInteger, primary_key = True, autoincrement = False)
+    performances = sa.Column(sa.Integer, nullable = False)
+    timed_performances = sa.Column(sa.Integer, nullable = False)
+    total_seconds = sa.Column(sa.Float, nullable = False)
+
+    def __repr__(self) -> str:
+        return f"GuildStatsEntry: Guild={self.guild_id!r}, Performances={self.performances!r}"
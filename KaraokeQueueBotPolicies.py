@@ -0,0 +1,74 @@
+import heapq
+
+# The orders waiting singers can be taken in, chosen per guild with /queue policy.
+POLICY_FIFO = "fifo"
+POLICY_ROTATION = "rotation"
+POLICY_WEIGHTED = "weighted"
+POLICY_NEWCOMERS = "newcomers"
+POLICIES = [POLICY_FIFO, POLICY_ROTATION, POLICY_WEIGHTED, POLICY_NEWCOMERS]
+
+POLICY_DESCRIPTIONS = {
+    POLICY_FIFO: "in the order they joined",
+    POLICY_ROTATION: "fewest turns sung first",
+    POLICY_WEIGHTED: "fewest turns for their weight first",
+    POLICY_NEWCOMERS: "whoever hasn't sung yet first"
+}
+
+DEFAULT_WEIGHT = 1
+MAX_WEIGHT = 5
+
+def order_key(policy: str, elem, turns: int, weight: int) -> tuple:
+    """Sort key of a waiting entry under policy, given how many turns its singer has had.
+
+    Singers the policy can't tell apart keep the order they joined in. Under "weighted" a
+    singer with weight 2 gets about twice the turns of one with weight 1, since each is due
+    once their turns so far are used up in proportion to their weight.
+    """
+    if(policy == POLICY_ROTATION):
+        return (turns, elem.sort_key, elem.id)
+    if(policy == POLICY_WEIGHTED):
+        return ((turns + 1) / weight, elem.sort_key, elem.id)
+    if(policy == POLICY_NEWCOMERS):
+        return (turns > 0, elem.sort_key, elem.id)
+    return (elem.sort_key, elem.id)
+
+class WaitingHeap():
+    """Binary heap of entry ids on their order_key, finds the next singer in O(log n).
+
+    Keys aren't updated in place: a changed entry is pushed again and its old copy is dropped
+    once it comes up to the top. The heap is rebuilt when old copies outnumber live ones.
+    """
+
+    def __init__(self, keys: dict) -> None:
+        self._keys = keys
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._heap = [(key, elem_id) for elem_id, key in self._keys.items()]
+        heapq.heapify(self._heap)
+
+    def push(self, elem_id: int, key: tuple) -> None:
+        self._keys[elem_id] = key
+        heapq.heappush(self._heap, (key, elem_id))
+        if(len(self._heap) > 2 * len(self._keys) + 16):
+            self._rebuild()
+
+    def discard(self, elem_id: int) -> None:
+        self._keys.pop(elem_id, None)
+
+    def peek(self, exclude: set) -> int:
+        """Id of the entry with the smallest key that isn't in exclude, None if there's none."""
+        skipped = []
+        found = None
+        while(self._heap):
+            key, elem_id = self._heap[0]
+            if(self._keys.get(elem_id) != key):
+                heapq.heappop(self._heap)
+            elif(elem_id in exclude):
+                skipped.append(heapq.heappop(self._heap))
+            else:
+                found = elem_id
+                break
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        return found
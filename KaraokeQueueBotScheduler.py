@@ -0,0 +1,132 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+class TimerScheduler():
+    """Runs callbacks at a deadline, for any number of timers from a single task.
+
+    Timers are keyed by any hashable key, and scheduling a key that's already pending moves
+    its deadline instead of adding a second timer. Deadlines are times on clock(), which is
+    time.time by default and can be swapped out so tests don't have to wait.
+
+    Pending timers sit in a binary heap on their deadline. Moving or cancelling a timer leaves
+    its old copy in the heap to be dropped once it comes up to the top, and the heap is rebuilt
+    when old copies outnumber live ones. The runner task sleeps until the earliest deadline, or
+    max_sleep seconds if that's sooner so a clock that jumps is noticed, and is woken early when
+    an earlier timer is scheduled.
+
+    A callback is an async callable taking no arguments. Due callbacks are started as their own
+    task and don't hold up the timers after them; exceptions are logged and dropped.
+    """
+
+    def __init__(self, clock = time.time, max_sleep: float = 60.0) -> None:
+        self.clock = clock
+        self.max_sleep = max_sleep
+        self.fired = 0
+        self._timers = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._running = set()
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def schedule(self, key, deadline: float, callback) -> None:
+        seq = next(self._seq)
+        self._timers[key] = (deadline, seq, callback)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        if(len(self._heap) > 2 * len(self._timers) + 16):
+            self._rebuild()
+
+        if(self._wakeup is not None and self._heap[0][1] == seq):
+            self._wakeup.set()
+
+    def cancel(self, key) -> None:
+        self._timers.pop(key, None)
+
+    def pending(self, key) -> float:
+        """The key's deadline, None if it has no timer pending."""
+        timer = self._timers.get(key)
+        return timer[0] if timer is not None else None
+
+    def next_deadline(self) -> float:
+        """The earliest pending deadline, None if nothing is pending."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self) -> int:
+        """Starts the callback of every timer that's due, returns how many were started."""
+        now = self.clock()
+        started = 0
+        while(True):
+            self._drop_stale()
+            if(not self._heap or self._heap[0][0] > now):
+                return started
+
+            _, _, key = heapq.heappop(self._heap)
+            _, _, callback = self._timers.pop(key)
+            task = asyncio.ensure_future(self._fire(key, callback))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            self.fired += 1
+            started += 1
+
+    async def join(self) -> None:
+        """Waits for the callbacks already started to finish."""
+        while(self._running):
+            await asyncio.gather(*list(self._running), return_exceptions=True)
+
+    def start(self) -> None:
+        if(self._task is None):
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        tasks = list(self._running)
+        if(self._task is not None):
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._timers),
+            "heap": len(self._heap),
+            "running": len(self._running),
+            "fired": self.fired
+        }
+
+    def _rebuild(self) -> None:
+        self._heap = [(deadline, seq, key) for key, (deadline, seq, _) in self._timers.items()]
+        heapq.heapify(self._heap)
+
+    def _drop_stale(self) -> None:
+        while(self._heap):
+            _, seq, key = self._heap[0]
+            timer = self._timers.get(key)
+            if(timer is not None and timer[1] == seq):
+                return
+            heapq.heappop(self._heap)
+
+    async def _fire(self, key, callback) -> None:
+        try:
+            await callback()
+        except Exception:
+            logging.exception(f"Timer {key!r} failed.")
+
+    async def _run(self) -> None:
+        while(True):
+            self.run_due()
+            deadline = self.next_deadline()
+            timeout = self.max_sleep if deadline is None else min(max(deadline - self.clock(), 0), self.max_sleep)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,208 @@
+import asyncio
+import collections
+import contextlib
+import glob
+import logging
+import os
+import os.path
+import re
+import zlib
+
+import sqlalchemy.ext.asyncio as sa_async
+import sqlalchemy.orm as sa_orm
+
+from KaraokeQueueBotMigrations import SCHEMA_VERSION, get_schema_version, run_migrations
+from KaraokeQueueBotStorage import GroupCommitter, create_db_engine
+
+FIXED_SHARD_RE = re.compile(r"shard-\d+-of-(\d+)\.db$")
+
+class ShardConfigError(Exception):
+    pass
+
+class Shard():
+    """One database file with its engine and write path."""
+
+    def __init__(self, key: str, path: str, storage) -> None:
+        self.key = key
+        self.path = path
+        self.engine = create_db_engine(path, storage)
+        self.sessionmaker = sa_orm.sessionmaker(bind=self.engine, expire_on_commit=False, class_=sa_async.AsyncSession, future=True)
+        # SQLite only has one writer at a time anyway. Queueing writers here instead of in
+        # SQLite's busy handler, which polls with sleeps, keeps write latency flat.
+        self.write_lock = asyncio.Lock()
+        if(storage.group_commit_ms > 0):
+            self.group_committer = GroupCommitter(self.sessionmaker, storage.group_commit_ms / 1000, self.write_lock)
+        else:
+            self.group_committer = None
+        # Callers currently holding this shard through ShardRouter.use(), it isn't closed while
+        # any are left.
+        self.users = 0
+        self.closed = False
+
+class ShardRouter():
+    """Maps guilds to database files and keeps a bounded set of them open.
+
+    With mode "off" every guild lives in db_path. With "guild" each guild gets its own file in
+    shard_dir, with "fixed" guilds are spread over shard_count files by a hash of their id.
+    Shards are opened, and migrated, the first time one of their guilds is used. Once more than
+    max_open_shards are open the least recently used ones that nobody is using are closed.
+    """
+
+    def __init__(self, db_path: str, storage, mode: str = "off", shard_dir: str = None, shard_count: int = 16, max_open_shards: int = 64) -> None:
+        self.db_path = db_path
+        self.storage = storage
+        self.mode = mode
+        self.shard_dir = shard_dir
+        self.shard_count = shard_count
+        self.max_open_shards = max_open_shards
+        self.shards = collections.OrderedDict()
+        # Called with every newly opened shard.
+        self.on_open = []
+        self.opens = 0
+        self.closes = 0
+        self._opening = {}
+        # Callers waiting on each open. The shard they get isn't pinned until they resume, so it
+        # mustn't be closed as idle before then.
+        self._waiting = collections.Counter()
+        # Files whose schema is known to be current, so reopening them skips the check.
+        self._schema_checked = set()
+        # Group commit counts of shards that have since been closed.
+        self._closed_batches = 0
+        self._closed_operations = 0
+
+    def shard_key(self, guild_id: int) -> str:
+        if(self.mode == "off"):
+            return "main"
+        if(self.mode == "guild"):
+            return f"guild-{guild_id}"
+        # Snowflakes aren't evenly spread in their low bits, so hash them first.
+        shard = zlib.crc32(int(guild_id).to_bytes(8, "little")) % self.shard_count
+        return f"shard-{shard:04d}-of-{self.shard_count:04d}"
+
+    def shard_path(self, key: str) -> str:
+        if(self.mode == "off"):
+            return self.db_path
+        return os.path.join(self.shard_dir, f"{key}.db")
+
+    def group_commit_stats(self) -> tuple:
+        """(batches, operations) committed by every shard's group committer so far."""
+        committers = [shard.group_committer for shard in self.shards.values() if shard.group_committer != None]
+        return (
+            self._closed_batches + sum(committer.batches for committer in committers),
+            self._closed_operations + sum(committer.operations for committer in committers)
+        )
+
+    async def prepare(self) -> None:
+        """Checks the shard directory, and opens the database right away when not sharding."""
+        if(self.mode == "off"):
+            await self._get("main")
+            return
+
+        os.makedirs(self.shard_dir, exist_ok=True)
+        if(self.mode == "fixed"):
+            for path in glob.glob(os.path.join(self.shard_dir, "shard-*-of-*.db")):
+                match = FIXED_SHARD_RE.search(path)
+                if(match and int(match.group(1)) != self.shard_count):
+                    raise ShardConfigError(
+                        f"{path} belongs to a layout with {int(match.group(1))} shards, not {self.shard_count}. "
+                        "Move the data with migrate_shards.py before changing shard_count."
+                    )
+
+    @contextlib.asynccontextmanager
+    async def use(self, guild_id: int):
+        """Holds the guild's shard open for the duration of the block."""
+        key = self.shard_key(guild_id)
+        while(True):
+            shard = await self._get(key)
+            # It may have been closed between being opened and us getting to run.
+            if(not shard.closed):
+                break
+        shard.users += 1
+        try:
+            yield shard
+        finally:
+            shard.users -= 1
+            if(len(self.shards) > self.max_open_shards):
+                await self._close_idle()
+
+    @contextlib.asynccontextmanager
+    async def session(self, guild_id: int):
+        async with self.use(guild_id) as shard:
+            if(shard.path):
+                async with shard.sessionmaker() as session:
+                    yield session
+                return
+
+            # An in-memory database has just the one connection, which a read can't begin a
+            # transaction on while a write, say a background history write, has one open.
+            async with shard.write_lock, shard.sessionmaker() as session:
+                yield session
+
+    async def _get(self, key: str) -> Shard:
+        shard = self.shards.get(key)
+        if(shard is not None):
+            self.shards.move_to_end(key)
+            return shard
+
+        # Everyone after the same shard waits for a single open.
+        opening = self._opening.get(key)
+        if(opening is None):
+            opening = self._opening[key] = asyncio.ensure_future(self._open(key))
+            opening.add_done_callback(lambda _: self._opening.pop(key, None))
+        self._waiting[key] += 1
+        try:
+            return await asyncio.shield(opening)
+        finally:
+            self._waiting[key] -= 1
+            if(not self._waiting[key]):
+                del self._waiting[key]
+
+    async def _open(self, key: str) -> Shard:
+        shard = Shard(key, self.shard_path(key), self.storage)
+        try:
+            if(shard.path not in self._schema_checked):
+                await self._check_schema(shard.engine)
+                self._schema_checked.add(shard.path)
+        except Exception:
+            await shard.engine.dispose()
+            raise
+
+        for callback in self.on_open:
+            callback(shard)
+        self.shards[key] = shard
+        self.opens += 1
+        if(len(self.shards) > self.max_open_shards):
+            await self._close_idle(key)
+        return shard
+
+    async def _check_schema(self, engine: sa_async.AsyncEngine) -> None:
+        # Reading the version doesn't need the write lock, migrating does.
+        async with engine.connect() as conn:
+            version = await conn.run_sync(get_schema_version)
+        if(version < SCHEMA_VERSION):
+            async with engine.begin() as conn:
+                await conn.run_sync(run_migrations)
+
+    async def _close_idle(self, keep_key: str = None) -> None:
+        # An in-memory database would be lost on close, but it's never sharded.
+        for key, shard in list(self.shards.items()):
+            if(len(self.shards) <= self.max_open_shards):
+                break
+            # Another close may have got to it while we were disposing of an earlier one.
+            if(shard.users or self._waiting[key] or key == keep_key or self.shards.get(key) is not shard):
+                continue
+
+            del self.shards[key]
+            shard.closed = True
+            self.closes += 1
+            if(shard.group_committer != None):
+                self._closed_batches += shard.group_committer.batches
+                self._closed_operations += shard.group_committer.operations
+            logging.debug(f"Closing idle shard {key}.")
+            await shard.engine.dispose()
+
+    async def close(self) -> None:
+        for shard in list(self.shards.values()):
+            shard.closed = True
+            await shard.engine.dispose()
+        self.shards.clear()
@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import logging
+import os.path
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
+import sqlalchemy.pool as sa_pool
+
+from KaraokeQueueBotExecutor import run_in_context
+
+def create_db_engine(db_path: str, storage) -> sa_async.AsyncEngine:
+    """Creates the bot's engine, with every connection set up according to the storage profile."""
+    if(db_path):
+        db_url = f"sqlite+aiosqlite:///{os.path.abspath(db_path)}"
+        # aiosqlite runs each connection on its own thread, so keep a few open instead of
+        # starting a thread (and re-reading the schema) for every command.
+        engine = sa_async.create_async_engine(
+            db_url,
+            future=True,
+            poolclass=sa_pool.AsyncAdaptedQueuePool,
+            pool_size=storage.pool_size,
+            max_overflow=0,
+            connect_args={"timeout": storage.busy_timeout_ms / 1000}
+        )
+    else:
+        # An in-memory database only lives as long as its one connection.
+        engine = sa_async.create_async_engine("sqlite+aiosqlite://", future=True)
+
+    @sa.event.listens_for(engine.sync_engine, "connect")
+    def set_pragmas(dbapi_conn, conn_record) -> None:
+        # Stop the driver from issuing its own BEGINs so that savepoints work and writes can
+        # take the write lock up front, see begin_transaction below.
+        dbapi_conn.isolation_level = None
+
+        cursor = dbapi_conn.cursor()
+        if(db_path):
+            cursor.execute(f"PRAGMA journal_mode = {storage.journal_mode}")
+            cursor.execute(f"PRAGMA mmap_size = {storage.mmap_size_mb * 1024 * 1024:d}")
+        cursor.execute(f"PRAGMA synchronous = {storage.synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout = {storage.busy_timeout_ms:d}")
+        # Negative sizes are in KiB rather than pages.
+        cursor.execute(f"PRAGMA cache_size = {-storage.cache_size_mb * 1024:d}")
+        cursor.close()
+
+    @sa.event.listens_for(engine.sync_engine, "begin")
+    def begin_transaction(conn) -> None:
+        conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get('sqlite_begin', 'DEFERRED')}")
+
+    return engine
+
+async def begin_write(session: sa_async.AsyncSession) -> None:
+    """Starts the session's transaction with BEGIN IMMEDIATE.
+
+    A deferred transaction that reads first and writes later can't wait for another writer to
+    finish, it fails with "database is locked" instead. Taking the write lock up front means
+    busy_timeout applies.
+    """
+    await session.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
+
+class GroupCommitter():
+    """Batches writes from different guilds into a single transaction.
+
+    Submitted operations are collected for window seconds and then run one after another on a
+    shared session, each inside its own savepoint so a failing operation only undoes its own
+    changes. The batch is committed once, so the whole window costs a single fsync. Every
+    submitter waits for that commit before getting its result back.
+    """
+
+    def __init__(self, sessionmaker, window: float, write_lock: asyncio.Lock) -> None:
+        self.sessionmaker = sessionmaker
+        self.window = window
+        self.write_lock = write_lock
+        self.batches = 0
+        self.operations = 0
+        self._pending = []
+        self._flush_task = None
+
+    async def submit(self, op):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((op, future, contextvars.copy_context()))
+        if(self._flush_task is None):
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+
+        results = []
+        try:
+            async with self.write_lock, self.sessionmaker() as session, session.begin():
+                await begin_write(session)
+                for op, future, context in batch:
+                    try:
+                        async with session.begin_nested():
+                            results.append((future, await run_in_context(context, lambda: op(session)), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            logging.exception(f"Group commit of {len(batch)} operations failed.")
+            for op, future, context in batch:
+                if(not future.done()):
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.operations += len(batch)
+        for future, result, exc in results:
+            if(future.done()):
+                continue
+            if(exc is not None):
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
@@ -0,0 +1,578 @@
+import time
+import typing
+
+import sqlalchemy as sa
+import sqlalchemy.dialects.sqlite as sa_sqlite
+import sqlalchemy.ext.asyncio as sa_async
+import sqlalchemy.future as sa_future
+import sqlalchemy.orm as sa_orm
+
+from KaraokeQueueBotObjects import QueueEntry, RoomEntry, SingerEntry, QUEUE_KEY_GAP
+from KaraokeQueueBotCache import GuildQueueState, QueueCache
+from KaraokeQueueBotPolicies import DEFAULT_WEIGHT, POLICY_FIFO
+
+# Rows per bulk INSERT/UPDATE, keeps each statement well under SQLite's bound parameter limit.
+BULK_STATEMENT_ROWS = 1000
+
+class QueueStore(typing.Protocol):
+    """Where the queues live.
+
+    A guild has a queue per room, see MAIN_ROOM_ID, and each room's queue, current singer,
+    policy and turns are independent of the others'. Mutations only happen inside
+    write(guild_id, op), which runs op(txn) and makes everything it did durable before
+    returning op's result, or undoes all of it if op raises. op may only touch the queues of
+    guild_id's rooms, and every method that takes a txn must be called with the one write()
+    handed to op. Entries returned have id, guild_id, room_id, user_id, song_name, sort_key,
+    requeue and eligible_at attributes.
+
+    Callers are expected to run at most one write per room at a time, see GuildExecutor.
+
+    advance_queue and remove_from_queue hand the current singer's turn to whoever the room's
+    policy puts next, see KaraokeQueueBotPolicies, and count a turn for them. A requeued singer
+    sent to the back by advance_queue isn't eligible again until requeue_cooldown seconds have
+    passed, and nobody goes up while every waiting singer is cooling down.
+    """
+
+    async def open(self) -> None:
+        """Gets the store ready. Called once at startup, but every other method also opens the
+        store on demand, so commands arriving early still work."""
+
+    async def write(self, guild_id: int, op): ...
+
+    async def get_state(self, guild_id: int, room_id: int) -> GuildQueueState:
+        """Current queue for reads outside a write, possibly from a cache."""
+
+    async def load_state(self, guild_id: int, room_id: int) -> GuildQueueState:
+        """The room's queue as last made durable, bypassing any cache."""
+
+    async def get_room_ids(self, guild_id: int) -> list:
+        """Rooms of the guild with anyone queued."""
+
+    async def close(self) -> None: ...
+
+    def export_guild(self, guild_id: int, batch_rows: int):
+        """Async iterator over the guild's rooms, singers and queue entries as export records, in
+        lists of up to batch_rows, see KaraokeQueueBotBackup."""
+
+    async def import_guild(self, txn, guild_id: int, batches) -> list:
+        """Clears every queue of the guild like clear_queue, then fills them from the export
+        records in batches, an iterable of lists of records. Returns the ids of the rooms changed."""
+
+    async def get_queue(self, txn, guild_id: int, room_id: int) -> list: ...
+    async def get_waiting(self, txn, guild_id: int, room_id: int) -> list: ...
+    async def get_queue_length(self, txn, guild_id: int, room_id: int) -> int: ...
+    async def check_in_queue(self, txn, guild_id: int, room_id: int, user_id: int) -> bool: ...
+    async def get_current(self, txn, guild_id: int, room_id: int): ...
+    async def add_to_queue(self, txn, guild_id: int, room_id: int, user_id: int, song: str = None, requeue = False) -> None: ...
+    async def add_many_to_queue(self, txn, guild_id: int, room_id: int, entries: list, requeue = False) -> list: ...
+    async def remove_from_queue(self, txn, guild_id: int, room_id: int, user_id: int) -> None: ...
+    async def advance_queue(self, txn, guild_id: int, room_id: int): ...
+    async def move_queue_elem(self, txn, guild_id: int, room_id: int, user_id: int, new_queue_pos: int) -> None: ...
+    async def swap_queue_elems(self, txn, guild_id: int, room_id: int, user1_id: int, user2_id: int) -> None: ...
+    async def reorder_queue(self, txn, guild_id: int, room_id: int, elems: list) -> None: ...
+    async def edit_song(self, txn, guild_id: int, room_id: int, user_id: int, song: str) -> None: ...
+    async def clear_queue(self, txn, guild_id: int, room_id: int) -> None: ...
+    async def get_policy(self, txn, guild_id: int, room_id: int) -> str: ...
+    async def set_policy(self, txn, guild_id: int, room_id: int, policy: str) -> None: ...
+    async def set_weight(self, txn, guild_id: int, room_id: int, user_id: int, weight: int) -> None: ...
+
+class SqlQueueStore():
+    """Queues in the queue and room tables, read through the write-through QueueCache.
+
+    The txn handed to write() ops is an AsyncSession, so ops can use it for other tables too.
+    Every query is on one room and covered by an index starting with (guild_id, room_id), so a
+    room's queries never scan the other rooms' rows.
+    """
+
+    def __init__(self, db_router, queue_cache: QueueCache, write, default_policy: str = POLICY_FIFO, requeue_cooldown: float = 0, clock = time.time) -> None:
+        self.db_router = db_router
+        self.queue_cache = queue_cache
+        self.default_policy = default_policy
+        self.requeue_cooldown = requeue_cooldown
+        self.clock = clock
+        # write(guild_id, op) runs op(session) in a write transaction on the guild's shard,
+        # see KaraokeQueueBot._write.
+        self._write = write
+
+    async def open(self) -> None:
+        # Shards are opened by the router as they're used.
+        pass
+
+    async def write(self, guild_id: int, op):
+        return await self._write(guild_id, op)
+
+    async def get_state(self, guild_id: int, room_id: int) -> GuildQueueState:
+        return await self.queue_cache.get((guild_id, room_id), lambda key: self.load_state(*key))
+
+    async def close(self) -> None:
+        pass
+
+    async def load_state(self, guild_id: int, room_id: int) -> GuildQueueState:
+        async with self.db_router.session(guild_id) as session:
+            return await self._read_state(session, guild_id, room_id)
+
+    async def get_room_ids(self, guild_id: int) -> list:
+        async with self.db_router.session(guild_id) as session:
+            stmt = sa_future.select(QueueEntry.room_id).distinct().where(QueueEntry.guild_id == guild_id)
+            return (await session.execute(stmt)).scalars().all()
+
+    async def _read_state(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> GuildQueueState:
+        current_elem = await self.get_current(session, guild_id, room_id)
+        waiting = await self.get_waiting(session, guild_id, room_id)
+        room = await session.get(RoomEntry, (guild_id, room_id))
+        stmt = sa_future.select(SingerEntry.user_id, SingerEntry.turns, SingerEntry.weight) \
+            .where(SingerEntry.guild_id == guild_id) \
+            .where(SingerEntry.room_id == room_id)
+        singers = (await session.execute(stmt)).all()
+        entries = ([current_elem] if current_elem != None else []) + waiting
+        return GuildQueueState(
+            guild_id, entries, current_elem.id if current_elem != None else None,
+            await self.get_policy(session, guild_id, room_id), singers, room.current_since if room != None else None, room_id
+        )
+
+    def _stage_cache(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, op) -> None:
+        # op(state) runs against the cached GuildQueueState once the session commits.
+        self.queue_cache.stage(session.sync_session, (guild_id, room_id), op)
+
+    async def _get_room(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> RoomEntry:
+        # The room's row, added on its first write.
+        room = await session.get(RoomEntry, (guild_id, room_id))
+        if(room == None):
+            room = RoomEntry(guild_id=guild_id, room_id=room_id)
+            session.add(room)
+        return room
+
+    def _room_filter(self, stmt, guild_id: int, room_id: int):
+        return stmt.where(QueueEntry.guild_id == guild_id).where(QueueEntry.room_id == room_id)
+
+    def _eligible_filter(self, stmt):
+        # Leaves out requeued singers still cooling down.
+        return stmt.where(sa.or_(QueueEntry.eligible_at == None, QueueEntry.eligible_at <= self.clock()))
+
+    def _current_id_subquery(self, guild_id: int, room_id: int):
+        # Id of the room's current singer, or 0 (never a valid id) if nobody is up.
+        current_id = sa_future.select(RoomEntry.current_id) \
+            .where(RoomEntry.guild_id == guild_id) \
+            .where(RoomEntry.room_id == room_id) \
+            .scalar_subquery()
+        return sa.func.coalesce(current_id, 0)
+
+    def _waiting_stmt(self, guild_id: int, room_id: int):
+        return self._room_filter(sa_future.select(QueueEntry), guild_id, room_id) \
+            .where(QueueEntry.id != self._current_id_subquery(guild_id, room_id)) \
+            .order_by(QueueEntry.sort_key)
+
+    async def get_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> list:
+        current_elem = await self.get_current(session, guild_id, room_id)
+        waiting = await self.get_waiting(session, guild_id, room_id)
+        return ([current_elem] if current_elem != None else []) + waiting
+
+    async def get_waiting(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> list:
+        result = await session.execute(self._waiting_stmt(guild_id, room_id))
+        return result.scalars().all()
+
+    async def get_queue_length(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> int:
+        stmt = self._room_filter(sa_future.select(sa.func.count(QueueEntry.id)), guild_id, room_id) \
+            .where(QueueEntry.id != self._current_id_subquery(guild_id, room_id))
+        result = await session.execute(stmt)
+        return result.scalar_one()
+
+    async def get_queue_elem(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, user_id: int) -> QueueEntry:
+        stmt = self._room_filter(sa_future.select(QueueEntry), guild_id, room_id) \
+            .where(QueueEntry.user_id == user_id)
+        result = await session.execute(stmt)
+        return result.scalar_one()
+
+    async def check_in_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, user_id: int) -> bool:
+        stmt = self._room_filter(sa_future.select(sa.func.count(QueueEntry.id)), guild_id, room_id) \
+            .where(QueueEntry.user_id == user_id)
+        result = await session.execute(stmt)
+        return result.scalar_one() > 0
+
+    async def get_current(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> QueueEntry:
+        stmt = sa_future.select(QueueEntry) \
+            .join(RoomEntry, RoomEntry.current_id == QueueEntry.id) \
+            .where(RoomEntry.guild_id == guild_id) \
+            .where(RoomEntry.room_id == room_id)
+        result = await session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    async def set_current(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, elem: QueueEntry) -> None:
+        room = await self._get_room(session, guild_id, room_id)
+        room.current_id = elem.id if elem != None else None
+        room.current_since = self.clock() if elem != None else None
+        await session.flush()
+        self._stage_cache(session, guild_id, room_id, lambda state: state.set_current(room.current_id, room.current_since))
+
+    async def get_last_key(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> int:
+        stmt = self._room_filter(sa_future.select(sa.func.max(QueueEntry.sort_key)), guild_id, room_id)
+        result = await session.execute(stmt)
+        last_key = result.scalar_one()
+        return last_key if last_key != None else 0
+
+    async def get_neighbour_keys(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, exclude_id: int, queue_pos: int) -> tuple:
+        # Sort keys of the waiting entries that would sit directly before and after an
+        # entry placed at queue_pos (1-based), ignoring the entry being placed.
+        stmt = self._room_filter(sa_future.select(QueueEntry.sort_key), guild_id, room_id) \
+            .where(QueueEntry.id != self._current_id_subquery(guild_id, room_id)) \
+            .where(QueueEntry.id != exclude_id) \
+            .order_by(QueueEntry.sort_key) \
+            .offset(max(queue_pos - 2, 0)) \
+            .limit(2 if queue_pos > 1 else 1)
+        result = await session.execute(stmt)
+        keys = result.scalars().all()
+
+        if(queue_pos <= 1):
+            return (None, keys[0] if keys else None)
+        return (keys[0] if keys else None, keys[1] if len(keys) > 1 else None)
+
+    async def rebalance_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> None:
+        await self.reorder_queue(session, guild_id, room_id, await self.get_waiting(session, guild_id, room_id))
+
+    async def add_to_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, user_id: int, song: str = None, requeue = False) -> None:
+        sort_key = await self.get_last_key(session, guild_id, room_id) + QUEUE_KEY_GAP
+        elem = QueueEntry(
+            guild_id=guild_id,
+            room_id=room_id,
+            user_id=user_id,
+            song_name=song,
+            sort_key=sort_key,
+            requeue=requeue
+        )
+        session.add(elem)
+        self._stage_cache(session, guild_id, room_id, lambda state: state.put(elem))
+
+    async def add_many_to_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, entries: list, requeue = False) -> list:
+        # entries is a list of (user_id, song). Users already queued, or listed twice, are
+        # skipped. Returns the entries that were added.
+        stmt = self._room_filter(sa_future.select(QueueEntry.user_id), guild_id, room_id) \
+            .where(QueueEntry.user_id.in_([user_id for user_id, song in entries]))
+        seen = set((await session.execute(stmt)).scalars().all())
+
+        added = []
+        for user_id, song in entries:
+            if(user_id not in seen):
+                seen.add(user_id)
+                added.append((user_id, song))
+        if(not added):
+            return added
+
+        last_key = await self.get_last_key(session, guild_id, room_id)
+        rows = [
+            {
+                "guild_id": guild_id,
+                "room_id": room_id,
+                "user_id": user_id,
+                "song_name": song,
+                "sort_key": last_key + i * QUEUE_KEY_GAP,
+                "requeue": requeue
+            }
+            for i, (user_id, song) in enumerate(added, start=1)
+        ]
+        for i in range(0, len(rows), BULK_STATEMENT_ROWS):
+            await session.execute(sa.insert(QueueEntry).values(rows[i:i + BULK_STATEMENT_ROWS]))
+
+        # No RETURNING on this SQLAlchemy version, read the new rows back for their ids.
+        stmt = self._room_filter(sa_future.select(QueueEntry), guild_id, room_id) \
+            .where(QueueEntry.sort_key > last_key)
+        new_elems = (await session.execute(stmt)).scalars().all()
+
+        def update_state(state: GuildQueueState) -> None:
+            for elem in new_elems:
+                state.put(elem)
+        self._stage_cache(session, guild_id, room_id, update_state)
+        return added
+
+    async def reorder_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, elems: list) -> None:
+        # Gives elems evenly spaced sort keys in list order, one UPDATE per BULK_STATEMENT_ROWS.
+        if(not elems):
+            return
+
+        new_keys = {elem.id: queue_pos * QUEUE_KEY_GAP for queue_pos, elem in enumerate(elems, start=1)}
+        for i in range(0, len(elems), BULK_STATEMENT_ROWS):
+            chunk = {elem.id: new_keys[elem.id] for elem in elems[i:i + BULK_STATEMENT_ROWS]}
+            stmt = sa.update(QueueEntry) \
+                .where(QueueEntry.id.in_(list(chunk.keys()))) \
+                .values(sort_key=sa.case(chunk, value=QueueEntry.id)) \
+                .execution_options(synchronize_session=False)
+            await session.execute(stmt)
+
+        for elem in elems:
+            sa_orm.attributes.set_committed_value(elem, "sort_key", new_keys[elem.id])
+
+        def update_state(state: GuildQueueState) -> None:
+            for elem in elems:
+                state.put(elem)
+        self._stage_cache(session, guild_id, room_id, update_state)
+
+    async def remove_from_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, user_id: int) -> None:
+        elem = await self.get_queue_elem(session, guild_id, room_id, user_id)
+        current_elem = await self.get_current(session, guild_id, room_id)
+
+        await session.delete(elem)
+        await session.flush()
+        self._stage_cache(session, guild_id, room_id, lambda state: state.remove(elem.id))
+
+        # Removing the current singer hands their turn to whoever is next in line.
+        if(current_elem != None and current_elem.id == elem.id):
+            await self.promote_head(session, guild_id, room_id, elem.id)
+
+    async def get_policy(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> str:
+        room = await session.get(RoomEntry, (guild_id, room_id))
+        return room.policy if room != None and room.policy != None else self.default_policy
+
+    async def set_policy(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, policy: str) -> None:
+        room = await self._get_room(session, guild_id, room_id)
+        room.policy = policy
+        await session.flush()
+        self._stage_cache(session, guild_id, room_id, lambda state: state.set_policy(policy))
+
+    async def set_weight(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, user_id: int, weight: int) -> None:
+        stmt = sa_sqlite.insert(SingerEntry) \
+            .values(guild_id=guild_id, room_id=room_id, user_id=user_id, turns=0, weight=weight) \
+            .on_conflict_do_update(index_elements=[SingerEntry.guild_id, SingerEntry.room_id, SingerEntry.user_id], set_={"weight": weight})
+        await session.execute(stmt)
+        self._stage_cache(session, guild_id, room_id, lambda state: state.set_weight(user_id, weight))
+
+    async def count_turn(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, elem: QueueEntry) -> None:
+        user_id = elem.user_id
+        stmt = sa_sqlite.insert(SingerEntry) \
+            .values(guild_id=guild_id, room_id=room_id, user_id=user_id, turns=1, weight=DEFAULT_WEIGHT) \
+            .on_conflict_do_update(index_elements=[SingerEntry.guild_id, SingerEntry.room_id, SingerEntry.user_id], set_={"turns": SingerEntry.turns + 1})
+        await session.execute(stmt)
+        self._stage_cache(session, guild_id, room_id, lambda state: state.add_turn(user_id))
+
+    async def peek_next(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, exclude_ids: set) -> QueueEntry:
+        """Who a policy other than fifo puts next, leaving out exclude_ids.
+
+        Picked from the cached queue, which only has what's been committed, so entries this
+        session has already taken out of the queue have to be in exclude_ids.
+        """
+        state = self.queue_cache.peek((guild_id, room_id))
+        if(state is None and self.queue_cache.checkpoint(session.sync_session) == 0):
+            # Nothing written yet, so this session reads what's committed and it can be cached.
+            state = await self.queue_cache.get((guild_id, room_id), lambda key: self._read_state(session, *key))
+        elif(state is None):
+            state = await self._read_state(session, guild_id, room_id)
+        head = state.peek_next(exclude_ids, self.clock())
+        if(head == None):
+            return None
+        elem = await session.get(QueueEntry, head.id)
+        if(elem == None):
+            # The cache was behind after all, read the queue as this session sees it.
+            head = (await self._read_state(session, guild_id, room_id)).peek_next(exclude_ids, self.clock())
+            elem = await session.get(QueueEntry, head.id) if head != None else None
+        return elem
+
+    async def promote_head(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, exclude_id: int = 0) -> QueueEntry:
+        policy = await self.get_policy(session, guild_id, room_id)
+        await self.set_current(session, guild_id, room_id, None)
+        if(policy == POLICY_FIFO):
+            stmt = self._eligible_filter(self._waiting_stmt(guild_id, room_id).where(QueueEntry.id != exclude_id))
+            result = await session.execute(stmt.limit(1))
+            head = result.scalar_one_or_none()
+        else:
+            head = await self.peek_next(session, guild_id, room_id, {exclude_id})
+        await self.set_current(session, guild_id, room_id, head)
+        if(head != None):
+            await self.count_turn(session, guild_id, room_id, head)
+        return head
+
+    async def advance_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> QueueEntry:
+        # Runs on every /next, so it reads the room row, the current singer and whoever is
+        # next in line up front and writes everything back in one flush.
+        stmt = sa_future.select(RoomEntry, QueueEntry) \
+            .outerjoin(QueueEntry, QueueEntry.id == RoomEntry.current_id) \
+            .where(RoomEntry.guild_id == guild_id) \
+            .where(RoomEntry.room_id == room_id)
+        row = (await session.execute(stmt)).first()
+        room, current_elem = row if row != None else (None, None)
+
+        policy = room.policy if room != None and room.policy != None else self.default_policy
+        if(policy == POLICY_FIFO):
+            stmt = self._room_filter(sa_future.select(QueueEntry), guild_id, room_id) \
+                .where(QueueEntry.id != (current_elem.id if current_elem != None else 0)) \
+                .order_by(QueueEntry.sort_key) \
+                .limit(1)
+            head = (await session.execute(self._eligible_filter(stmt))).scalar_one_or_none()
+        else:
+            head = await self.peek_next(session, guild_id, room_id, {current_elem.id if current_elem != None else 0})
+
+        if(current_elem != None and not current_elem.requeue):
+            await session.delete(current_elem)
+        elif(current_elem != None and current_elem.requeue):
+            current_elem.sort_key = await self.get_last_key(session, guild_id, room_id) + QUEUE_KEY_GAP
+            current_elem.eligible_at = self.clock() + self.requeue_cooldown if self.requeue_cooldown else None
+            # A requeued singer with nobody else waiting goes straight back up, unless they
+            # have to cool down first.
+            if(head == None and current_elem.eligible_at == None):
+                head = current_elem
+
+        if(room == None):
+            room = RoomEntry(guild_id=guild_id, room_id=room_id)
+            session.add(room)
+        room.current_id = head.id if head != None else None
+        room.current_since = self.clock() if head != None else None
+        await session.flush()
+
+        def update_state(state: GuildQueueState) -> None:
+            if(current_elem != None and not current_elem.requeue):
+                state.remove(current_elem.id)
+            elif(current_elem != None):
+                state.put(current_elem)
+            state.set_current(room.current_id, room.current_since)
+        self._stage_cache(session, guild_id, room_id, update_state)
+        if(head != None):
+            await self.count_turn(session, guild_id, room_id, head)
+
+        return head
+
+    async def move_queue_elem(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, user_id: int, new_queue_pos: int) -> None:
+        # Position 0 belongs to the current singer; use swap_queue_elems to change who is up.
+        if(new_queue_pos < 1):
+            return
+
+        elem = await self.get_queue_elem(session, guild_id, room_id, user_id)
+        current_elem = await self.get_current(session, guild_id, room_id)
+
+        # Moving the current singer back into the queue hands their turn to whoever is next.
+        if(current_elem != None and current_elem.id == elem.id):
+            await self.promote_head(session, guild_id, room_id, elem.id)
+
+        prev_key, next_key = await self.get_neighbour_keys(session, guild_id, room_id, elem.id, new_queue_pos)
+        if(prev_key != None and next_key != None and next_key - prev_key < 2):
+            await self.rebalance_queue(session, guild_id, room_id)
+            prev_key, next_key = await self.get_neighbour_keys(session, guild_id, room_id, elem.id, new_queue_pos)
+
+        if(prev_key == None and next_key == None):
+            elem.sort_key = QUEUE_KEY_GAP
+        elif(prev_key == None):
+            elem.sort_key = next_key - QUEUE_KEY_GAP
+        elif(next_key == None):
+            elem.sort_key = prev_key + QUEUE_KEY_GAP
+        else:
+            elem.sort_key = (prev_key + next_key) // 2
+        self._stage_cache(session, guild_id, room_id, lambda state: state.put(elem))
+
+    async def swap_queue_elems(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, user1_id: int, user2_id: int) -> None:
+        elem1 = await self.get_queue_elem(session, guild_id, room_id, user1_id)
+        elem2 = await self.get_queue_elem(session, guild_id, room_id, user2_id)
+        current_elem = await self.get_current(session, guild_id, room_id)
+
+        elem1.sort_key, elem2.sort_key = elem2.sort_key, elem1.sort_key
+        self._stage_cache(session, guild_id, room_id, lambda state: (state.put(elem1), state.put(elem2)))
+        if(current_elem != None and current_elem.id == elem1.id):
+            await self.set_current(session, guild_id, room_id, elem2)
+        elif(current_elem != None and current_elem.id == elem2.id):
+            await self.set_current(session, guild_id, room_id, elem1)
+
+    async def edit_song(self, session: sa_async.AsyncSession, guild_id: int, room_id: int, user_id: int, song: str) -> None:
+        elem = await self.get_queue_elem(session, guild_id, room_id, user_id)
+        elem.song_name = song
+        self._stage_cache(session, guild_id, room_id, lambda state: state.put(elem))
+
+    async def clear_queue(self, session: sa_async.AsyncSession, guild_id: int, room_id: int) -> None:
+        stmt = sa.delete(QueueEntry) \
+            .where(QueueEntry.guild_id == guild_id) \
+            .where(QueueEntry.room_id == room_id) \
+            .execution_options(synchronize_session=False)
+        await session.execute(stmt)
+
+        # A cleared queue starts a new night, so everyone's turns start over too.
+        stmt = sa.update(SingerEntry) \
+            .where(SingerEntry.guild_id == guild_id) \
+            .where(SingerEntry.room_id == room_id) \
+            .values(turns=0) \
+            .execution_options(synchronize_session=False)
+        await session.execute(stmt)
+
+        await self.set_current(session, guild_id, room_id, None)
+        self._stage_cache(session, guild_id, room_id, lambda state: state.clear())
+
+    async def export_guild(self, guild_id: int, batch_rows: int):
+        async with self.db_router.session(guild_id) as session:
+            # Every batch is read in the session's one transaction, so they all see the
+            # same moment however long the export takes.
+            stmts = [
+                ("room", sa_future.select(RoomEntry.room_id, QueueEntry.user_id, RoomEntry.policy, RoomEntry.current_since)
+                    .outerjoin(QueueEntry, QueueEntry.id == RoomEntry.current_id)
+                    .where(RoomEntry.guild_id == guild_id)),
+                ("singer", sa_future.select(SingerEntry.room_id, SingerEntry.user_id, SingerEntry.turns, SingerEntry.weight)
+                    .where(SingerEntry.guild_id == guild_id)),
+                ("queue", sa_future.select(QueueEntry.room_id, QueueEntry.user_id, QueueEntry.song_name, QueueEntry.sort_key, QueueEntry.requeue, QueueEntry.eligible_at)
+                    .where(QueueEntry.guild_id == guild_id)
+                    .order_by(QueueEntry.room_id, QueueEntry.sort_key))
+            ]
+            for kind, stmt in stmts:
+                result = await session.stream(stmt)
+                async for partition in result.partitions(batch_rows):
+                    yield [[kind, *row] for row in partition]
+
+    async def import_guild(self, session: sa_async.AsyncSession, guild_id: int, batches) -> list:
+        room_ids = set()
+        for entry_type in (QueueEntry, RoomEntry, SingerEntry):
+            stmt = sa_future.select(entry_type.room_id).distinct().where(entry_type.guild_id == guild_id)
+            room_ids.update((await session.execute(stmt)).scalars().all())
+
+        # Like clear_queue, for every room at once.
+        await session.execute(sa.delete(QueueEntry).where(QueueEntry.guild_id == guild_id).execution_options(synchronize_session=False))
+        await session.execute(sa.update(SingerEntry).where(SingerEntry.guild_id == guild_id).values(turns=0).execution_options(synchronize_session=False))
+        await session.execute(sa.update(RoomEntry).where(RoomEntry.guild_id == guild_id).values(current_id=None, current_since=None).execution_options(synchronize_session=False))
+
+        current_user_ids = {}
+        for batch in batches:
+            rooms, singers, entries = [], [], []
+            for record in batch:
+                room_ids.add(record[1])
+                if(record[0] == "room"):
+                    rooms.append({"guild_id": guild_id, "room_id": record[1], "policy": record[3], "current_since": record[4]})
+                    if(record[2] != None):
+                        current_user_ids[record[1]] = record[2]
+                elif(record[0] == "singer"):
+                    singers.append({"guild_id": guild_id, "room_id": record[1], "user_id": record[2], "turns": record[3], "weight": record[4]})
+                elif(record[0] == "queue"):
+                    entries.append({
+                        "guild_id": guild_id,
+                        "room_id": record[1],
+                        "user_id": record[2],
+                        "song_name": record[3],
+                        "sort_key": record[4],
+                        "requeue": bool(record[5]),
+                        "eligible_at": record[6]
+                    })
+
+            # Executed with every row of the batch at once, so each statement is only compiled
+            # the once however many batches there are.
+            if(rooms):
+                stmt = sa_sqlite.insert(RoomEntry)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[RoomEntry.guild_id, RoomEntry.room_id],
+                    set_={"policy": stmt.excluded.policy, "current_since": stmt.excluded.current_since}
+                )
+                await session.execute(stmt, rooms)
+            if(singers):
+                stmt = sa_sqlite.insert(SingerEntry)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[SingerEntry.guild_id, SingerEntry.room_id, SingerEntry.user_id],
+                    set_={"turns": stmt.excluded.turns, "weight": stmt.excluded.weight}
+                )
+                await session.execute(stmt, singers)
+            if(entries):
+                await session.execute(sa.insert(QueueEntry), entries)
+
+        # Entries get new ids, so current singers are pointed at by user until they're in.
+        for room_id, user_id in current_user_ids.items():
+            current_id = self._room_filter(sa_future.select(QueueEntry.id), guild_id, room_id) \
+                .where(QueueEntry.user_id == user_id) \
+                .limit(1) \
+                .scalar_subquery()
+            stmt = sa.update(RoomEntry) \
+                .where(RoomEntry.guild_id == guild_id) \
+                .where(RoomEntry.room_id == room_id) \
+                .values(current_id=current_id) \
+                .execution_options(synchronize_session=False)
+            await session.execute(stmt)
+
+        for room_id in room_ids:
+            self.queue_cache.stage_invalidate(session.sync_session, (guild_id, room_id))
+        return sorted(room_ids)
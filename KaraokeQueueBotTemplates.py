@@ -0,0 +1,129 @@
+import asyncio
+import collections
+import logging
+import random
+import string
+
+DEFAULT_WITH_SONG = "{user} is up next! They'll be singing \"{song}\"!"
+DEFAULT_NO_SONG = "{user} is up next!"
+
+TEMPLATE_FIELDS = ("user", "song")
+
+class NextMsgTemplate():
+    """A 'next up' template parsed once into literal text and placeholders.
+
+    Renders the same as template.format(user=..., song=...) without re-parsing the template
+    on every /next. Raises ValueError for anything that could fail or blow up at render time:
+    unbalanced braces, unknown placeholders, conversions like {user!r} or format specs like
+    {song:>99999}. The template is rendered once with sample values to make sure.
+    """
+    __slots__ = ("template", "pieces", "fields")
+
+    _formatter = string.Formatter()
+
+    def __init__(self, template: str) -> None:
+        self.template = template
+        self.pieces = []
+        self.fields = set()
+
+        for literal, field_name, format_spec, conversion in self._formatter.parse(template):
+            if(field_name == None):
+                self.pieces.append((literal, None))
+                continue
+            if(field_name not in TEMPLATE_FIELDS):
+                raise ValueError(f"Unknown placeholder {{{field_name}}}, expected one of {', '.join('{' + i + '}' for i in TEMPLATE_FIELDS)}.")
+            # /next renders the template after the queue has already moved on, so nothing that
+            # can fail there, or pad a message out to gigabytes, gets in.
+            if(conversion or format_spec):
+                raise ValueError(f"Placeholders can't have conversions or formats, use just {{{field_name}}}.")
+            self.pieces.append((literal, field_name))
+            self.fields.add(field_name)
+
+        try:
+            self.render("@singer", "Song")
+        except Exception as e:
+            raise ValueError(f"The template can't be filled in: {e}")
+
+    def render(self, user: str, song: str) -> str:
+        values = {"user": user, "song": song}
+        out = []
+        for literal, field_name in self.pieces:
+            out.append(literal)
+            if(field_name != None):
+                out.append(str(values[field_name]))
+        return "".join(out)
+
+DEFAULT_TEMPLATES = {
+    True: NextMsgTemplate(DEFAULT_WITH_SONG),
+    False: NextMsgTemplate(DEFAULT_NO_SONG)
+}
+
+class GuildTemplates():
+    def __init__(self, guild_id: int, entries: list) -> None:
+        self.guild_id = guild_id
+        self.with_song = []
+        self.no_song = []
+
+        for entry in entries:
+            try:
+                template = NextMsgTemplate(entry.msg)
+            except ValueError as e:
+                logging.warning(f"Skipping broken 'next up' template \"{entry.name}\" in guild {guild_id}: {e}")
+                continue
+            (self.with_song if entry.has_song else self.no_song).append(template)
+
+    def choose(self, has_song: bool) -> NextMsgTemplate:
+        bucket = self.with_song if has_song else self.no_song
+        if(bucket):
+            return random.choice(bucket)
+        return DEFAULT_TEMPLATES[has_song]
+
+class TemplateCache():
+    """Compiled 'next up' templates for the most recently advanced guilds.
+
+    Only /next reads from the cache and only nextmsg add/remove change templates. /next runs
+    on its room's executor and nextmsg add/remove on the guild's, so they can overlap: the
+    writes invalidate both inside the transaction and once it has committed, and a load that
+    an invalidation raced with is returned but not cached. Lookups that miss while a guild's
+    templates are already loading wait for that load instead of starting another.
+    """
+
+    def __init__(self, max_guilds: int = 1024) -> None:
+        self.max_guilds = max_guilds
+        self.guilds = collections.OrderedDict()
+        self.generations = collections.Counter()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, guild_id: int, loader) -> GuildTemplates:
+        templates = self.guilds.get(guild_id)
+        if(templates is not None):
+            self.hits += 1
+            self.guilds.move_to_end(guild_id)
+            return templates
+
+        self.misses += 1
+        generation = self.generations[guild_id]
+        loading = self._loading.get(guild_id)
+        if(loading is not None and loading[0] == generation):
+            return await asyncio.shield(loading[1])
+
+        future = asyncio.ensure_future(loader(guild_id))
+        self._loading[guild_id] = (generation, future)
+        try:
+            templates = await asyncio.shield(future)
+        finally:
+            if(self._loading.get(guild_id, (None, None))[1] is future):
+                del self._loading[guild_id]
+        if(self.generations[guild_id] != generation):
+            return templates
+
+        self.guilds[guild_id] = templates
+        while(len(self.guilds) > self.max_guilds):
+            self.guilds.popitem(last=False)
+        return templates
+
+    def invalidate(self, guild_id: int) -> None:
+        self.guilds.pop(guild_id, None)
+        self.generations[guild_id] += 1
@@ -0,0 +1,32 @@
+import nextcord
+
+from KaraokeQueueBotDispatch import LANE_CONFIRM
+
+class QueueListView(nextcord.ui.View):
+    """Previous/next buttons under a paginated queue list.
+
+    Every click re-renders from the room's current queue, so paging through a list that
+    changed in the meantime shows the queue as it is now, not as it was when listed.
+    """
+
+    def __init__(self, queue_bot, guild_id: int, room_id: int, page: int) -> None:
+        super().__init__(timeout=300)
+        self.queue_bot = queue_bot
+        self.guild_id = guild_id
+        self.room_id = room_id
+        self.page = page
+
+    async def show_page(self, interaction: nextcord.Interaction, page: int) -> None:
+        content, page, page_count = await self.queue_bot.render_queue_page(self.guild_id, self.room_id, page)
+        self.page = page
+        self.previous_page.disabled = page <= 1
+        self.next_page.disabled = page >= page_count
+        await self.queue_bot.dispatcher.send(LANE_CONFIRM, lambda: interaction.response.edit_message(content=content, view=self))
+
+    @nextcord.ui.button(label="Previous", style=nextcord.ButtonStyle.secondary)
+    async def previous_page(self, button: nextcord.ui.Button, interaction: nextcord.Interaction) -> None:
+        await self.show_page(interaction, self.page - 1)
+
+    @nextcord.ui.button(label="Next", style=nextcord.ButtonStyle.secondary)
+    async def next_page(self, button: nextcord.ui.Button, interaction: nextcord.Interaction) -> None:
+        await self.show_page(interaction, self.page + 1)
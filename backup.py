@@ -0,0 +1,138 @@
+"""Exports and imports a guild's queues, and takes online backups of the whole database.
+
+Usage:
+    python backup.py [--config PATH] export GUILD_ID FILE
+    python backup.py [--config PATH] import GUILD_ID FILE
+    python backup.py [--config PATH] backup DEST
+
+export writes the guild's queues and 'next up' templates to FILE in the same format as
+/queue export, and import replaces them with FILE's like /queue import. With the sqlite queue
+backend an export can run alongside the bot, but an import has to be run with the bot stopped
+or it will keep serving the queues it has cached. The journal backend keeps its queues in the
+bot's memory, so stop the bot for both.
+
+backup copies the database, or every shard into the directory DEST when sharding, with
+SQLite's online backup API. It's safe to run while the bot is up and doesn't hold up its
+writes. Queues kept by the journal backend aren't in the database, export them instead.
+"""
+
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import os.path
+import sys
+import time
+import yaml
+
+import KaraokeQueueBot
+from KaraokeQueueBotBackup import ExportError, backup_database, export_guild, import_guild
+from KaraokeQueueBotCache import QueueCache
+from KaraokeQueueBotJournal import JournalQueueStore
+from KaraokeQueueBotShards import ShardRouter
+from KaraokeQueueBotStorage import begin_write
+from KaraokeQueueBotStore import SqlQueueStore
+
+def open_stores(config: KaraokeQueueBot.KaraokeQueueBotConfig) -> tuple:
+    sharding = config.sharding
+    router = ShardRouter(config.db_path, config.storage, sharding.mode, sharding.shard_dir, sharding.shard_count, sharding.max_open_shards)
+
+    async def write(guild_id: int, op):
+        async with router.use(guild_id) as shard, shard.write_lock, shard.sessionmaker() as session, session.begin():
+            await begin_write(session)
+            return await op(session)
+
+    if(config.storage.queue_backend == "journal"):
+        queue_store = JournalQueueStore(config.storage.journal_dir, config.storage.snapshot_every, config.queue_policy)
+    else:
+        # Nothing is read through the cache, so it doesn't need any room.
+        queue_store = SqlQueueStore(router, QueueCache(0), write, config.queue_policy)
+    return (router, queue_store, write)
+
+async def run_export(config: KaraokeQueueBot.KaraokeQueueBotConfig, guild_id: int, path: str) -> int:
+    router, queue_store, write = open_stores(config)
+    try:
+        await router.prepare()
+        await queue_store.open()
+        with open(path + ".tmp", "wb") as export_file:
+            counts = await export_guild(export_file, guild_id, queue_store, router, time.time())
+        os.replace(path + ".tmp", path)
+    finally:
+        await queue_store.close()
+        await router.close()
+
+    print(f"Exported guild {guild_id} to {path}: {', '.join(f'{count} {kind}' for kind, count in counts.items())}.")
+    return 0
+
+async def run_import(config: KaraokeQueueBot.KaraokeQueueBotConfig, guild_id: int, path: str) -> int:
+    router, queue_store, write = open_stores(config)
+    try:
+        await router.prepare()
+        await queue_store.open()
+        with open(path, "rb") as export_file:
+            counts, room_ids = await import_guild(export_file, guild_id, queue_store, write)
+    except ExportError as e:
+        logging.error(f"{path} can't be imported: {e}")
+        return 1
+    finally:
+        await queue_store.close()
+        await router.close()
+
+    print(f"Imported {path} into guild {guild_id}: {', '.join(f'{count} {kind}' for kind, count in counts.items())}, {len(room_ids)} rooms changed.")
+    return 0
+
+def run_backup(config: KaraokeQueueBot.KaraokeQueueBotConfig, dest: str) -> int:
+    if(config.sharding.mode == "off"):
+        if(not config.db_path or not os.path.exists(config.db_path)):
+            logging.error(f"Database {config.db_path!r} not found.")
+            return 1
+        copies = [(config.db_path, dest)]
+    else:
+        os.makedirs(dest, exist_ok=True)
+        copies = [(path, os.path.join(dest, os.path.basename(path))) for path in sorted(glob.glob(os.path.join(config.sharding.shard_dir, "*.db")))]
+
+    start = time.perf_counter()
+    pages = 0
+    for source_path, dest_path in copies:
+        pages += backup_database(source_path, dest_path, config.storage.busy_timeout_ms)
+        logging.info(f"Backed up {source_path} to {dest_path}.")
+    print(f"Backed up {len(copies)} databases, {pages} pages, to {dest} in {time.perf_counter() - start:.1f}s.")
+    return 0
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export, import and back up the bot's queues.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.yaml"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write a guild's queues and templates to a file.")
+    export_parser.add_argument("guild_id", type=int)
+    export_parser.add_argument("file")
+    import_parser = subparsers.add_parser("import", help="Replace a guild's queues and templates with an export. Stop the bot first.")
+    import_parser.add_argument("guild_id", type=int)
+    import_parser.add_argument("file")
+    backup_parser = subparsers.add_parser("backup", help="Copy the database while the bot is running.")
+    backup_parser.add_argument("dest", help="File to write, or directory when sharding.")
+    args = parser.parse_args()
+
+    if(not os.path.exists(args.config)):
+        logging.error(f"Config file {args.config} not found.")
+        return 1
+    try:
+        with open(args.config, "r", encoding="UTF-8") as config_file:
+            config = KaraokeQueueBot.KaraokeQueueBotConfig.from_yaml_data(yaml.load(config_file, Loader=yaml.Loader))
+    except (yaml.YAMLError, KaraokeQueueBot.KaraokeQueueBotConfigError) as e:
+        logging.error(f"Invalid config file {args.config}: {e}")
+        return 1
+
+    if(args.command == "export"):
+        return asyncio.run(run_export(config, args.guild_id, args.file))
+    if(args.command == "import"):
+        if(not os.path.exists(args.file)):
+            logging.error(f"Export {args.file} not found.")
+            return 1
+        return asyncio.run(run_import(config, args.guild_id, args.file))
+    return run_backup(config, args.dest)
+
+if __name__ == "__main__":
+    sys.exit(main())
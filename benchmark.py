@@ -0,0 +1,1872 @@
+"""Offline checks and benchmarks that drive the bot's commands without a Discord connection.
+
+Usage:
+    python benchmark.py plans [--db PATH]
+    python benchmark.py cache [--guilds N] [--queue-size N] [--reads N] [--cache-size-mb N]
+    python benchmark.py next [--guilds N] [--queue-size N]
+    python benchmark.py stress [--db PATH] [--guilds N] [--users N] [--rounds N] [--seed N] [--queue-policy POLICY] [storage options]
+    python benchmark.py writes [--db PATH] [--guilds N] [--ops N] [--noisy-size N] [storage options]
+    python benchmark.py board [--guilds N] [--bursts N] [--burst-size N] [--debounce-ms N]
+    python benchmark.py dispatch [--channels N] [--confirms N] [--edits N] [--edge-429s]
+    python benchmark.py startup [--guilds N] [--queue-size N] [--runs N] [storage options]
+    python benchmark.py catalog [--tracks N] [--searches N] [--budget-ms N] [--seed N]
+    python benchmark.py history [--rows N] [--guilds N] [--singers N] [--songs N] [--stats N] [--retention-days N] [--seed N]
+    python benchmark.py policies [--singers N] [--queue-size N] [--nexts N] [storage options]
+    python benchmark.py rooms [--rooms N] [--singers N] [--rounds N] [--interval-ms N] [--max-slowdown X] [--seed N] [storage options]
+    python benchmark.py timers [--timers N] [--guilds N] [--seed N] [storage options]
+    python benchmark.py export [--rooms N] [--queue-size N] [--templates N] [--memory-budget-mb N] [--seed N] [storage options]
+    python benchmark.py suite [--queue-sizes N,N,..] [--guild-counts N,N,..] [--databases memory,disk,journal]
+                              [--samples N] [--concurrency N] [--max-entries N] [--seed N] [--out PATH]
+
+Storage options (see the storage section of sample_config.yaml):
+    --journal-mode MODE --synchronous MODE --pool-size N --group-commit-ms N
+    --queue-backend sqlite|journal --journal-dir PATH --snapshot-every N
+    --shard-mode off|guild|fixed --shard-count N --max-open-shards N
+"""
+
+import argparse
+import asyncio
+import collections
+import csv
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import aiohttp.web
+import sqlalchemy as sa
+
+import nextcord
+from nextcord.ext import commands
+
+import KaraokeQueueBot
+from KaraokeQueueBotObjects import MAIN_ROOM_ID, QueueEntry, RoomEntry, PerformanceEntry, SingerStatsEntry, SongStatsEntry, GuildStatsEntry
+from KaraokeQueueBotCache import GuildQueueState
+from KaraokeQueueBotJournal import JournalQueueStore
+from KaraokeQueueBotCatalog import SongCatalog, build_catalog, read_tracks
+from KaraokeQueueBotDispatch import LANE_ANNOUNCE, LANE_CONFIRM, LANE_EDIT, OutboundDispatcher, TokenBucket
+from KaraokeQueueBotHistory import PerformanceHistory
+from KaraokeQueueBotPolicies import DEFAULT_WEIGHT, POLICIES, POLICY_FIFO, POLICY_NEWCOMERS, POLICY_ROTATION, POLICY_WEIGHTED
+from KaraokeQueueBotScheduler import TimerScheduler
+from KaraokeQueueBotBackup import ExportError, backup_database
+from KaraokeQueueBotStore import BULK_STATEMENT_ROWS
+
+class FakeVoiceState():
+    def __init__(self, channel) -> None:
+        self.channel = channel
+
+class FakeUser():
+    def __init__(self, user_id: int, voice_channel_id: int = None) -> None:
+        self.id = user_id
+        self.voice = FakeVoiceState(FakeChannel(voice_channel_id)) if voice_channel_id != None else None
+
+class FakeMessage():
+    def __init__(self, message_id: int, channel) -> None:
+        self.id = message_id
+        self.channel = channel
+
+class FakeChannel():
+    def __init__(self, channel_id: int) -> None:
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        self.sent.append(content)
+        return FakeMessage(len(self.sent), self)
+
+class FakeResponse():
+    def __init__(self, interaction) -> None:
+        self.interaction = interaction
+
+    async def send_autocomplete(self, choices: list) -> None:
+        self.interaction.sent.append(choices)
+
+    async def defer(self, **kwargs) -> None:
+        pass
+
+class FakeAttachment():
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    async def save(self, fp, seek_begin: bool = True) -> int:
+        fp.write(self.data)
+        if(seek_begin):
+            fp.seek(0)
+        return len(self.data)
+
+class FakeInteraction():
+    # Just enough of nextcord.Interaction for the command callbacks.
+    def __init__(self, guild_id: int, user_id: int, voice_channel_id: int = None) -> None:
+        self.guild_id = guild_id
+        self.user = FakeUser(user_id, voice_channel_id)
+        self.channel = FakeChannel(guild_id)
+        self.response = FakeResponse(self)
+        self.sent = []
+        self.files = []
+
+    async def send(self, content: str = None, **kwargs) -> None:
+        self.sent.append(content)
+        if("file" in kwargs):
+            self.files.append(kwargs["file"].fp.read())
+
+class StatementCounter():
+    # Counts statements on every engine, whichever shards they belong to. Those issued by the
+    # history's background writes are also counted in history_count.
+    def __init__(self) -> None:
+        self.count = 0
+        self.history_count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.count += 1
+        task = asyncio.current_task()
+        if(task is not None and task.get_coro().__qualname__ == PerformanceHistory._write_pending.__qualname__):
+            self.history_count += 1
+
+    def __enter__(self):
+        sa.event.listen(sa.engine.Engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        sa.event.remove(sa.engine.Engine, "before_cursor_execute", self._on_execute)
+
+def make_queue_bot(db_path: str, cache_size_mb: int = 16, storage: KaraokeQueueBot.KaraokeQueueBotStorageConfig = None, sharding: KaraokeQueueBot.KaraokeQueueBotShardingConfig = None, guild_ids: list = None, board_debounce_ms: int = 2000, song_catalog_path: str = None, queue_policy: str = POLICY_FIFO, history_retention_days: int = 0, auto_advance_minutes: float = 0, idle_queue_expiry_hours: float = 0, requeue_cooldown_minutes: float = 0, clock = time.time) -> KaraokeQueueBot.KaraokeQueueBot:
+    # Stress runs queue hundreds of commands at once, which would all count as slow.
+    metrics = KaraokeQueueBot.KaraokeQueueBotMetricsConfig(slow_command_ms=0)
+    # Fake interactions have no rate limits to stay under.
+    dispatch = KaraokeQueueBot.KaraokeQueueBotDispatchConfig(global_limit=10 ** 9, channel_limit=10 ** 9, max_in_flight=10 ** 9)
+    config = KaraokeQueueBot.KaraokeQueueBotConfig(None, db_path, logging.WARNING, guild_ids if guild_ids else [], cache_size_mb, 0, storage, metrics, sharding, board_debounce_ms, dispatch, song_catalog_path, queue_policy, history_retention_days, auto_advance_minutes, idle_queue_expiry_hours, requeue_cooldown_minutes)
+    return KaraokeQueueBot.KaraokeQueueBot(commands.Bot(), config, clock)
+
+def run_on_bot_loop(queue_bot: KaraokeQueueBot.KaraokeQueueBot, coro):
+    # Like bot.run(), so the bot's startup task runs alongside the benchmark.
+    return queue_bot.bot.loop.run_until_complete(coro)
+
+def with_option_defaults(callback):
+    # Discord fills in options left out of a command, calling the callback directly doesn't.
+    defaults = {}
+    for name, param in inspect.signature(callback).parameters.items():
+        if(isinstance(param.default, nextcord.SlashOption)):
+            default = param.default.default
+            defaults[name] = None if default is nextcord.utils.MISSING else default
+
+    async def call(interaction, **kwargs):
+        return await callback(interaction, **{**defaults, **kwargs})
+    return call
+
+def get_callbacks(queue_bot: KaraokeQueueBot.KaraokeQueueBot) -> dict:
+    # Maps "queue add", "next", ... to the registered command callbacks.
+    callbacks = {}
+    for command in queue_bot.bot._application_commands_to_add:
+        name = command.callback.__name__
+        callbacks[name] = with_option_defaults(command.callback)
+        for child_name, child in command.children.items():
+            callbacks[f"{name} {child_name}"] = with_option_defaults(child.callback)
+    return callbacks
+
+async def run_command_sample(callbacks: dict, guild_id: int) -> None:
+    # One call of every command, with enough singers queued that every branch touches the db.
+    for user_id in range(1, 6):
+        await callbacks["queue add"](FakeInteraction(guild_id, user_id), song=f"Song {user_id}", requeue=user_id == 1)
+    await callbacks["queue add-someone"](FakeInteraction(guild_id, 1), user=FakeUser(6), song=None, requeue=False)
+    await callbacks["next"](FakeInteraction(guild_id, 1))
+    await callbacks["current"](FakeInteraction(guild_id, 1))
+    await callbacks["stats"](FakeInteraction(guild_id, 1), user=None)
+    await callbacks["stats"](FakeInteraction(guild_id, 1), user=FakeUser(1))
+    await callbacks["queue list"](FakeInteraction(guild_id, 1), public=False, page=1)
+    await callbacks["queue move"](FakeInteraction(guild_id, 1), user=FakeUser(5), position=1)
+    await callbacks["queue swap"](FakeInteraction(guild_id, 1), user1=FakeUser(2), user2=FakeUser(4))
+    await callbacks["queue sink"](FakeInteraction(guild_id, 3))
+    await callbacks["queue edit-song"](FakeInteraction(guild_id, 3), song="Another Song")
+    await callbacks["queue remove"](FakeInteraction(guild_id, 4))
+    await callbacks["queue remove-someone"](FakeInteraction(guild_id, 1), user=FakeUser(6))
+    await callbacks["queue add-many"](FakeInteraction(guild_id, 1), users="<@7> Song 7 <@8> <@2>", requeue=False)
+    await callbacks["queue reorder"](FakeInteraction(guild_id, 1), order="<@8> <@3>")
+    await callbacks["queue shuffle"](FakeInteraction(guild_id, 1))
+    await callbacks["queue weight"](FakeInteraction(guild_id, 1), user=FakeUser(3), weight=2)
+    await callbacks["queue policy"](FakeInteraction(guild_id, 1), policy=POLICY_WEIGHTED)
+    await callbacks["queue policy"](FakeInteraction(guild_id, 1), policy=None)
+    await callbacks["next"](FakeInteraction(guild_id, 1))
+    await callbacks["queue remove"](FakeInteraction(guild_id, 8))
+    await callbacks["queue policy"](FakeInteraction(guild_id, 1), policy=POLICY_FIFO)
+    await callbacks["nextmsg add"](FakeInteraction(guild_id, 1), template="{user} sings {song}", name="template")
+    await callbacks["nextmsg list"](FakeInteraction(guild_id, 1))
+    await callbacks["board show"](FakeInteraction(guild_id, 1), size=5)
+    export_interaction = FakeInteraction(guild_id, 1)
+    await callbacks["queue export"](export_interaction)
+    await callbacks["queue import"](FakeInteraction(guild_id, 1), file=FakeAttachment(export_interaction.files[0]))
+    await callbacks["next"](FakeInteraction(guild_id, 1))
+    await callbacks["queue clear"](FakeInteraction(guild_id, 1))
+    await callbacks["board remove"](FakeInteraction(guild_id, 1))
+
+def full_scans(plan: list) -> list:
+    """The steps of an EXPLAIN QUERY PLAN that read a whole table."""
+    return [step for step in plan if step.startswith("SCAN") and step != "SCAN CONSTANT ROW"]
+
+async def collect_query_plans(queue_bot: KaraokeQueueBot.KaraokeQueueBot) -> dict:
+    """Runs every command and returns the query plan of each statement they issued, as a list
+    of steps by statement. Closes the bot."""
+    callbacks = get_callbacks(queue_bot)
+    # Creating the schema reads sqlite_master, which isn't a command's query.
+    await queue_bot.startup_task
+
+    statements = {}
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        if(statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))):
+            statements.setdefault(statement, parameters)
+    sa.event.listen(sa.engine.Engine, "before_cursor_execute", record_statement)
+
+    try:
+        # Give the planner a second guild's rows to skip over.
+        await run_command_sample(callbacks, 2)
+        await run_command_sample(callbacks, 1)
+        await queue_bot.history.flush()
+    finally:
+        sa.event.remove(sa.engine.Engine, "before_cursor_execute", record_statement)
+
+    plans = {}
+    async with queue_bot.db_router.use(1) as shard, shard.engine.connect() as conn:
+        for statement, parameters in statements.items():
+            result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plans[statement] = [row[3] for row in result]
+
+    await queue_bot.close()
+    return plans
+
+async def check_query_plans(queue_bot: KaraokeQueueBot.KaraokeQueueBot) -> int:
+    """Runs every command and fails if any statement it issued needs a full table scan."""
+    plans = await collect_query_plans(queue_bot)
+    failures = 0
+    for statement, plan in plans.items():
+        if(full_scans(plan)):
+            failures += 1
+            print(f"FULL SCAN: {' '.join(statement.split())}")
+            for step in plan:
+                print(f"    {step}")
+
+    print(f"Checked {len(plans)} statements, {failures} with full table scans.")
+    return 1 if failures else 0
+
+async def check_cache(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, queue_size: int, reads: int) -> int:
+    """Fills some guilds, then reports how many statements repeated read commands still issue."""
+    callbacks = get_callbacks(queue_bot)
+    for guild_id in range(1, guilds + 1):
+        for user_id in range(1, queue_size + 1):
+            await callbacks["queue add"](FakeInteraction(guild_id, user_id), song=f"Song {user_id}", requeue=False)
+        await callbacks["next"](FakeInteraction(guild_id, 1))
+    await queue_bot.history.flush()
+
+    with StatementCounter() as counter:
+        for i in range(reads):
+            guild_id = i % guilds + 1
+            await callbacks["queue list"](FakeInteraction(guild_id, 1), public=False, page=1)
+            await callbacks["current"](FakeInteraction(guild_id, 1))
+
+    await queue_bot.close()
+    stats = queue_bot.queue_cache.stats()
+    print(f"{reads * 2} read commands issued {counter.count} statements.")
+    print(", ".join(f"{key}={value}" for key, value in stats.items()))
+    return 0
+
+# Statements a warmed up /next may issue: BEGIN, the guild and current singer, the next in
+# line, the requeued singer's new sort key, the flush (guild pointer, delete or update), then
+# counting the new singer's turn.
+NEXT_STATEMENT_BUDGET = 7
+# And recording the finished turn afterwards: BEGIN, the performance, then its singer's, song's
+# and guild's totals.
+HISTORY_STATEMENT_BUDGET = 5
+
+async def count_next_statements(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, queue_size: int) -> tuple:
+    """Counts the statements issued by each warmed up /next and by recording its finished turn.
+
+    Returns (counts, history_counts, sent), sent being what a /next right after a guild's
+    templates changed replied, which should be ["Song by <@1>"]. Closes the bot.
+    """
+    callbacks = get_callbacks(queue_bot)
+
+    for guild_id in range(1, guilds + 1):
+        await callbacks["nextmsg add"](FakeInteraction(guild_id, 1), template="{user} takes the stage with {song}", name="song")
+        await callbacks["nextmsg add"](FakeInteraction(guild_id, 1), template="{user} takes the stage", name="no-song")
+        for user_id in range(1, queue_size + 1):
+            song = f"Song {user_id}" if user_id % 2 else None
+            await callbacks["queue add"](FakeInteraction(guild_id, user_id), song=song, requeue=user_id % 3 == 0)
+        # The first /next loads the guild's templates.
+        await callbacks["next"](FakeInteraction(guild_id, 1))
+
+    await queue_bot.history.flush()
+    counts = []
+    history_counts = []
+    for i in range(queue_size):
+        for guild_id in range(1, guilds + 1):
+            with StatementCounter() as counter:
+                await callbacks["next"](FakeInteraction(guild_id, 1))
+                # Written in the background, waited for so it's counted here and not in the next call.
+                await queue_bot.history.flush()
+            counts.append(counter.count - counter.history_count)
+            history_counts.append(counter.history_count)
+
+    # Changing a guild's templates has to show up on its very next /next.
+    await callbacks["queue clear"](FakeInteraction(1, 1))
+    await callbacks["queue add"](FakeInteraction(1, 1), song="Song", requeue=False)
+    await callbacks["nextmsg remove"](FakeInteraction(1, 1), name="song")
+    await callbacks["nextmsg add"](FakeInteraction(1, 1), template="{song} by {user}", name="reversed")
+    interaction = FakeInteraction(1, 1)
+    await callbacks["next"](interaction)
+
+    await queue_bot.close()
+    return (counts, history_counts, interaction.sent)
+
+async def check_next(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, queue_size: int) -> int:
+    """Counts the statements issued by each /next and fails if any goes over the budget."""
+    counts, history_counts, sent = await count_next_statements(queue_bot, guilds, queue_size)
+    failures = 0
+    if(sent != ["Song by <@1>"]):
+        failures += 1
+        print(f"/next used a stale template: {sent}")
+
+    over_budget = [count for count in counts if count > NEXT_STATEMENT_BUDGET]
+    history_over_budget = [count for count in history_counts if count > HISTORY_STATEMENT_BUDGET]
+    failures += len(over_budget) + len(history_over_budget)
+    print(f"{len(counts)} /next calls issued {sum(counts)} statements: "
+          f"mean {statistics.mean(counts):.2f}, max {max(counts)}, budget {NEXT_STATEMENT_BUDGET}.")
+    print(f"Recording their history issued {sum(history_counts)}: "
+          f"mean {statistics.mean(history_counts):.2f}, max {max(history_counts)}, budget {HISTORY_STATEMENT_BUDGET}.")
+    print(f"{len(over_budget)} calls and {len(history_over_budget)} history writes over budget, "
+          f"template cache hits={queue_bot.template_cache.hits} misses={queue_bot.template_cache.misses}")
+    return 1 if failures else 0
+
+async def recover_journal_copy(queue_bot: KaraokeQueueBot.KaraokeQueueBot, tmp_dir: str) -> JournalQueueStore:
+    # Recovers a copy of the journal, as if the bot had crashed right now.
+    copy_dir = os.path.join(tmp_dir, "recovered")
+    shutil.rmtree(copy_dir, ignore_errors=True)
+    shutil.copytree(queue_bot.queue_store.journal_dir, copy_dir)
+    store = JournalQueueStore(copy_dir, default_policy=queue_bot.queue_store.default_policy)
+    await store.open()
+    return store
+
+async def check_queue_consistency(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guild_id: int, recovered: JournalQueueStore = None, room_id: int = MAIN_ROOM_ID) -> list:
+    """Returns a description of everything wrong with a room's queue, in the db and in the cache.
+
+    With the journal backend the in-memory queue is checked against the queue recovered from
+    the journal instead.
+    """
+    errors = []
+    if(recovered != None):
+        durable = recovered.states.get((guild_id, room_id), GuildQueueState(guild_id, [], None, room_id=room_id))
+        entries = list(durable.entries.values())
+        current_id = durable.current_id
+        current_elem = durable.get_current()
+        waiting = sorted(durable.get_waiting(), key=lambda elem: elem.sort_key)
+        turns = durable.turns
+        state = queue_bot.queue_store.states.get((guild_id, room_id))
+    else:
+        async with queue_bot.db_router.session(guild_id) as session:
+            entries = (await session.execute(sa.select(QueueEntry).where(QueueEntry.guild_id == guild_id, QueueEntry.room_id == room_id))).scalars().all()
+            room = await session.get(RoomEntry, (guild_id, room_id))
+            current_elem = await queue_bot.queue_store.get_current(session, guild_id, room_id)
+            waiting = await queue_bot.queue_store.get_waiting(session, guild_id, room_id)
+        current_id = room.current_id if room != None else None
+        turns = (await queue_bot.queue_store.load_state(guild_id, room_id)).turns
+        state = queue_bot.queue_cache.states.get((guild_id, room_id))
+
+    user_ids = [elem.user_id for elem in entries]
+    if(len(user_ids) != len(set(user_ids))):
+        errors.append(f"guild {guild_id} room {room_id}: users queued more than once: {sorted(user_ids)}")
+    if(current_id != None and current_elem == None):
+        errors.append(f"guild {guild_id} room {room_id}: current singer {current_id} is not in the queue")
+    sort_keys = [elem.sort_key for elem in waiting]
+    if(len(sort_keys) != len(set(sort_keys))):
+        errors.append(f"guild {guild_id} room {room_id}: duplicate sort keys {sort_keys}")
+
+    if(state != None):
+        cached_current = state.get_current()
+        if((cached_current.id if cached_current else None) != (current_elem.id if current_elem else None)):
+            errors.append(f"guild {guild_id} room {room_id}: cached current singer differs from what's stored")
+        cached_waiting = sorted(state.get_waiting(), key=lambda elem: elem.sort_key)
+        if([(elem.id, elem.user_id, elem.song_name) for elem in cached_waiting] != [(elem.id, elem.user_id, elem.song_name) for elem in waiting]):
+            errors.append(f"guild {guild_id} room {room_id}: cached queue differs from what's stored")
+        if(state.turns != turns):
+            errors.append(f"guild {guild_id} room {room_id}: cached turns {state.turns} differ from what's stored {turns}")
+    return errors
+
+async def stress_errors(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, users: int, rounds: int, seed: int, tmp_dir: str) -> list:
+    """Fires concurrent commands at every guild and returns a description of every way the
+    queues ended up inconsistent. Closes the bot."""
+    callbacks = get_callbacks(queue_bot)
+    rng = random.Random(seed)
+    errors = []
+
+    async def gather_calls(calls: list) -> None:
+        rng.shuffle(calls)
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        errors.extend(f"command failed: {result!r}" for result in results if isinstance(result, Exception))
+
+    def random_call(guild_id: int):
+        user_id = rng.randint(1, users)
+        other_id = rng.randint(1, users)
+        interaction = FakeInteraction(guild_id, user_id)
+        return rng.choice([
+            lambda: callbacks["queue add"](interaction, song=f"Song {user_id}", requeue=rng.random() < 0.3),
+            lambda: callbacks["queue remove"](interaction),
+            lambda: callbacks["queue sink"](interaction),
+            lambda: callbacks["queue edit-song"](interaction, song="Edited"),
+            lambda: callbacks["queue move"](interaction, user=FakeUser(other_id), position=rng.randint(1, users)),
+            lambda: callbacks["queue swap"](interaction, user1=FakeUser(user_id), user2=FakeUser(other_id)),
+            lambda: callbacks["queue list"](interaction, public=False, page=1),
+            lambda: callbacks["queue add-many"](interaction, users=f"<@{user_id}> Song <@{other_id}>", requeue=False),
+            lambda: callbacks["queue reorder"](interaction, order=f"<@{other_id}> <@{user_id}>"),
+            lambda: callbacks["queue shuffle"](interaction),
+            lambda: callbacks["next"](interaction),
+        ])()
+
+    for round_num in range(rounds):
+        # Everyone signs up at once, most of them twice.
+        calls = []
+        for guild_id in range(1, guilds + 1):
+            await callbacks["queue clear"](FakeInteraction(guild_id, 1))
+            for user_id in range(1, users + 1):
+                calls.append(callbacks["queue add"](FakeInteraction(guild_id, user_id), song=None, requeue=False))
+                calls.append(callbacks["queue add-someone"](FakeInteraction(guild_id, 1), user=FakeUser(user_id), song=None, requeue=False))
+        await gather_calls(calls)
+
+        advances = users // 2
+        for guild_id in range(1, guilds + 1):
+            queued = len((await queue_bot.queue_store.load_state(guild_id, MAIN_ROOM_ID)).entries)
+            if(queued != users):
+                errors.append(f"round {round_num}, guild {guild_id}: {queued} entries after {users} users signed up")
+
+        # Half the queue gets advanced at once, alongside reads.
+        calls = []
+        for guild_id in range(1, guilds + 1):
+            calls += [callbacks["next"](FakeInteraction(guild_id, 1)) for i in range(advances)]
+            calls += [callbacks["queue list"](FakeInteraction(guild_id, 1), public=False, page=1) for i in range(advances)]
+        await gather_calls(calls)
+
+        for guild_id in range(1, guilds + 1):
+            queued = len((await queue_bot.queue_store.load_state(guild_id, MAIN_ROOM_ID)).entries)
+            if(queued != users - advances + 1):
+                errors.append(f"round {round_num}, guild {guild_id}: {queued} entries after {advances} advances, expected {users - advances + 1}")
+
+        # Then a free for all.
+        await gather_calls([random_call(guild_id) for guild_id in range(1, guilds + 1) for i in range(users * 4)])
+
+        recovered = None
+        if(isinstance(queue_bot.queue_store, JournalQueueStore)):
+            recovered = await recover_journal_copy(queue_bot, tmp_dir)
+        for guild_id in range(1, guilds + 1):
+            errors += await check_queue_consistency(queue_bot, guild_id, recovered)
+        if(recovered != None):
+            await recovered.close()
+
+    await queue_bot.close()
+    return errors
+
+async def run_stress(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, users: int, rounds: int, seed: int, tmp_dir: str) -> int:
+    """Fires concurrent commands at every guild and checks that the queues stay consistent."""
+    errors = await stress_errors(queue_bot, guilds, users, rounds, seed, tmp_dir)
+    for error in errors:
+        print(error)
+    print(f"{rounds} rounds over {guilds} guilds with {users} users each, {len(errors)} problems found.")
+    return 1 if errors else 0
+
+async def run_writes(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, ops: int, noisy_size: int = 0) -> int:
+    """Every guild signs up and advances through a queue at the same time, timing each command.
+
+    With noisy_size, guild 0 keeps shuffling a queue of that many singers for the whole run,
+    and only the other guilds' commands are timed.
+    """
+    callbacks = get_callbacks(queue_bot)
+    latencies = []
+    done = asyncio.Event()
+
+    async def timed(call) -> None:
+        start = time.perf_counter()
+        await call
+        latencies.append(time.perf_counter() - start)
+
+    async def guild_workload(guild_id: int) -> None:
+        for user_id in range(1, ops // 2 + 1):
+            await timed(callbacks["queue add"](FakeInteraction(guild_id, user_id), song=f"Song {user_id}", requeue=False))
+        for i in range(ops - ops // 2):
+            await timed(callbacks["next"](FakeInteraction(guild_id, 1)))
+
+    async def noisy_workload() -> int:
+        entries = [(user_id, f"Song {user_id}") for user_id in range(1, noisy_size + 1)]
+        await queue_bot.run_queue_write(0, MAIN_ROOM_ID, lambda txn: queue_bot.queue_store.add_many_to_queue(txn, 0, MAIN_ROOM_ID, entries))
+        shuffles = 0
+        while(not done.is_set()):
+            await callbacks["queue shuffle"](FakeInteraction(0, 1))
+            shuffles += 1
+        return shuffles
+
+    async def quiet_workload() -> None:
+        await asyncio.gather(*[guild_workload(guild_id) for guild_id in range(1, guilds + 1)])
+        done.set()
+
+    noisy = asyncio.create_task(noisy_workload()) if noisy_size else None
+    if(noisy != None):
+        # Let the noisy guild fill its queue first.
+        await asyncio.sleep(0.5)
+    start = time.perf_counter()
+    await quiet_workload()
+    elapsed = time.perf_counter() - start
+    shuffles = await noisy if noisy != None else 0
+    await queue_bot.close()
+
+    latencies.sort()
+    print(f"{len(latencies)} writes in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} writes/s, "
+          f"p50 {statistics.median(latencies) * 1000:.1f}ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+    if(noisy_size):
+        print(f"Meanwhile the noisy guild shuffled its {noisy_size} singers {shuffles} times.")
+    if(queue_bot.config.storage.group_commit_ms > 0):
+        batches, operations = queue_bot.db_router.group_commit_stats()
+        print(f"{operations} writes committed in {batches} batches.")
+    if(queue_bot.config.sharding.mode != "off"):
+        print(f"{queue_bot.db_router.opens} shards opened, {queue_bot.db_router.closes} closed while idle.")
+    if(isinstance(queue_bot.queue_store, JournalQueueStore)):
+        print(f"{queue_bot.queue_store.appends} journal records synced in {queue_bot.queue_store.batches} batches, {queue_bot.queue_store.snapshots} snapshots.")
+    return 0
+
+SUITE_COMMANDS = ["queue list", "queue move", "queue swap", "next", "stats", "nextmsg add", "queue add"]
+
+# Each burst of queue changes comes in this many waves, half a debounce apart, so it lasts
+# longer than the debounce like people signing up over a few seconds would.
+BOARD_BURST_WAVES = 4
+
+async def count_board_edits(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, bursts: int, burst_size: int) -> tuple:
+    """Fires bursts of queue changes at guilds with a board, with the board's debounce running
+    out between bursts. Returns (changes, edits by guild, stale), stale being the guilds whose
+    board doesn't end up showing their queue. Closes the bot."""
+    callbacks = get_callbacks(queue_bot)
+    debounce = queue_bot.board_updater.debounce
+    edits = collections.Counter()
+    contents = {}
+    async def edit(board, content: str) -> None:
+        edits[board.guild_id] += 1
+        contents[board.guild_id] = content
+    queue_bot.board_updater.edit = edit
+
+    for guild_id in range(1, guilds + 1):
+        await callbacks["board show"](FakeInteraction(guild_id, 1), size=5)
+
+    changes = 0
+    next_user_id = 1
+    for burst in range(bursts):
+        for wave in range(BOARD_BURST_WAVES):
+            if(wave):
+                await asyncio.sleep(debounce / 2)
+            calls = []
+            for guild_id in range(1, guilds + 1):
+                for i in range(burst_size // BOARD_BURST_WAVES):
+                    next_user_id += 1
+                    calls.append(callbacks["queue add"](FakeInteraction(guild_id, next_user_id), song=f"Song {next_user_id}", requeue=False))
+                if(wave == BOARD_BURST_WAVES - 1):
+                    calls.append(callbacks["next"](FakeInteraction(guild_id, 1)))
+            await asyncio.gather(*calls)
+            changes += len(calls)
+        # Let the debounce run out before the next burst.
+        await asyncio.sleep(debounce * 1.5)
+
+    stale = []
+    for guild_id in range(1, guilds + 1):
+        expected = queue_bot._render_board(await queue_bot.get_queue_state(guild_id, MAIN_ROOM_ID), 5)
+        if(contents.get(guild_id) != expected):
+            stale.append(guild_id)
+            print(f"Guild {guild_id}'s board is stale:\n{contents.get(guild_id)}\nexpected:\n{expected}")
+
+    await queue_bot.close()
+    return (changes, edits, stale)
+
+async def check_board(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, bursts: int, burst_size: int) -> int:
+    """Counts the board edits caused by bursts of queue changes, and fails unless each guild's
+    board was edited once per burst and ends up showing its queue."""
+    changes, edits, stale = await count_board_edits(queue_bot, guilds, bursts, burst_size)
+    updater = queue_bot.board_updater
+    extra = sum(max(0, count - bursts) for count in edits.values())
+    print(f"{changes} queue changes over {bursts} bursts in {guilds} guilds caused {sum(edits.values())} board edits, "
+          f"{updater.unchanged} skipped as unchanged, {extra} more than one per burst, {len(stale)} stale boards.")
+    return 1 if stale or extra else 0
+
+class FakeDiscordApi():
+    """A local stand-in for the Discord routes the bot sends to, rate limited like Discord.
+
+    Channel message routes count against a global bucket and the channel's, interaction
+    responses aren't limited, and answers carry Discord's X-RateLimit headers. Every answer
+    takes latency seconds, like a round trip to Discord would. Going over a limit gets a 429
+    with Retry-After. Those normally come with a Via header, which nextcord takes to mean the
+    API sent them and retries by itself. With edge_429s they don't, like a 429 from the edge
+    in front of the API, and nextcord hands them back to the caller.
+    """
+
+    def __init__(self, global_limit: int, channel_limit: int, channel_period: float, latency: float, edge_429s: bool) -> None:
+        self.global_bucket = TokenBucket(global_limit, 1.0)
+        self.latency = latency
+        self.channel_limit = channel_limit
+        self.channel_period = channel_period
+        self.edge_429s = edge_429s
+        self.channel_buckets = {}
+        self.requests = collections.Counter()
+        self.rate_limited = 0
+
+    def _rate_limited(self, retry_after: float, is_global: bool) -> aiohttp.web.Response:
+        self.rate_limited += 1
+        headers = {"Retry-After": f"{retry_after:.3f}", "X-RateLimit-Scope": "global" if is_global else "user"}
+        if(is_global):
+            headers["X-RateLimit-Global"] = "true"
+        if(not self.edge_429s):
+            headers["Via"] = "1.1 google"
+        body = {"message": "You are being rate limited.", "retry_after": retry_after, "global": is_global}
+        return aiohttp.web.json_response(body, status=429, headers=headers)
+
+    async def handle(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        await asyncio.sleep(self.latency)
+        channel_id = request.match_info.get("channel_id")
+        headers = {"Via": "1.1 google"}
+        if(channel_id != None):
+            channel_bucket = self.channel_buckets.setdefault(channel_id, TokenBucket(self.channel_limit, self.channel_period))
+            wait = self.global_bucket.wait_time()
+            if(wait > 0):
+                return self._rate_limited(wait, True)
+            wait = channel_bucket.wait_time()
+            if(wait > 0):
+                return self._rate_limited(wait, False)
+
+            self.global_bucket.take()
+            channel_bucket.take()
+            headers.update({
+                "X-RateLimit-Limit": str(channel_bucket.limit),
+                "X-RateLimit-Remaining": str(max(0, int(channel_bucket.tokens))),
+                "X-RateLimit-Reset-After": f"{(channel_bucket.limit - channel_bucket.tokens) / channel_bucket.rate:.3f}",
+                "X-RateLimit-Bucket": f"channel-{channel_id}"
+            })
+        self.requests[request.method] += 1
+
+        if(request.path.endswith("/callback")):
+            return aiohttp.web.Response(status=204, headers=headers)
+        if(request.path.endswith("/users/@me")):
+            return aiohttp.web.json_response({"id": "1", "username": "bot", "discriminator": "0001", "avatar": None}, headers=headers)
+        return aiohttp.web.json_response({"id": request.match_info.get("message_id", "1"), "channel_id": channel_id}, headers=headers)
+
+    async def serve(self) -> tuple:
+        """Starts listening on a free local port, returns (runner, base url)."""
+        app = aiohttp.web.Application()
+        app.router.add_get("/api/v10/users/@me", self.handle)
+        app.router.add_post("/api/v10/interactions/{interaction_id}/{token}/callback", self.handle)
+        app.router.add_post("/api/v10/channels/{channel_id}/messages", self.handle)
+        app.router.add_patch("/api/v10/channels/{channel_id}/messages/{message_id}", self.handle)
+        runner = aiohttp.web.AppRunner(app)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await aiohttp.web.SockSite(runner, sock).start()
+        return (runner, f"http://127.0.0.1:{sock.getsockname()[1]}/api/v10")
+
+async def run_dispatch_case(args: argparse.Namespace, dispatched: bool) -> dict:
+    """Sends a burst through nextcord to a FakeDiscordApi: in every channel a batch of
+    confirmations, a run of board edits and, last, a /next announcement."""
+    api = FakeDiscordApi(args.global_limit, args.channel_limit, args.channel_period_ms / 1000, args.latency_ms / 1000, args.edge_429s)
+    runner, base = await api.serve()
+    nextcord.http.Route.BASE = base
+    # HTTPClient wants a client's dispatch for its HTTP events, nothing listens for them here.
+    http = nextcord.http.HTTPClient(dispatch=lambda *args, **kwargs: None)
+    await http.static_login("token")
+    dispatcher = None
+    if(dispatched):
+        dispatcher = OutboundDispatcher(args.global_limit, 1.0, args.channel_limit, args.channel_period_ms / 1000, max_in_flight=args.max_in_flight)
+
+    latencies = {"announce": [], "confirm": [], "edit": []}
+    failures = 0
+    async def submit(kind: str, lane: int, send, channel_id: int = None, merge_key = None) -> None:
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            if(dispatcher != None):
+                await dispatcher.send(lane, send, channel_id, merge_key)
+            else:
+                await send()
+        except nextcord.HTTPException:
+            failures += 1
+        latencies[kind].append(time.perf_counter() - start)
+
+    def respond(interaction_id: int, content: str, flags: int):
+        return lambda: http.create_interaction_response(interaction_id, f"token-{interaction_id}", type=4, data={"content": content, "flags": flags})
+
+    calls = []
+    interaction_id = 0
+    for channel_id in range(1, args.channels + 1):
+        for i in range(args.confirms):
+            interaction_id += 1
+            calls.append(submit("confirm", LANE_CONFIRM, respond(interaction_id, "You have been added to the queue.", 64)))
+        for i in range(args.edits):
+            edit = lambda channel_id=channel_id, i=i: http.edit_message(channel_id, channel_id, content=f"Board update {i}")
+            calls.append(submit("edit", LANE_EDIT, edit, channel_id, ("board", channel_id)))
+    for channel_id in range(1, args.channels + 1):
+        interaction_id += 1
+        calls.append(submit("announce", LANE_ANNOUNCE, respond(interaction_id, "<@1> is up next!", 0)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*calls)
+    elapsed = time.perf_counter() - start
+
+    if(dispatcher != None):
+        await dispatcher.close()
+    await http.close()
+    await runner.cleanup()
+
+    result = {"elapsed_s": round(elapsed, 2), "requests": sum(api.requests.values()), "edits_sent": api.requests["PATCH"], "rate_limited": api.rate_limited, "failures": failures}
+    for kind, values in latencies.items():
+        result[f"{kind}_p50_ms"] = round(statistics.median(values) * 1000)
+        result[f"{kind}_max_ms"] = round(max(values) * 1000)
+    return result
+
+def run_dispatch(args: argparse.Namespace) -> int:
+    results = {}
+    for dispatched in (False, True):
+        # Each case gets a fresh loop, so nextcord's global rate limit state doesn't carry over.
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        results["dispatcher" if dispatched else "direct"] = asyncio.get_event_loop().run_until_complete(run_dispatch_case(args, dispatched))
+
+    print(f"{args.channels} channels, each with {args.confirms} confirmations, {args.edits} board edits and a /next announcement:")
+    for name, result in results.items():
+        print(f"{name:>10}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+    return 1 if results["dispatcher"]["failures"] else 0
+
+def summarize_latencies(latencies: list) -> dict:
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3)
+    }
+
+async def fill_queues(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, queue_size: int) -> None:
+    # Seeded singers requeue, so /next keeps the queues at the size being measured.
+    callbacks = get_callbacks(queue_bot)
+    for guild_id in range(1, guilds + 1):
+        entries = [(user_id, f"Song {user_id}") for user_id in range(1, queue_size + 1)]
+        await queue_bot.run_queue_write(guild_id, MAIN_ROOM_ID, lambda txn, guild_id=guild_id, entries=entries: queue_bot.queue_store.add_many_to_queue(txn, guild_id, MAIN_ROOM_ID, entries, True))
+        await callbacks["next"](FakeInteraction(guild_id, 1))
+
+async def run_suite_case(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, queue_size: int, samples: int, concurrency: int, seed: int) -> list:
+    """Fills guilds queues of queue_size singers, then times samples calls of every command in
+    SUITE_COMMANDS against random guilds. Returns one result dict per command."""
+    callbacks = get_callbacks(queue_bot)
+    rng = random.Random(seed)
+    await fill_queues(queue_bot, guilds, queue_size)
+
+    next_user_id = queue_size + 1
+    def make_call(command: str):
+        nonlocal next_user_id
+        guild_id = rng.randint(1, guilds)
+        user_id = rng.randint(1, queue_size)
+        other_id = rng.randint(1, queue_size)
+        interaction = FakeInteraction(guild_id, user_id)
+        if(command == "queue list"):
+            return callbacks[command](interaction, public=False, page=1)
+        elif(command == "queue move"):
+            return callbacks[command](interaction, user=FakeUser(user_id), position=rng.randint(1, max(queue_size - 1, 1)))
+        elif(command == "queue swap"):
+            return callbacks[command](interaction, user1=FakeUser(user_id), user2=FakeUser(other_id))
+        elif(command == "next"):
+            return callbacks[command](interaction)
+        elif(command == "stats"):
+            # Each /stats reads while a finished turn is being written in the background, flushed
+            # so it doesn't wait out the history's write delay first.
+            queue_bot.history.record(guild_id, user_id, f"Song {user_id}", None, queue_bot.clock())
+            return asyncio.gather(queue_bot.history.flush(), callbacks[command](interaction, user=None))
+        elif(command == "nextmsg add"):
+            return callbacks[command](interaction, template="{user} is up with {song}!", name=None)
+        elif(command == "queue add"):
+            next_user_id += 1
+            return callbacks[command](FakeInteraction(guild_id, next_user_id), song="New Song", requeue=False)
+
+    results = []
+    for command in SUITE_COMMANDS:
+        latencies = []
+        statements = []
+
+        async def timed(call) -> None:
+            start = time.perf_counter()
+            await call
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with StatementCounter() as counter:
+            for i in range(0, samples, concurrency):
+                batch = [make_call(command) for j in range(min(concurrency, samples - i))]
+                before = counter.count
+                await asyncio.gather(*[timed(call) for call in batch])
+                statements.append((counter.count - before) / len(batch))
+        elapsed = time.perf_counter() - start
+
+        result = {
+            "command": command,
+            "calls": len(latencies),
+            "throughput_per_s": round(len(latencies) / elapsed, 1),
+            "statements_per_call": round(statistics.mean(statements), 2),
+            "max_statements_per_call": max(statements)
+        }
+        result.update(summarize_latencies(latencies))
+        results.append(result)
+
+    await queue_bot.close()
+    return results
+
+def run_suite(args: argparse.Namespace) -> int:
+    """Runs run_suite_case for every database, guild count and queue size combination and
+    writes the results as JSON."""
+    report = {
+        "settings": {
+            "samples": args.samples,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+            "sqlalchemy": sa.__version__
+        },
+        "results": [],
+        "skipped": []
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for database in args.databases:
+            for guilds in args.guild_counts:
+                for queue_size in args.queue_sizes:
+                    case = {"database": database, "guilds": guilds, "queue_size": queue_size}
+                    if(guilds * queue_size > args.max_entries):
+                        report["skipped"].append(case)
+                        continue
+
+                    print(f"Running {database} database, {guilds} guilds, {queue_size} singers each...", file=sys.stderr)
+                    db_path = os.path.join(tmp_dir, f"suite_{guilds}_{queue_size}.db") if database != "memory" else None
+                    storage = None
+                    if(database == "journal"):
+                        # Queues in the journal, nextmsg templates still in the disk database.
+                        storage = KaraokeQueueBot.KaraokeQueueBotStorageConfig(queue_backend="journal", journal_dir=os.path.join(tmp_dir, f"suite_{guilds}_{queue_size}_journal"))
+                    # Each case gets a fresh loop for its bot to run on.
+                    asyncio.set_event_loop(asyncio.new_event_loop())
+                    queue_bot = make_queue_bot(db_path, storage=storage)
+                    for result in run_on_bot_loop(queue_bot, run_suite_case(queue_bot, guilds, queue_size, args.samples, args.concurrency, args.seed)):
+                        report["results"].append({**case, **result})
+
+    out = json.dumps(report, indent=2)
+    if(args.out):
+        with open(args.out, "w", encoding="UTF-8") as out_file:
+            out_file.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+CATALOG_SYLLABLES = ["ka", "ra", "o", "ke", "lo", "ve", "ni", "ght", "sta", "r", "do", "mi", "tu", "be", "la", "sho", "ré", "an", "el", "zu"]
+
+def write_fake_tracks(path: str, tracks: int, seed: int) -> list:
+    """Writes a CSV of made up karaoke tracks, returns their titles."""
+    rng = random.Random(seed)
+    words = list(set("".join(rng.choices(CATALOG_SYLLABLES, k=rng.randint(1, 4))).capitalize() for i in range(5000)))
+    titles = []
+    with open(path, "w", encoding="UTF-8", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Title", "Artist"])
+        for i in range(tracks):
+            title = " ".join(rng.choices(words, k=rng.randint(1, 5)))
+            writer.writerow([title, " ".join(rng.choices(words, k=rng.randint(1, 3)))])
+            titles.append(title)
+    return titles
+
+async def check_catalog(queue_bot: KaraokeQueueBot.KaraokeQueueBot, titles: list, searches: int, budget_ms: float, seed: int) -> int:
+    """Types out random titles a letter at a time, plus a few words from the middle of them, and
+    fails if the 99th percentile search is over budget_ms."""
+    rng = random.Random(seed)
+    queries = []
+    while(len(queries) < searches):
+        title = rng.choice(titles)
+        queries.extend(title[:length] for length in range(1, min(len(title), 20) + 1))
+        words = title.split()
+        if(len(words) > 1):
+            queries.append(" ".join(words[1:3]).lower())
+    queries = queries[:searches]
+
+    # The first search opens the catalog.
+    start = time.perf_counter()
+    await queue_bot.song_catalog.search(queries[0])
+    open_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    empty = 0
+    for query in queries:
+        start = time.perf_counter()
+        choices = await queue_bot.song_catalog.search(query)
+        latencies.append(time.perf_counter() - start)
+        if(not choices):
+            empty += 1
+
+    # And once through the autocomplete callback, as Discord would call it.
+    interaction = FakeInteraction(1, 1)
+    add = next(command for command in queue_bot.bot._application_commands_to_add if command.callback.__name__ == "queue").children["add"]
+    add.from_callback(add.callback)
+    await add.options["song"].invoke_autocomplete_callback(interaction, titles[0][:4])
+    await queue_bot.close()
+
+    summary = summarize_latencies(latencies)
+    print(f"{searches} searches of {len(titles)} tracks, first search (opening the catalog) {open_ms:.1f}ms, {empty} without results:")
+    print(", ".join(f"{key}={value}" for key, value in summary.items()))
+    print(f"Autocompleting {titles[0][:4]!r}: {interaction.sent[0][:3]}...")
+    return 1 if summary["p99_ms"] > budget_ms or not interaction.sent[0] else 0
+
+async def check_policies(queue_bot: KaraokeQueueBot.KaraokeQueueBot, singers: int, queue_size: int, nexts: int) -> int:
+    """Runs a night under each policy in its own guild, with half the singers joining late and
+    every fourth early singer at weight 3, and fails if a policy doesn't share the turns out as
+    it says. Then times /next on a queue of queue_size singers under each policy."""
+    callbacks = get_callbacks(queue_bot)
+    failures = 0
+    early = list(range(1, singers // 2 + 1))
+    late = list(range(singers // 2 + 1, singers + 1))
+    heavy = set(early[::4])
+
+    print(f"{singers} singers, {len(late)} of them joining late, {len(heavy)} at weight 3:")
+    for guild_id, policy in enumerate(POLICIES, start=1):
+        async def advance(count: int) -> list:
+            singing = []
+            for i in range(count):
+                await callbacks["next"](FakeInteraction(guild_id, 1))
+                singing.append((await queue_bot.get_queue_state(guild_id, MAIN_ROOM_ID)).get_current().user_id)
+            return singing
+
+        await callbacks["queue policy"](FakeInteraction(guild_id, 1), policy=policy)
+        for user_id in heavy:
+            await callbacks["queue weight"](FakeInteraction(guild_id, 1), user=FakeUser(user_id), weight=3)
+        for user_id in early:
+            await callbacks["queue add"](FakeInteraction(guild_id, user_id), song=None, requeue=True)
+        await advance(len(early) * 2)
+        for user_id in late:
+            await callbacks["queue add"](FakeInteraction(guild_id, user_id), song=None, requeue=True)
+        singing = await advance(singers * 4)
+
+        state = await queue_bot.get_queue_state(guild_id, MAIN_ROOM_ID)
+        durable = await queue_bot.queue_store.load_state(guild_id, MAIN_ROOM_ID)
+        if(durable.turns != state.turns):
+            failures += 1
+            print(f"{policy}: stored turns {durable.turns} differ from {state.turns}")
+
+        first_turn_wait = max(singing.index(user_id) + 1 if user_id in singing else len(singing) + 1 for user_id in late)
+        light_turns = [state.get_turns(user_id) for user_id in early + late if user_id not in heavy]
+        heavy_ratio = statistics.mean(state.get_turns(user_id) for user_id in heavy) / statistics.mean(state.get_turns(user_id) for user_id in early if user_id not in heavy)
+        print(f"{policy:>10}: late singers first up within {first_turn_wait} /next, weight 1 singers had {min(light_turns)}-{max(light_turns)} turns, "
+              f"weight 3 singers {heavy_ratio:.2f}x as many as early weight 1 singers")
+
+        if(policy == POLICY_ROTATION and max(light_turns) - min(light_turns) > 1):
+            failures += 1
+            print(f"{policy}: turns should differ by at most one")
+        elif(policy == POLICY_WEIGHTED and not 2.5 <= heavy_ratio <= 3.5):
+            failures += 1
+            print(f"{policy}: weight 3 singers should sing about 3x as often")
+        elif(policy == POLICY_NEWCOMERS and first_turn_wait > len(late)):
+            failures += 1
+            print(f"{policy}: late singers should go before anyone sings again")
+
+    print(f"/next on a queue of {queue_size} singers, {nexts} times:")
+    for guild_id, policy in enumerate(POLICIES, start=len(POLICIES) + 1):
+        entries = [(user_id, f"Song {user_id}") for user_id in range(1, queue_size + 1)]
+        await queue_bot.run_queue_write(guild_id, MAIN_ROOM_ID, lambda txn, guild_id=guild_id, entries=entries: queue_bot.queue_store.add_many_to_queue(txn, guild_id, MAIN_ROOM_ID, entries, True))
+        await callbacks["queue policy"](FakeInteraction(guild_id, 1), policy=policy)
+        # The first /next loads the guild's templates and, for the policies, orders the queue.
+        await callbacks["next"](FakeInteraction(guild_id, 1))
+        await queue_bot.history.flush()
+
+        latencies = []
+        statements = []
+        history_statements = []
+        for i in range(nexts):
+            start = time.perf_counter()
+            with StatementCounter() as counter:
+                await callbacks["next"](FakeInteraction(guild_id, 1))
+                latencies.append(time.perf_counter() - start)
+                await queue_bot.history.flush()
+            statements.append(counter.count - counter.history_count)
+            history_statements.append(counter.history_count)
+        print(f"{policy:>10}: " + ", ".join(f"{key}={value}" for key, value in summarize_latencies(latencies).items()) +
+              f", max statements {max(statements)}, {max(history_statements)} for the history")
+        if(max(statements) > NEXT_STATEMENT_BUDGET):
+            failures += 1
+            print(f"{policy}: /next went over its budget of {NEXT_STATEMENT_BUDGET} statements")
+        if(max(history_statements) > HISTORY_STATEMENT_BUDGET):
+            failures += 1
+            print(f"{policy}: recording the history went over its budget of {HISTORY_STATEMENT_BUDGET} statements")
+
+    await queue_bot.close()
+    return 1 if failures else 0
+
+async def naive_guild_stats(session, guild_id: int) -> tuple:
+    # What /stats would have to do without the summary tables.
+    performances = (await session.execute(
+        sa.select(sa.func.count(), sa.func.avg(PerformanceEntry.ended_at - PerformanceEntry.started_at))
+            .where(PerformanceEntry.guild_id == guild_id)
+    )).one()
+    top_singers = (await session.execute(
+        sa.select(PerformanceEntry.user_id, sa.func.count().label("performances"))
+            .where(PerformanceEntry.guild_id == guild_id)
+            .group_by(PerformanceEntry.user_id)
+            .order_by(sa.desc("performances"))
+            .limit(KaraokeQueueBot.STATS_TOP_SIZE)
+    )).all()
+    top_songs = (await session.execute(
+        sa.select(PerformanceEntry.song_name, sa.func.count().label("performances"))
+            .where(PerformanceEntry.guild_id == guild_id)
+            .where(PerformanceEntry.song_name != None)
+            .group_by(PerformanceEntry.song_name)
+            .order_by(sa.desc("performances"))
+            .limit(KaraokeQueueBot.STATS_TOP_SIZE)
+    )).all()
+    return (performances, top_singers, top_songs)
+
+async def check_history_totals(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guild_id: int) -> list:
+    """Differences between the guild's summary tables and its history, recounted from scratch."""
+    problems = []
+    async with queue_bot.db_router.session(guild_id) as session:
+        guild = await session.get(GuildStatsEntry, guild_id)
+        singers = {row.user_id: row for row in (await session.execute(sa.select(SingerStatsEntry).where(SingerStatsEntry.guild_id == guild_id))).scalars()}
+        songs = {row.song_name: row.performances for row in (await session.execute(sa.select(SongStatsEntry).where(SongStatsEntry.guild_id == guild_id))).scalars()}
+
+        stmt = sa.select(
+            PerformanceEntry.user_id,
+            sa.func.count(),
+            sa.func.count(PerformanceEntry.started_at),
+            sa.func.coalesce(sa.func.sum(PerformanceEntry.ended_at - PerformanceEntry.started_at), 0)
+        ).where(PerformanceEntry.guild_id == guild_id).group_by(PerformanceEntry.user_id)
+        counted = {row[0]: row[1:] for row in (await session.execute(stmt)).all()}
+        stmt = sa.select(PerformanceEntry.song_name, sa.func.count()) \
+            .where(PerformanceEntry.guild_id == guild_id) \
+            .where(PerformanceEntry.song_name != None) \
+            .group_by(PerformanceEntry.song_name)
+        counted_songs = dict((await session.execute(stmt)).all())
+
+    if(guild is None or guild.performances != sum(row[0] for row in counted.values())):
+        problems.append(f"guild {guild_id}: {guild.performances if guild else 0} performances in its totals, {sum(row[0] for row in counted.values())} in its history")
+    for user_id, (performances, timed_performances, total_seconds) in counted.items():
+        singer = singers.get(user_id)
+        if(singer is None or (singer.performances, singer.timed_performances) != (performances, timed_performances) or abs(singer.total_seconds - total_seconds) > 1e-3 * max(1.0, total_seconds)):
+            problems.append(f"guild {guild_id}: singer {user_id} has {singer!r}, history has {performances} performances, {timed_performances} timed, {total_seconds:.0f}s")
+    if(songs != counted_songs):
+        problems.append(f"guild {guild_id}: {len(songs)} songs in its totals don't match the {len(counted_songs)} in its history")
+    return problems
+
+async def check_history(queue_bot: KaraokeQueueBot.KaraokeQueueBot, rows: int, guilds: int, singers: int, songs: int, stats: int, retention_days: int, seed: int) -> int:
+    """Fills the history with rows performances spread over the last year, checks the totals
+    /stats reads against the history, times /stats against counting the history directly,
+    then compacts the history down to retention_days and checks /stats didn't change."""
+    rng = random.Random(seed)
+    callbacks = get_callbacks(queue_bot)
+    await queue_bot.startup_task
+    failures = 0
+    now = time.time()
+    year = 365 * 24 * 60 * 60
+
+    start = time.perf_counter()
+    batch_size = 10000
+    for guild_id in range(1, guilds + 1):
+        guild_rows = rows // guilds + (1 if guild_id <= rows % guilds else 0)
+        ended = sorted(now - rng.random() * year for i in range(guild_rows))
+        for batch_start in range(0, guild_rows, batch_size):
+            batch = []
+            for ended_at in ended[batch_start:batch_start + batch_size]:
+                # Some singers and songs are far more popular than others.
+                song = int(rng.paretovariate(1.2)) % songs
+                batch.append({
+                    "guild_id": guild_id,
+                    "user_id": int(rng.paretovariate(1.5)) % singers + 1,
+                    "song_name": f"Song {song}" if song else None,
+                    "started_at": ended_at - rng.uniform(120, 360) if rng.random() > 0.01 else None,
+                    "ended_at": ended_at
+                })
+            await queue_bot.run_write(guild_id, lambda session, guild_id=guild_id, batch=batch: queue_bot.history.write_performances(session, guild_id, batch))
+    print(f"Wrote {rows} performances in {guilds} guilds in {time.perf_counter() - start:.1f}s.")
+
+    for guild_id in range(1, guilds + 1):
+        problems = await check_history_totals(queue_bot, guild_id)
+        failures += len(problems)
+        for problem in problems:
+            print(problem)
+
+    async def time_stats(samples: int) -> tuple:
+        latencies = []
+        statements = []
+        answers = {}
+        for i in range(samples):
+            guild_id = rng.randint(1, guilds)
+            user = FakeUser(rng.randint(1, singers)) if i % 2 else None
+            interaction = FakeInteraction(guild_id, 1)
+            start = time.perf_counter()
+            with StatementCounter() as counter:
+                await callbacks["stats"](interaction, user=user)
+            latencies.append(time.perf_counter() - start)
+            statements.append(counter.count)
+            if(user is None):
+                answers[guild_id] = interaction.sent[0]
+        return (latencies, statements, answers)
+
+    latencies, statements, before = await time_stats(stats)
+    print(f"/stats {stats} times: " + ", ".join(f"{key}={value}" for key, value in summarize_latencies(latencies).items()) + f", max statements {max(statements)}")
+
+    naive_latencies = []
+    for i in range(min(stats, 50)):
+        guild_id = rng.randint(1, guilds)
+        start = time.perf_counter()
+        async with queue_bot.db_router.session(guild_id) as session:
+            await naive_guild_stats(session, guild_id)
+        naive_latencies.append(time.perf_counter() - start)
+    print(f"Counting the history instead, {len(naive_latencies)} times: " + ", ".join(f"{key}={value}" for key, value in summarize_latencies(naive_latencies).items()))
+
+    # Each performance recorded from now on also deletes a batch of the guild's old ones.
+    history = PerformanceHistory(queue_bot.run_write, retention_days)
+    cutoff = now - retention_days * 24 * 60 * 60
+    async with queue_bot.db_router.session(1) as session:
+        old = (await session.execute(sa.select(sa.func.count()).select_from(PerformanceEntry).where(PerformanceEntry.ended_at < cutoff))).scalar_one()
+    start = time.perf_counter()
+    write_latencies = []
+    recorded = 0
+    for guild_id in range(1, guilds + 1):
+        while(True):
+            compacted = history.compacted
+            write_start = time.perf_counter()
+            # Nameless and already counted singers, so /stats only changes by the count.
+            history.record(guild_id, 1, None, None, now)
+            await history.flush()
+            write_latencies.append(time.perf_counter() - write_start)
+            recorded += 1
+            if(history.compacted == compacted):
+                break
+    print(f"Compacted {history.compacted} of {old} performances older than {retention_days} days in {time.perf_counter() - start:.1f}s, "
+          f"{recorded} writes: " + ", ".join(f"{key}={value}" for key, value in summarize_latencies(write_latencies).items()))
+    if(history.compacted != old):
+        failures += 1
+        print(f"{old - history.compacted} old performances weren't compacted")
+
+    latencies, statements, after = await time_stats(stats)
+    print(f"/stats {stats} times after compacting: " + ", ".join(f"{key}={value}" for key, value in summarize_latencies(latencies).items()) + f", max statements {max(statements)}")
+    for guild_id, answer in before.items():
+        # Only the count and the first singer's number can have moved, by the performances just recorded.
+        if(guild_id in after and re.sub(r"\d+", "#", after[guild_id]) != re.sub(r"\d+", "#", answer)):
+            failures += 1
+            print(f"guild {guild_id}: /stats changed after compacting:\n{answer}\n->\n{after[guild_id]}")
+
+    await queue_bot.close()
+    return 1 if failures else 0
+
+ROOM_COMMANDS = ["queue add", "next", "queue list", "current"]
+# The lone room's workload is this many times longer at this many times the pace, so its p95
+# has about as many samples behind it as the busy guild's and is still timed in the same while.
+ROOM_BASELINE_SCALE = 10
+# Slowdowns of less than this are put down to noise, most commands only take a fraction of it.
+ROOM_NOISE_MS = 2
+
+async def check_rooms(queue_bot: KaraokeQueueBot.KaraokeQueueBot, rooms: int, singers: int, rounds: int, interval_ms: int, max_slowdown: float, seed: int, tmp_dir: str) -> int:
+    """Times the same paced workload in one room of a guild, then in rooms rooms of that guild
+    at once, and fails if a command's p95 in the busy guild is over max_slowdown times its p95
+    in the lone room, or any room's queue picks up another room's singers. The same load in one
+    shared queue is timed last, for comparison."""
+    callbacks = get_callbacks(queue_bot)
+    rng = random.Random(seed)
+    guild_id = 1
+    baseline_room_id = rooms + 1
+    await queue_bot.startup_task
+
+    def room_singers(room_id: int) -> list:
+        # Each room has its own singers, so one turning up in the wrong room is caught.
+        count = singers * ROOM_BASELINE_SCALE if room_id == baseline_room_id else singers
+        return [room_id * 1000 + i for i in range(1, count + 1)]
+
+    async def room_workload(room_id: int, voice_channel_id: int, latencies: dict, rounds: int, interval_ms: float) -> None:
+        async def timed(command: str, **kwargs) -> None:
+            start = time.perf_counter()
+            await callbacks[command](FakeInteraction(guild_id, user_id, voice_channel_id), **kwargs)
+            latencies[command].append(time.perf_counter() - start)
+            await asyncio.sleep(interval_ms / 1000)
+
+        # Rooms don't all send their commands in the same instant.
+        await asyncio.sleep(rng.random() * interval_ms / 1000)
+        for user_id in room_singers(room_id):
+            await timed("queue add", song=f"Song {user_id}", requeue=True)
+        for i in range(rounds):
+            await timed("next")
+            await timed("queue list", public=False, page=1)
+            await timed("current")
+
+    async def run_case(room_ids: list, shared: bool, rounds: int, interval_ms: float) -> dict:
+        latencies = {command: [] for command in ROOM_COMMANDS}
+        await asyncio.gather(*[room_workload(room_id, None if shared else room_id, latencies, rounds, interval_ms) for room_id in room_ids])
+        return {command: summarize_latencies(values) for command, values in latencies.items()}
+
+    results = {
+        "1 room": await run_case([baseline_room_id], False, rounds * ROOM_BASELINE_SCALE, interval_ms / ROOM_BASELINE_SCALE),
+        f"{rooms} rooms": await run_case(list(range(1, rooms + 1)), False, rounds, interval_ms),
+        f"{rooms} in 1": await run_case(list(range(rooms + 2, rooms * 2 + 2)), True, rounds, interval_ms),
+    }
+
+    failures = 0
+    recovered = None
+    if(isinstance(queue_bot.queue_store, JournalQueueStore)):
+        recovered = await recover_journal_copy(queue_bot, tmp_dir)
+    for room_id in range(1, rooms + 2):
+        errors = await check_queue_consistency(queue_bot, guild_id, recovered, room_id)
+        user_ids = sorted(elem.user_id for elem in (await queue_bot.get_queue_state(guild_id, room_id)).entries.values())
+        if(user_ids != room_singers(room_id)):
+            errors.append(f"room {room_id} holds singers {user_ids}, expected its own {len(room_singers(room_id))}")
+        failures += len(errors)
+        for error in errors:
+            print(error)
+    if(recovered != None):
+        await recovered.close()
+    await queue_bot.close()
+
+    print(f"{singers} singers per room signing up and taking {rounds} turns, a command every {interval_ms}ms per room:")
+    for command in ROOM_COMMANDS:
+        print(f"{command:>12}: " + "; ".join(f"{case} p50 {result[command]['p50_ms']:.1f}ms p95 {result[command]['p95_ms']:.1f}ms" for case, result in results.items()))
+        baseline = results["1 room"][command]["p95_ms"]
+        p95 = results[f"{rooms} rooms"][command]["p95_ms"]
+        if(p95 > max(baseline * max_slowdown, baseline + ROOM_NOISE_MS)):
+            failures += 1
+            print(f"{command}: p95 {p95:.1f}ms with {rooms} rooms is over {max_slowdown}x the {baseline:.1f}ms with 1 room")
+    return 1 if failures else 0
+
+class FakeClock():
+    # Unix time that only moves when a benchmark moves it.
+    def __init__(self) -> None:
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+async def check_timer_scheduler(timers: int, seed: int) -> int:
+    """Schedules timers timers over an hour of fake time, moves a third and cancels a tenth, then
+    steps through the hour and fails unless every remaining timer fires exactly once, in deadline
+    order, in the step its deadline falls in."""
+    rng = random.Random(seed)
+    clock = FakeClock()
+    start = clock.now
+    scheduler = TimerScheduler(clock)
+    fired = []
+
+    def callback(key) -> object:
+        async def fire() -> None:
+            fired.append((key, clock.now))
+        return fire
+
+    began = time.perf_counter()
+    deadlines = {}
+    for key in range(timers):
+        deadlines[key] = start + rng.random() * 3600
+        scheduler.schedule(key, deadlines[key], callback(key))
+    for key in rng.sample(range(timers), timers // 3):
+        deadlines[key] = start + rng.random() * 3600
+        scheduler.schedule(key, deadlines[key], callback(key))
+    cancelled = set(rng.sample(range(timers), timers // 10))
+    for key in cancelled:
+        scheduler.cancel(key)
+        del deadlines[key]
+    scheduled_s = time.perf_counter() - began
+
+    began = time.perf_counter()
+    step = 60
+    while(clock.now < start + 3600 + step):
+        clock.now += step
+        scheduler.run_due()
+        await scheduler.join()
+    fired_s = time.perf_counter() - began
+
+    problems = []
+    fired_keys = [key for key, now in fired]
+    if(len(fired_keys) != len(set(fired_keys))):
+        problems.append(f"{len(fired_keys) - len(set(fired_keys))} timers fired more than once")
+    if(set(fired_keys) != set(deadlines)):
+        problems.append(f"{len(set(deadlines) - set(fired_keys))} timers never fired, {len(set(fired_keys) & cancelled)} cancelled ones did")
+    late = sum(1 for key, now in fired if key in deadlines and not deadlines[key] <= now < deadlines[key] + step)
+    if(late):
+        problems.append(f"{late} timers fired outside the step their deadline falls in")
+    if([deadlines[key] for key in fired_keys if key in deadlines] != sorted(deadlines[key] for key in fired_keys if key in deadlines)):
+        problems.append("timers fired out of deadline order")
+    if(len(scheduler) or scheduler.stats()["running"]):
+        problems.append(f"{len(scheduler)} timers and {scheduler.stats()['running']} callbacks left over")
+
+    print(f"{timers} timers: {timers + timers // 3 + len(cancelled)} schedules and cancels in {scheduled_s * 1000:.0f}ms, {len(fired)} fired in {fired_s * 1000:.0f}ms.")
+    for problem in problems:
+        print(problem)
+    return len(problems)
+
+async def check_timers(queue_bot: KaraokeQueueBot.KaraokeQueueBot, clock: FakeClock, guilds: int) -> int:
+    """Walks guilds guilds, each with a requeue singer and a one-off singer, through auto-advance,
+    a requeue cooldown and idle expiry on a fake clock, checking each step for every guild, and
+    that the number of tasks doesn't grow with the number of pending timers. The bot must have
+    5 minute auto-advance, 10 minute cooldowns and 2 hour idle expiry."""
+    callbacks = get_callbacks(queue_bot)
+    await queue_bot.startup_task
+    start = clock.now
+    tasks_before = len(asyncio.all_tasks())
+    problems = []
+
+    def singers(guild_id: int) -> tuple:
+        return (guild_id * 1000 + 1, guild_id * 1000 + 2)
+
+    async def set_up(guild_id: int) -> None:
+        requeued, once = singers(guild_id)
+        await callbacks["queue add"](FakeInteraction(guild_id, requeued), song="Again", requeue=True)
+        await callbacks["queue add"](FakeInteraction(guild_id, once), song="Once")
+        await callbacks["next"](FakeInteraction(guild_id, requeued))
+
+    async def move_clock_to(seconds: float) -> float:
+        # Runs every timer due by then, including ones the timers that fire set.
+        clock.now = start + seconds
+        began = time.perf_counter()
+        while(True):
+            queue_bot.scheduler.run_due()
+            await queue_bot.scheduler.join()
+            deadline = queue_bot.scheduler.next_deadline()
+            if(deadline == None or deadline > clock.now):
+                return time.perf_counter() - began
+
+    async def expect(step: str, expected) -> None:
+        wrong = 0
+        for guild_id in range(1, guilds + 1):
+            state = await queue_bot.get_queue_state(guild_id, MAIN_ROOM_ID)
+            current_elem = state.get_current()
+            found = (current_elem.user_id if current_elem != None else None, sorted(elem.user_id for elem in state.get_waiting()))
+            if(found != expected(guild_id)):
+                wrong += 1
+                if(wrong <= 3):
+                    problems.append(f"{step}: guild {guild_id} has {found}, expected {expected(guild_id)}")
+        if(wrong > 3):
+            problems.append(f"{step}: {wrong - 3} more guilds wrong")
+
+    began = time.perf_counter()
+    for guild_id in range(1, guilds + 1):
+        await set_up(guild_id)
+    set_up_s = time.perf_counter() - began
+    await expect("set up", lambda guild_id: (singers(guild_id)[0], [singers(guild_id)[1]]))
+    pending = len(queue_bot.scheduler)
+    extra_tasks = len(asyncio.all_tasks()) - tasks_before
+    if(pending != 2 * guilds):
+        problems.append(f"{pending} timers pending, expected an advance and an expiry per guild")
+    if(extra_tasks > 16):
+        problems.append(f"{extra_tasks} more tasks with {pending} timers pending")
+
+    # Nothing is due yet.
+    fired = queue_bot.scheduler.fired
+    await move_clock_to(299)
+    if(queue_bot.scheduler.fired != fired):
+        problems.append(f"{queue_bot.scheduler.fired - fired} timers fired early")
+
+    # The requeue singer's time is up, they go to the back to cool down and the other goes up.
+    first_s = await move_clock_to(301)
+    await expect("first auto-advance", lambda guild_id: (singers(guild_id)[1], [singers(guild_id)[0]]))
+
+    # The other singer's time is up, but the requeue singer is still cooling down.
+    second_s = await move_clock_to(602)
+    await expect("second auto-advance", lambda guild_id: (None, [singers(guild_id)[0]]))
+    interaction = FakeInteraction(1, singers(1)[1])
+    interaction.channel = queue_bot.announce_channels[(1, MAIN_ROOM_ID)]
+    await callbacks["next"](interaction)
+    if(not interaction.sent or not interaction.sent[-1].startswith("No one can sing yet")):
+        problems.append(f"/next during the cooldown answered {interaction.sent}")
+    await move_clock_to(900)
+    await expect("during cooldown", lambda guild_id: (None, [singers(guild_id)[0]]))
+
+    # The cooldown ends and the requeue singer goes back up.
+    cooldown_s = await move_clock_to(901)
+    await expect("after cooldown", lambda guild_id: (singers(guild_id)[0], []))
+    announced = sum(len(queue_bot.announce_channels[(guild_id, MAIN_ROOM_ID)].sent) for guild_id in range(1, guilds + 1))
+    if(announced != 3 * guilds):
+        problems.append(f"{announced} auto-advances announced, expected {3 * guilds}")
+
+    # Nobody has run a command for two hours. Auto-advances don't count, so the queue is
+    # cleared even though the requeue singer keeps being moved on from.
+    expire_s = await move_clock_to(602 + 7201)
+    await expect("after expiry", lambda guild_id: (None, []))
+    if(queue_bot.expired_queues != guilds):
+        problems.append(f"{queue_bot.expired_queues} queues expired, expected {guilds}")
+    if(len(queue_bot.scheduler)):
+        problems.append(f"{len(queue_bot.scheduler)} timers still pending after every queue expired")
+    if(queue_bot.announce_channels):
+        problems.append(f"{len(queue_bot.announce_channels)} announcement channels still kept after every queue expired")
+    if(isinstance(queue_bot.queue_store, KaraokeQueueBot.SqlQueueStore)):
+        rows = 0
+        for guild_id in range(1, guilds + 1):
+            async with queue_bot.db_router.session(guild_id) as session:
+                rows += (await session.execute(sa.select(sa.func.count(QueueEntry.id)).where(QueueEntry.guild_id == guild_id))).scalar_one()
+        if(rows):
+            problems.append(f"{rows} queue rows left after every queue expired")
+
+    await queue_bot.close()
+    print(f"{guilds} guilds set up in {set_up_s:.1f}s with {pending} timers pending and {extra_tasks} extra tasks.")
+    print(f"Fired {guilds} auto-advances in {first_s:.2f}s and {second_s:.2f}s, {guilds} cooldowns in {cooldown_s:.2f}s, {guilds} expiries in {expire_s:.2f}s.")
+    print(f"auto-advances={queue_bot.auto_advances}, expired={queue_bot.expired_queues}, {queue_bot.scheduler.stats()}")
+    for problem in problems:
+        print(problem)
+    return len(problems)
+
+def describe_room(state: GuildQueueState) -> tuple:
+    # Everything an export carries of a room, leaving out the entry ids an import changes.
+    def describe(elem) -> tuple:
+        return (elem.user_id, elem.song_name, elem.sort_key, bool(elem.requeue), elem.eligible_at)
+
+    current_elem = state.get_current()
+    return (
+        describe(current_elem) if current_elem != None else None,
+        state.current_since if current_elem != None else None,
+        state.policy,
+        [describe(elem) for elem in sorted(state.get_waiting(), key=lambda elem: elem.sort_key)],
+        {user_id: turns for user_id, turns in state.turns.items() if turns},
+        {user_id: weight for user_id, weight in state.weights.items() if weight != DEFAULT_WEIGHT}
+    )
+
+async def describe_guild(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guild_id: int, room_ids: list) -> tuple:
+    templates = await queue_bot.get_nextmsg_templates(guild_id)
+    template_strs = sorted(template.template for template in templates.with_song + templates.no_song)
+    return ([describe_room(await queue_bot.get_queue_state(guild_id, room_id)) for room_id in room_ids], template_strs)
+
+async def check_export(queue_bot: KaraokeQueueBot.KaraokeQueueBot, rooms: int, queue_size: int, templates: int, memory_budget_mb: float, seed: int, tmp_dir: str) -> int:
+    """Fills rooms rooms of a guild with queue_size singers each, exports the guild and imports
+    it over a guild that already has queues, and fails unless every room and template comes
+    across exactly, the import replaced what was there, a cut short export is turned away
+    without changing anything and the SQL store streams both ways within memory_budget_mb.
+    Then backs the database up while writes are going on, timing the writes. The bot must have
+    a requeue cooldown, so entries have one to carry over."""
+    callbacks = get_callbacks(queue_bot)
+    rng = random.Random(seed)
+    await queue_bot.startup_task
+    source, target, traced, writes_guild = 1, 2, 3, 4
+    room_ids = [MAIN_ROOM_ID] + list(range(1, rooms))
+    sql = isinstance(queue_bot.queue_store, KaraokeQueueBot.SqlQueueStore)
+    problems = []
+
+    began = time.perf_counter()
+    for room_id in room_ids:
+        users = [room_id * 10 ** 6 + i for i in range(1, queue_size + 1)]
+        for i in range(0, len(users), BULK_STATEMENT_ROWS):
+            chunk = [(user_id, f"Song {user_id}" if rng.random() < 0.8 else None) for user_id in users[i:i + BULK_STATEMENT_ROWS]]
+            await queue_bot.run_queue_write(source, room_id, lambda txn, room_id=room_id, chunk=chunk: queue_bot.queue_store.add_many_to_queue(txn, source, room_id, chunk, requeue=True))
+        # Turns, cooldowns, a current singer and weights to carry over too.
+        for _ in range(3):
+            await queue_bot.guild_executor.run((source, room_id), lambda room_id=room_id: queue_bot.advance(source, room_id))
+        await queue_bot.run_queue_write(source, room_id, lambda txn, room_id=room_id, user_id=users[-1]: queue_bot.queue_store.set_weight(txn, source, room_id, user_id, 3))
+    await callbacks["queue policy"](FakeInteraction(source, 1, room_ids[-1]), policy=POLICY_ROTATION)
+    for i in range(templates):
+        await callbacks["nextmsg add"](FakeInteraction(source, 1), template=f"{{user}} is up, take {i}!" if i % 2 else f"{{user}} sings {{song}}, take {i}!", name=f"take-{i}")
+    fill_s = time.perf_counter() - began
+    expected = await describe_guild(queue_bot, source, room_ids)
+
+    # The target already has queues and templates, which the import must replace.
+    for user_id in range(1, 6):
+        await callbacks["queue add"](FakeInteraction(target, user_id, 999), song="Old", requeue=False)
+    await callbacks["next"](FakeInteraction(target, 1, 999))
+    await callbacks["nextmsg add"](FakeInteraction(target, 1), template="{user} is old news", name="old")
+
+    export_path = os.path.join(tmp_dir, "export.jsonl.gz")
+    began = time.perf_counter()
+    with open(export_path, "wb") as export_file:
+        counts = await queue_bot.export_guild(source, export_file)
+    export_s = time.perf_counter() - began
+    rows = sum(counts.values())
+    if(counts["queue"] != rooms * queue_size or counts["nextmsg"] != templates):
+        problems.append(f"exported {counts}, expected {rooms * queue_size} queued and {templates} templates")
+
+    began = time.perf_counter()
+    with open(export_path, "rb") as export_file:
+        await queue_bot.restore_guild(target, export_file)
+    import_s = time.perf_counter() - began
+    found = await describe_guild(queue_bot, target, room_ids + [999])
+    if(found != (expected[0] + [describe_room(GuildQueueState(target, [], None, queue_bot.config.queue_policy))], expected[1])):
+        problems.append("imported guild differs from the exported one")
+        for room_id, expected_room, found_room in zip(room_ids, expected[0], found[0]):
+            if(expected_room != found_room):
+                problems.append(f"room {room_id}: {str(found_room)[:200]} != {str(expected_room)[:200]}")
+
+    recovered = await recover_journal_copy(queue_bot, tmp_dir) if not sql else None
+    for room_id in room_ids + [999]:
+        problems.extend(await check_queue_consistency(queue_bot, target, recovered, room_id))
+    if(recovered != None):
+        found = [describe_room(recovered.states[(target, room_id)]) for room_id in room_ids]
+        if(found != expected[0]):
+            problems.append("import recovered from the journal differs from the exported guild")
+        await recovered.close()
+
+    # Importing a guild's own export over it changes nothing.
+    with open(export_path, "rb") as export_file:
+        await queue_bot.restore_guild(source, export_file)
+    if(await describe_guild(queue_bot, source, room_ids) != expected):
+        problems.append("importing a guild's own export changed it")
+
+    # A cut short export is turned away before anything is touched.
+    truncated_path = os.path.join(tmp_dir, "truncated.jsonl.gz")
+    with open(export_path, "rb") as export_file, open(truncated_path, "wb") as truncated_file:
+        truncated_file.write(export_file.read(os.path.getsize(export_path) * 2 // 3))
+    before = await describe_guild(queue_bot, target, room_ids)
+    try:
+        with open(truncated_path, "rb") as export_file:
+            await queue_bot.restore_guild(target, export_file)
+        problems.append("a cut short export was imported")
+    except ExportError as e:
+        truncated_error = str(e)
+    if(await describe_guild(queue_bot, target, room_ids) != before):
+        problems.append("a cut short export changed the guild")
+
+    # Again with allocations traced, which is too slow to time.
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    with open(os.path.join(tmp_dir, "traced.jsonl.gz"), "wb") as export_file:
+        await queue_bot.export_guild(source, export_file)
+    export_peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    with open(export_path, "rb") as export_file:
+        await queue_bot.restore_guild(traced, export_file)
+    import_peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    # The journal keeps every queue in memory anyway, and an import is a single record.
+    if(sql and max(export_peak, import_peak) > memory_budget_mb * 1024 * 1024):
+        problems.append(f"peak memory {export_peak / 1024 / 1024:.1f}MB exporting, {import_peak / 1024 / 1024:.1f}MB importing, over the {memory_budget_mb}MB budget")
+
+    # An online backup, with a guild writing away the whole time.
+    latencies = {"before": [], "during": []}
+    phase = "before"
+    stop = asyncio.Event()
+
+    async def writer() -> None:
+        user_id = 0
+        while(not stop.is_set()):
+            user_id += 1
+            began = time.perf_counter()
+            await callbacks["queue add"](FakeInteraction(writes_guild, user_id), song=None, requeue=False)
+            await callbacks["queue remove"](FakeInteraction(writes_guild, user_id))
+            latencies[phase].append(time.perf_counter() - began)
+            await asyncio.sleep(0)
+
+    db_path = queue_bot.db_router.shard_path(queue_bot.db_router.shard_key(source))
+    backup_path = os.path.join(tmp_dir, "backup.db")
+    writer_task = asyncio.create_task(writer())
+    await asyncio.sleep(0.5)
+    phase = "during"
+    began = time.perf_counter()
+    pages = await asyncio.get_running_loop().run_in_executor(None, backup_database, db_path, backup_path)
+    backup_s = time.perf_counter() - began
+    phase = "after"
+    latencies["after"] = []
+    stop.set()
+    await writer_task
+
+    backup = sqlite3.connect(backup_path)
+    try:
+        if(backup.execute("PRAGMA integrity_check").fetchone()[0] != "ok"):
+            problems.append("the backup fails its integrity check")
+        backed_up = backup.execute("SELECT COUNT(*) FROM nextmsg WHERE guild_id = ?", (source,)).fetchone()[0]
+        if(sql):
+            backed_up += backup.execute("SELECT COUNT(*) FROM queue WHERE guild_id = ?", (source,)).fetchone()[0]
+    finally:
+        backup.close()
+    if(backed_up != templates + (rooms * queue_size if sql else 0)):
+        problems.append(f"the backup has {backed_up} of the guild's rows")
+    if(not latencies["during"]):
+        problems.append("no writes got through while the backup ran")
+
+    await queue_bot.close()
+    print(f"{rooms} rooms of {queue_size} singers and {templates} templates filled in {fill_s:.1f}s.")
+    print(f"Exported {rows} rows in {export_s:.2f}s ({rows / export_s:.0f} rows/s) to {os.path.getsize(export_path) / 1024:.0f}KB, peak {export_peak / 1024 / 1024:.1f}MB.")
+    print(f"Imported them in {import_s:.2f}s ({rows / import_s:.0f} rows/s), peak {import_peak / 1024 / 1024:.1f}MB.")
+    print(f"Cut short export turned away: {truncated_error}")
+    print(f"Backed up {pages} pages in {backup_s:.2f}s. Writes before: {len(latencies['before'])}, {summarize_latencies(latencies['before'])}; "
+          f"during: {len(latencies['during'])}, {summarize_latencies(latencies['during'])}, max {max(latencies['during'], default=0) * 1000:.1f}ms.")
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+STARTUP_STAGES = ["imported", "constructed", "first_command", "warmed"]
+
+def run_startup(args: argparse.Namespace) -> int:
+    """Fills a database, then starts the bot in fresh processes and reports how long after the
+    process was spawned it got through each of STARTUP_STAGES."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        queue_bot = make_queue_bot(os.path.join(tmp_dir, "startup.db"), storage=storage_from_args(args, tmp_dir), sharding=sharding_from_args(args, tmp_dir))
+        async def fill() -> None:
+            await fill_queues(queue_bot, args.guilds, args.queue_size)
+            callbacks = get_callbacks(queue_bot)
+            for guild_id in range(1, args.guilds + 1):
+                await callbacks["nextmsg add"](FakeInteraction(guild_id, 1), template="{user} is up with {song}!", name=None)
+            await queue_bot.close()
+        run_on_bot_loop(queue_bot, fill())
+
+        timings = {stage: [] for stage in STARTUP_STAGES}
+        for run in range(args.runs):
+            spawned = time.time()
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ["--child", "--work-dir", tmp_dir],
+                capture_output=True, text=True
+            )
+            if(child.returncode != 0):
+                print(child.stderr, file=sys.stderr)
+                return 1
+            result = json.loads(child.stdout.splitlines()[-1])
+            for stage in STARTUP_STAGES:
+                timings[stage].append((result[stage] - spawned) * 1000)
+
+    print(f"Startup with {args.guilds} guilds of {args.queue_size} singers, ms after spawning, over {args.runs} runs:")
+    for stage in STARTUP_STAGES:
+        values = timings[stage]
+        print(f"{stage:>14}: median {statistics.median(values):.0f}, min {min(values):.0f}, max {max(values):.0f}")
+    return 0
+
+def run_startup_child(args: argparse.Namespace) -> int:
+    # Runs in the spawned process, what main.py does minus the Discord connection.
+    imported = time.time()
+    queue_bot = make_queue_bot(
+        os.path.join(args.work_dir, "startup.db"),
+        storage=storage_from_args(args, args.work_dir),
+        sharding=sharding_from_args(args, args.work_dir),
+        guild_ids=list(range(1, args.guilds + 1))
+    )
+    constructed = time.time()
+
+    async def serve() -> tuple:
+        # The last guild is warmed last, so this command doesn't find anything cached.
+        interaction = FakeInteraction(args.guilds, 1)
+        await get_callbacks(queue_bot)["queue list"](interaction, public=False, page=1)
+        first_command = time.time()
+        await queue_bot.startup_task
+        warmed = time.time()
+        await queue_bot.close()
+        return first_command, warmed
+    first_command, warmed = run_on_bot_loop(queue_bot, serve())
+
+    print(json.dumps({"imported": imported, "constructed": constructed, "first_command": first_command, "warmed": warmed}))
+    return 0
+
+def int_list(value: str) -> list:
+    return [int(i) for i in value.split(",")]
+
+def add_storage_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = KaraokeQueueBot.KaraokeQueueBotStorageConfig()
+    parser.add_argument("--journal-mode", default=defaults.journal_mode)
+    parser.add_argument("--synchronous", default=defaults.synchronous)
+    parser.add_argument("--pool-size", type=int, default=defaults.pool_size)
+    parser.add_argument("--group-commit-ms", type=int, default=defaults.group_commit_ms)
+    parser.add_argument("--queue-backend", default=defaults.queue_backend)
+    parser.add_argument("--journal-dir", help="Journal directory for the journal backend, defaults to a fresh temporary one.")
+    parser.add_argument("--snapshot-every", type=int, default=defaults.snapshot_every)
+    sharding_defaults = KaraokeQueueBot.KaraokeQueueBotShardingConfig()
+    parser.add_argument("--shard-mode", default=sharding_defaults.mode)
+    parser.add_argument("--shard-count", type=int, default=sharding_defaults.shard_count)
+    parser.add_argument("--max-open-shards", type=int, default=sharding_defaults.max_open_shards)
+
+def storage_from_args(args: argparse.Namespace, tmp_dir: str) -> KaraokeQueueBot.KaraokeQueueBotStorageConfig:
+    return KaraokeQueueBot.KaraokeQueueBotStorageConfig(
+        journal_mode=args.journal_mode,
+        synchronous=args.synchronous,
+        pool_size=args.pool_size,
+        group_commit_ms=args.group_commit_ms,
+        queue_backend=args.queue_backend,
+        journal_dir=args.journal_dir if args.journal_dir else os.path.join(tmp_dir, "journal"),
+        snapshot_every=args.snapshot_every
+    )
+
+def sharding_from_args(args: argparse.Namespace, tmp_dir: str) -> KaraokeQueueBot.KaraokeQueueBotShardingConfig:
+    return KaraokeQueueBot.KaraokeQueueBotShardingConfig(
+        mode=args.shard_mode,
+        shard_dir=os.path.join(tmp_dir, "shards"),
+        shard_count=args.shard_count,
+        max_open_shards=args.max_open_shards
+    )
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline checks and benchmarks for the karaoke queue bot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plans_parser = subparsers.add_parser("plans", help="Fail if any command's queries fall back to a full table scan.")
+    plans_parser.add_argument("--db", help="Database file to use, defaults to a fresh temporary file.")
+
+    cache_parser = subparsers.add_parser("cache", help="Count the statements issued by read-only commands.")
+    cache_parser.add_argument("--guilds", type=int, default=10)
+    cache_parser.add_argument("--queue-size", type=int, default=50)
+    cache_parser.add_argument("--reads", type=int, default=1000)
+    cache_parser.add_argument("--cache-size-mb", type=int, default=16)
+
+    next_parser = subparsers.add_parser("next", help="Fail if /next issues more statements than it should.")
+    next_parser.add_argument("--guilds", type=int, default=5)
+    next_parser.add_argument("--queue-size", type=int, default=30)
+
+    stress_parser = subparsers.add_parser("stress", help="Check queue consistency under concurrent commands.")
+    stress_parser.add_argument("--db", help="Database file to use, defaults to a fresh temporary file.")
+    stress_parser.add_argument("--guilds", type=int, default=5)
+    stress_parser.add_argument("--users", type=int, default=20)
+    stress_parser.add_argument("--rounds", type=int, default=3)
+    stress_parser.add_argument("--seed", type=int, default=0)
+    stress_parser.add_argument("--queue-policy", choices=POLICIES, default=POLICY_FIFO)
+    add_storage_arguments(stress_parser)
+
+    writes_parser = subparsers.add_parser("writes", help="Measure write throughput with a storage profile.")
+    writes_parser.add_argument("--db", help="Database file to use, defaults to a fresh temporary file.")
+    writes_parser.add_argument("--guilds", type=int, default=20)
+    writes_parser.add_argument("--ops", type=int, default=100, help="Commands per guild.")
+    writes_parser.add_argument("--noisy-size", type=int, default=0, help="Queue size of a guild that keeps shuffling during the run, 0 for none.")
+    add_storage_arguments(writes_parser)
+
+    board_parser = subparsers.add_parser("board", help="Count the board edits caused by bursts of queue changes.")
+    board_parser.add_argument("--guilds", type=int, default=10)
+    board_parser.add_argument("--bursts", type=int, default=5)
+    board_parser.add_argument("--burst-size", type=int, default=20, help="Queue changes per guild and burst.")
+    board_parser.add_argument("--debounce-ms", type=int, default=2000)
+
+    dispatch_parser = subparsers.add_parser("dispatch", help="Compare sending a burst of messages through the dispatcher and directly, against a fake Discord API.")
+    dispatch_parser.add_argument("--channels", type=int, default=10)
+    dispatch_parser.add_argument("--confirms", type=int, default=20, help="Ephemeral replies per channel.")
+    dispatch_parser.add_argument("--edits", type=int, default=8, help="Board edits per channel.")
+    dispatch_parser.add_argument("--global-limit", type=int, default=50, help="Requests per second.")
+    dispatch_parser.add_argument("--channel-limit", type=int, default=5)
+    dispatch_parser.add_argument("--channel-period-ms", type=int, default=5000)
+    dispatch_parser.add_argument("--max-in-flight", type=int, default=4)
+    dispatch_parser.add_argument("--latency-ms", type=int, default=50, help="Round trip time of the fake API.")
+    dispatch_parser.add_argument("--edge-429s", action="store_true", help="Send 429s that nextcord doesn't retry by itself.")
+
+    startup_parser = subparsers.add_parser("startup", help="Time how long a fresh process takes to serve its first command.")
+    startup_parser.add_argument("--guilds", type=int, default=20)
+    startup_parser.add_argument("--queue-size", type=int, default=100)
+    startup_parser.add_argument("--runs", type=int, default=5)
+    startup_parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    startup_parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    add_storage_arguments(startup_parser)
+
+    catalog_parser = subparsers.add_parser("catalog", help="Import a made up song catalog and time autocomplete searches against it.")
+    catalog_parser.add_argument("--tracks", type=int, default=100000)
+    catalog_parser.add_argument("--searches", type=int, default=5000)
+    catalog_parser.add_argument("--budget-ms", type=float, default=10, help="Fail if the 99th percentile search takes longer.")
+    catalog_parser.add_argument("--seed", type=int, default=0)
+
+    history_parser = subparsers.add_parser("history", help="Check and time /stats and history compaction against millions of performances.")
+    history_parser.add_argument("--rows", type=int, default=2000000)
+    history_parser.add_argument("--guilds", type=int, default=100)
+    history_parser.add_argument("--singers", type=int, default=200, help="Singers per guild.")
+    history_parser.add_argument("--songs", type=int, default=2000, help="Songs per guild.")
+    history_parser.add_argument("--stats", type=int, default=1000, help="/stats calls timed before and after compacting.")
+    history_parser.add_argument("--retention-days", type=int, default=30)
+    history_parser.add_argument("--seed", type=int, default=0)
+
+    policies_parser = subparsers.add_parser("policies", help="Check how each queue policy shares out turns and time /next under it.")
+    policies_parser.add_argument("--singers", type=int, default=40)
+    policies_parser.add_argument("--queue-size", type=int, default=2000)
+    policies_parser.add_argument("--nexts", type=int, default=500)
+    add_storage_arguments(policies_parser)
+
+    rooms_parser = subparsers.add_parser("rooms", help="Check that many rooms in one guild don't slow each other down.")
+    rooms_parser.add_argument("--rooms", type=int, default=50)
+    rooms_parser.add_argument("--singers", type=int, default=10, help="Singers per room.")
+    rooms_parser.add_argument("--rounds", type=int, default=10, help="Turns taken in each room.")
+    rooms_parser.add_argument("--interval-ms", type=int, default=1000, help="Pause between a room's commands.")
+    rooms_parser.add_argument("--max-slowdown", type=float, default=5, help="Fail if a command's 95th percentile with every room busy is this many times that with one room. The busy guild takes rooms / 10 times the commands, which alone can triple it on a single core, rooms waiting on each other's turns would be tens of times slower.")
+    rooms_parser.add_argument("--seed", type=int, default=0)
+    add_storage_arguments(rooms_parser)
+
+    timers_parser = subparsers.add_parser("timers", help="Check and time auto-advance, requeue cooldowns and idle expiry on a fake clock.")
+    timers_parser.add_argument("--timers", type=int, default=100000, help="Timers for the scheduler on its own.")
+    timers_parser.add_argument("--guilds", type=int, default=2000, help="Guilds walked through every timer.")
+    timers_parser.add_argument("--seed", type=int, default=0)
+    add_storage_arguments(timers_parser)
+
+    export_parser = subparsers.add_parser("export", help="Check and time exporting, importing and backing up a big guild.")
+    export_parser.add_argument("--rooms", type=int, default=4)
+    export_parser.add_argument("--queue-size", type=int, default=25000, help="Singers per room.")
+    export_parser.add_argument("--templates", type=int, default=200)
+    export_parser.add_argument("--memory-budget-mb", type=float, default=16, help="Fail if exporting or importing with the sqlite backend allocates more at once.")
+    export_parser.add_argument("--seed", type=int, default=0)
+    add_storage_arguments(export_parser)
+
+    suite_parser = subparsers.add_parser("suite", help="Time every command across queue sizes and guild counts, as JSON.")
+    suite_parser.add_argument("--queue-sizes", type=int_list, default=[10, 100, 1000, 10000])
+    suite_parser.add_argument("--guild-counts", type=int_list, default=[1, 10, 100, 1000])
+    suite_parser.add_argument("--databases", type=lambda value: value.split(","), default=["memory", "disk"])
+    suite_parser.add_argument("--samples", type=int, default=200, help="Calls per command and case.")
+    suite_parser.add_argument("--concurrency", type=int, default=1, help="Calls in flight at once.")
+    suite_parser.add_argument("--max-entries", type=int, default=100000, help="Skip cases with more queued singers than this in total.")
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("--out", help="Write the JSON report here instead of stdout.")
+
+    args = parser.parse_args()
+
+    if(args.command == "plans"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = args.db if args.db else os.path.join(tmp_dir, "plans.db")
+            # With a retention period, so compacting the history is checked too.
+            queue_bot = make_queue_bot(db_path, history_retention_days=30)
+            return run_on_bot_loop(queue_bot, check_query_plans(queue_bot))
+    elif(args.command == "cache"):
+        queue_bot = make_queue_bot(None, args.cache_size_mb)
+        return run_on_bot_loop(queue_bot, check_cache(queue_bot, args.guilds, args.queue_size, args.reads))
+    elif(args.command == "next"):
+        queue_bot = make_queue_bot(None)
+        return run_on_bot_loop(queue_bot, check_next(queue_bot, args.guilds, args.queue_size))
+    elif(args.command == "stress"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = args.db if args.db else os.path.join(tmp_dir, "stress.db")
+            queue_bot = make_queue_bot(db_path, storage=storage_from_args(args, tmp_dir), sharding=sharding_from_args(args, tmp_dir), queue_policy=args.queue_policy)
+            return run_on_bot_loop(queue_bot, run_stress(queue_bot, args.guilds, args.users, args.rounds, args.seed, tmp_dir))
+    elif(args.command == "writes"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = args.db if args.db else os.path.join(tmp_dir, "writes.db")
+            queue_bot = make_queue_bot(db_path, storage=storage_from_args(args, tmp_dir), sharding=sharding_from_args(args, tmp_dir))
+            return run_on_bot_loop(queue_bot, run_writes(queue_bot, args.guilds, args.ops, args.noisy_size))
+    elif(args.command == "board"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Boards are updated alongside the writes, which the in-memory database can't do.
+            queue_bot = make_queue_bot(os.path.join(tmp_dir, "board.db"), board_debounce_ms=args.debounce_ms)
+            return run_on_bot_loop(queue_bot, check_board(queue_bot, args.guilds, args.bursts, args.burst_size))
+    elif(args.command == "dispatch"):
+        return run_dispatch(args)
+    elif(args.command == "startup"):
+        return run_startup_child(args) if args.child else run_startup(args)
+    elif(args.command == "catalog"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tracks_path = os.path.join(tmp_dir, "tracks.csv")
+            catalog_path = os.path.join(tmp_dir, "catalog.db")
+            titles = write_fake_tracks(tracks_path, args.tracks, args.seed)
+            queue_bot = make_queue_bot(None, song_catalog_path=catalog_path)
+            start = time.perf_counter()
+            imported, duplicates = run_on_bot_loop(queue_bot, build_catalog(catalog_path, read_tracks(tracks_path)))
+            print(f"Imported {imported} songs ({duplicates} duplicates) in {time.perf_counter() - start:.1f}s, {os.path.getsize(catalog_path) / 1024 / 1024:.1f}MB.")
+            return run_on_bot_loop(queue_bot, check_catalog(queue_bot, titles, args.searches, args.budget_ms, args.seed))
+    elif(args.command == "history"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            queue_bot = make_queue_bot(os.path.join(tmp_dir, "history.db"))
+            return run_on_bot_loop(queue_bot, check_history(queue_bot, args.rows, args.guilds, args.singers, args.songs, args.stats, args.retention_days, args.seed))
+    elif(args.command == "policies"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            queue_bot = make_queue_bot(os.path.join(tmp_dir, "policies.db"), storage=storage_from_args(args, tmp_dir), sharding=sharding_from_args(args, tmp_dir))
+            return run_on_bot_loop(queue_bot, check_policies(queue_bot, args.singers, args.queue_size, args.nexts))
+    elif(args.command == "rooms"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            queue_bot = make_queue_bot(os.path.join(tmp_dir, "rooms.db"), storage=storage_from_args(args, tmp_dir), sharding=sharding_from_args(args, tmp_dir))
+            return run_on_bot_loop(queue_bot, check_rooms(queue_bot, args.rooms, args.singers, args.rounds, args.interval_ms, args.max_slowdown, args.seed, tmp_dir))
+    elif(args.command == "timers"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            clock = FakeClock()
+            queue_bot = make_queue_bot(
+                os.path.join(tmp_dir, "timers.db"), storage=storage_from_args(args, tmp_dir), sharding=sharding_from_args(args, tmp_dir),
+                auto_advance_minutes=5, idle_queue_expiry_hours=2, requeue_cooldown_minutes=10, clock=clock
+            )
+            failures = run_on_bot_loop(queue_bot, check_timer_scheduler(args.timers, args.seed))
+            failures += run_on_bot_loop(queue_bot, check_timers(queue_bot, clock, args.guilds))
+            return 1 if failures else 0
+    elif(args.command == "export"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            queue_bot = make_queue_bot(os.path.join(tmp_dir, "export.db"), storage=storage_from_args(args, tmp_dir), sharding=sharding_from_args(args, tmp_dir), requeue_cooldown_minutes=10)
+            return run_on_bot_loop(queue_bot, check_export(queue_bot, args.rooms, args.queue_size, args.templates, args.memory_budget_mb, args.seed, tmp_dir))
+    elif(args.command == "suite"):
+        return run_suite(args)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
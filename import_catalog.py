@@ -0,0 +1,71 @@
+"""Builds the song catalog that autocompletes the song options of /queue commands.
+
+Usage:
+    python import_catalog.py TRACKS [TRACKS ...] [--config PATH] [--catalog PATH]
+
+TRACKS are CSV files with a header row, JSON files holding a list of objects or files of JSON
+objects, one per line (.jsonl). Each track needs a title (or song) and may have an artist.
+Spellings that only differ in case, accents or punctuation are imported once. The catalog is
+replaced as a whole, so pass every file each time. A running bot keeps searching the catalog
+it opened until it's restarted.
+"""
+
+import argparse
+import asyncio
+import csv
+import itertools
+import logging
+import os
+import os.path
+import sqlite3
+import sys
+import time
+import yaml
+
+import sqlalchemy as sa
+
+from KaraokeQueueBotConfig import KaraokeQueueBotConfig, KaraokeQueueBotConfigError
+from KaraokeQueueBotCatalog import MIN_SQLITE_VERSION, build_catalog, read_tracks
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the song catalog from CSV or JSON track lists.")
+    parser.add_argument("tracks", nargs="+", help="CSV, JSON or JSON lines files of tracks.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.yaml"))
+    parser.add_argument("--catalog", help="Catalog file to write, defaults to the config's song_catalog_path.")
+    args = parser.parse_args()
+
+    catalog_path = args.catalog
+    if(not catalog_path and os.path.exists(args.config)):
+        try:
+            with open(args.config, "r", encoding="UTF-8") as config_file:
+                catalog_path = KaraokeQueueBotConfig.from_yaml_data(yaml.load(config_file, Loader=yaml.Loader)).song_catalog_path
+        except (yaml.YAMLError, KaraokeQueueBotConfigError) as e:
+            logging.error(f"Invalid config file {args.config}: {e}")
+            return 1
+    if(not catalog_path):
+        logging.error("No catalog path given, pass --catalog or set song_catalog_path in the config.")
+        return 1
+    for path in args.tracks:
+        if(not os.path.exists(path)):
+            logging.error(f"Track file {path} not found.")
+            return 1
+
+    start = time.perf_counter()
+    tracks = itertools.chain.from_iterable(read_tracks(path) for path in args.tracks)
+    try:
+        imported, duplicates = asyncio.run(build_catalog(catalog_path, tracks))
+    except (OSError, ValueError, csv.Error) as e:
+        logging.error(f"Import failed, {catalog_path} was left as it was: {e}")
+        return 1
+    except sa.exc.DBAPIError as e:
+        logging.error(f"Import failed, {catalog_path} was left as it was: {e.orig}")
+        if(sqlite3.sqlite_version_info < MIN_SQLITE_VERSION):
+            logging.error(f"The catalog needs SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))} or newer for its search index, "
+                          f"this Python has SQLite {sqlite3.sqlite_version}.")
+        return 1
+    print(f"Imported {imported} songs into {catalog_path} in {time.perf_counter() - start:.1f}s, skipped {duplicates} duplicates.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
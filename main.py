@@ -1,27 +1,80 @@
+import argparse
 import logging
 import os
 import os.path
 import sys
 import yaml
 
-import KaraokeQueueBot
-
-from nextcord.ext import commands
+# Only the config module is imported up front, nextcord and SQLAlchemy are slow to import and
+# --check-config doesn't need them.
+import KaraokeQueueBotConfig
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     script_path = os.path.realpath(__file__)
-    config_path = os.path.join(os.path.dirname(script_path), "config.yaml")
+
+    parser = argparse.ArgumentParser(description="Runs the karaoke queue bot.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(script_path), "config.yaml"))
+    parser.add_argument("--check-config", action="store_true", help="Check the config file and exit without starting the bot.")
+    args = parser.parse_args()
+    config_path = args.config
     
     if(not os.path.exists(config_path)):
-        logging.error(f"Config file not found! Please put it next to the bot python file (at {script_path}). You can find a sample config file in the repo.")
+        logging.error(f"Config file {config_path} not found! Please put it next to the bot python file (at {script_path}). You can find a sample config file in the repo.")
         sys.exit(-1)
     
     config = None
-    with open(config_path, "r+", encoding="UTF-8") as config_file:
-        config = yaml.load(config_file, Loader=yaml.Loader)
-    
-    bot_config = KaraokeQueueBot.KaraokeQueueBotConfig.from_yaml_data(config)
-    bot = commands.Bot()
+    try:
+        with open(config_path, "r", encoding="UTF-8") as config_file:
+            config = yaml.load(config_file, Loader=yaml.Loader)
+        bot_config = KaraokeQueueBotConfig.KaraokeQueueBotConfig.from_yaml_data(config)
+        if(not config["config"].get("discord_token")):
+            raise KaraokeQueueBotConfig.KaraokeQueueBotConfigError("Missing setting discord_token.")
+    except (yaml.YAMLError, KaraokeQueueBotConfig.KaraokeQueueBotConfigError) as e:
+        logging.error(f"Invalid config file {config_path}: {e}")
+        sys.exit(-1)
+
+    if(args.check_config):
+        print(f"{config_path} is valid: {len(bot_config.guild_ids)} guilds, database {bot_config.db_path}, "
+              f"queue backend {bot_config.storage.queue_backend}, sharding {bot_config.sharding.mode}.")
+        sys.exit(0)
+
+    import asyncio
+    import signal
+    import KaraokeQueueBot
+    from nextcord.ext import commands
+
+    class KaraokeBot(commands.Bot):
+        async def close(self) -> None:
+            # The queue bot goes first, while its queued messages can still be sent.
+            await queue_bot.close()
+            await super().close()
+
+    async def run_bot(token: str) -> None:
+        # Like bot.run(), except a signal closes the bot before the loop's tasks are cancelled,
+        # so pending history writes and messages get to finish.
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, lambda: loop.create_task(bot.close()))
+            except NotImplementedError:
+                # Windows has no signal handlers, Ctrl+C raises KeyboardInterrupt below instead.
+                pass
+        try:
+            await bot.start(token)
+        finally:
+            await bot.close()
+
+    # The basic setup above only covers errors while loading the config.
+    logging.basicConfig(
+        filename=bot_config.log_path if bot_config.log_path else None,
+        level=bot_config.log_level,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        force=True
+    )
+    bot = KaraokeBot()
     queue_bot = KaraokeQueueBot.KaraokeQueueBot(bot, bot_config)
-    bot.run(config["config"]["discord_token"])
\ No newline at end of file
+    try:
+        bot.loop.run_until_complete(run_bot(config["config"]["discord_token"]))
+    except KeyboardInterrupt:
+        bot.loop.run_until_complete(bot.close())
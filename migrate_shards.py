@@ -0,0 +1,122 @@
+"""Copies a single-file database into per-guild or fixed shard files.
+
+Usage:
+    python migrate_shards.py [--config PATH] [--source PATH] [--mode guild|fixed] [--shard-dir PATH] [--shard-count N]
+
+Anything not given on the command line is taken from the config file: the source is
+sqlite_database_path and the layout is the sharding section. The source database is brought up
+to date like the bot would at startup but otherwise left alone, so point the config at the
+shards only once the copy checks out. The shard directory must not hold any shards yet.
+"""
+
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import os.path
+import sys
+import yaml
+
+import sqlalchemy as sa
+
+import KaraokeQueueBot
+from KaraokeQueueBotObjects import (
+    QueueEntry, RoomEntry, NextMsgEntry, BoardEntry, GuildSettingsEntry, SingerEntry, PerformanceEntry, SingerStatsEntry,
+    SongStatsEntry, GuildStatsEntry
+)
+from KaraokeQueueBotMigrations import run_migrations
+from KaraokeQueueBotShards import ShardRouter
+from KaraokeQueueBotStorage import create_db_engine
+
+TABLES = [
+    QueueEntry.__table__, RoomEntry.__table__, NextMsgEntry.__table__, BoardEntry.__table__, GuildSettingsEntry.__table__,
+    SingerEntry.__table__, PerformanceEntry.__table__, SingerStatsEntry.__table__, SongStatsEntry.__table__, GuildStatsEntry.__table__
+]
+
+async def count_rows(conn, table: sa.Table, guild_id: int) -> int:
+    stmt = sa.select(sa.func.count()).select_from(table).where(table.c.guild_id == guild_id)
+    return (await conn.execute(stmt)).scalar_one()
+
+async def migrate(source_path: str, storage: KaraokeQueueBot.KaraokeQueueBotStorageConfig, sharding: KaraokeQueueBot.KaraokeQueueBotShardingConfig) -> int:
+    source = create_db_engine(source_path, storage)
+    async with source.begin() as conn:
+        await conn.run_sync(run_migrations)
+
+    router = ShardRouter(None, storage, sharding.mode, sharding.shard_dir, sharding.shard_count, sharding.max_open_shards)
+    await router.prepare()
+
+    async with source.connect() as conn:
+        guild_ids = set()
+        for table in TABLES:
+            guild_ids.update((await conn.execute(sa.select(table.c.guild_id).distinct())).scalars().all())
+
+        problems = 0
+        for guild_id in sorted(guild_ids):
+            rows = {}
+            for table in TABLES:
+                result = await conn.execute(sa.select(table).where(table.c.guild_id == guild_id))
+                rows[table.name] = [dict(row._mapping) for row in result]
+
+            # Ids are kept as they are so the guild's current singer still points at them.
+            async with router.use(guild_id) as shard, shard.engine.begin() as shard_conn:
+                for table in TABLES:
+                    if(rows[table.name]):
+                        await shard_conn.execute(sa.insert(table), rows[table.name])
+                counts = {table.name: await count_rows(shard_conn, table, guild_id) for table in TABLES}
+
+            for table in TABLES:
+                if(counts[table.name] != len(rows[table.name])):
+                    problems += 1
+                    logging.error(f"Guild {guild_id}: copied {len(rows[table.name])} {table.name} rows but the shard has {counts[table.name]}.")
+            logging.info(f"Guild {guild_id}: {', '.join(f'{len(rows[name])} {name}' for name in rows)} -> {router.shard_key(guild_id)}")
+
+    await router.close()
+    await source.dispose()
+    print(f"Copied {len(guild_ids)} guilds into {router.opens} shards in {sharding.shard_dir}, {problems} problems.")
+    return 1 if problems else 0
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Copy a single-file database into shards.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.yaml"))
+    parser.add_argument("--source", help="Database to copy, defaults to sqlite_database_path.")
+    parser.add_argument("--mode", choices=["guild", "fixed"], help="Defaults to the config's sharding mode.")
+    parser.add_argument("--shard-dir", help="Defaults to the config's shard_dir.")
+    parser.add_argument("--shard-count", type=int, help="Defaults to the config's shard_count.")
+    args = parser.parse_args()
+
+    storage = KaraokeQueueBot.KaraokeQueueBotStorageConfig()
+    sharding = KaraokeQueueBot.KaraokeQueueBotShardingConfig()
+    source_path = None
+    if(os.path.exists(args.config)):
+        with open(args.config, "r", encoding="UTF-8") as config_file:
+            config = KaraokeQueueBot.KaraokeQueueBotConfig.from_yaml_data(yaml.load(config_file, Loader=yaml.Loader))
+        storage, sharding, source_path = config.storage, config.sharding, config.db_path
+
+    try:
+        sharding = KaraokeQueueBot.KaraokeQueueBotShardingConfig(
+            args.mode if args.mode else sharding.mode,
+            args.shard_dir if args.shard_dir else sharding.shard_dir,
+            args.shard_count if args.shard_count else sharding.shard_count,
+            sharding.max_open_shards
+        )
+    except KaraokeQueueBot.KaraokeQueueBotConfigError as e:
+        logging.error(e)
+        return 1
+
+    source_path = args.source if args.source else source_path
+    if(sharding.mode == "off"):
+        logging.error("No shard layout given, pass --mode or set one in the config's sharding section.")
+        return 1
+    if(not source_path or not os.path.exists(source_path)):
+        logging.error(f"Source database {source_path!r} not found.")
+        return 1
+    if(glob.glob(os.path.join(sharding.shard_dir, "*.db"))):
+        logging.error(f"{sharding.shard_dir} already holds shards, refusing to merge into them.")
+        return 1
+
+    return asyncio.run(migrate(source_path, storage, sharding))
+
+if __name__ == "__main__":
+    sys.exit(main())
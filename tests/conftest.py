@@ -0,0 +1,16 @@
+import asyncio
+import os.path
+import sys
+
+import pytest
+
+# The bot's modules sit at the top of the repo, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+@pytest.fixture
+def run():
+    """Runs a coroutine on a loop of its own. Not asyncio.run(), which leaves no current loop
+    behind for the bots of later tests."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
@@ -0,0 +1,45 @@
+import asyncio
+
+import benchmark
+from KaraokeQueueBotBoard import Board, BoardUpdater
+
+def test_one_edit_per_guild_and_burst():
+    queue_bot = benchmark.make_queue_bot(None, board_debounce_ms=200)
+    changes, edits, stale = benchmark.run_on_bot_loop(queue_bot, benchmark.count_board_edits(queue_bot, 3, 2, 20))
+    assert stale == []
+    assert edits == {guild_id: 2 for guild_id in range(1, 4)}
+
+async def edit_times_during_changes(debounce: float, max_delay: float, duration: float) -> list:
+    # Changes the room every half debounce for duration seconds, returns when the board was
+    # edited, in seconds since the first change.
+    loop = asyncio.get_running_loop()
+    board = Board(1, 0, 1, 1, 5)
+    version = 0
+    edited_at = []
+
+    async def load(key):
+        return board
+    async def render(board):
+        return str(version)
+    async def edit(board, content):
+        edited_at.append(loop.time() - start)
+
+    updater = BoardUpdater(load, render, edit, debounce, max_delay=max_delay)
+    start = loop.time()
+    while(loop.time() - start < duration):
+        version += 1
+        await updater.changed((1, 0))
+        await asyncio.sleep(debounce / 2)
+    await asyncio.sleep(debounce * 1.5)
+    await updater.close()
+    return edited_at
+
+def test_edits_once_changes_stop(run):
+    edited_at = run(edit_times_during_changes(0.1, 10, 0.5))
+    assert len(edited_at) == 1
+    assert edited_at[0] >= 0.5
+
+def test_edits_a_board_that_never_goes_quiet_every_max_delay(run):
+    edited_at = run(edit_times_during_changes(0.1, 0.3, 1.0))
+    assert edited_at[0] < 0.5
+    assert len(edited_at) >= 3
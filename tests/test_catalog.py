@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+from KaraokeQueueBotCatalog import build_catalog
+
+def tracks_then_error():
+    yield ("Song A", "Artist")
+    raise ValueError("Broken track file")
+
+def test_failed_import_leaves_the_old_catalog(run, tmp_path):
+    path = str(tmp_path / "catalog.db")
+    assert run(build_catalog(path, [("Song A", "Artist"), ("song a", "ARTIST")])) == (1, 1)
+    with open(path, "rb") as catalog_file:
+        before = catalog_file.read()
+
+    with pytest.raises(ValueError):
+        run(build_catalog(path, tracks_then_error()))
+    with open(path, "rb") as catalog_file:
+        assert catalog_file.read() == before
+    assert os.listdir(tmp_path) == ["catalog.db"]
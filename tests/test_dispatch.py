@@ -0,0 +1,29 @@
+import asyncio
+
+from KaraokeQueueBotDispatch import LANE_CONFIRM, OutboundDispatcher
+
+async def count_sent_at_once(channel_ids: list) -> int:
+    # Sends one request per entry in channel_ids, each blocking until all of them were
+    # checked, and returns how many the dispatcher had handed over by then.
+    dispatcher = OutboundDispatcher(max_in_flight=1)
+    started = 0
+    release = asyncio.Event()
+
+    async def send() -> None:
+        nonlocal started
+        started += 1
+        await release.wait()
+
+    sends = [asyncio.ensure_future(dispatcher.send(LANE_CONFIRM, send, channel_id)) for channel_id in channel_ids]
+    await asyncio.sleep(0.05)
+    sent_at_once = started
+    release.set()
+    await asyncio.gather(*sends)
+    await dispatcher.close()
+    return sent_at_once
+
+def test_interaction_responses_dont_wait_on_each_other(run):
+    assert run(count_sent_at_once([None] * 10)) == 10
+
+def test_channel_messages_are_sent_max_in_flight_at_a_time(run):
+    assert run(count_sent_at_once([1] * 3 + [2] * 3)) == 2
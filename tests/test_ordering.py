@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import benchmark
+import KaraokeQueueBot
+from KaraokeQueueBotObjects import MAIN_ROOM_ID
+from KaraokeQueueBotPolicies import POLICY_FIFO, POLICY_ROTATION
+
+BACKENDS = [("sqlite", POLICY_FIFO), ("journal", POLICY_FIFO), ("sqlite", POLICY_ROTATION)]
+
+def make_queue_bot(tmp_path, backend: str, policy: str) -> KaraokeQueueBot.KaraokeQueueBot:
+    storage = KaraokeQueueBot.KaraokeQueueBotStorageConfig(queue_backend=backend, journal_dir=str(tmp_path / "journal"))
+    return benchmark.make_queue_bot(str(tmp_path / "queue.db"), storage=storage, queue_policy=policy)
+
+async def queued_users(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guild_id: int) -> list:
+    state = await queue_bot.get_queue_state(guild_id, MAIN_ROOM_ID)
+    return [elem.user_id for elem in sorted(state.get_waiting(), key=lambda elem: elem.sort_key)]
+
+async def interleaved_writes(queue_bot: KaraokeQueueBot.KaraokeQueueBot, guilds: int, users: int) -> dict:
+    # Every guild gets its signups and the removal of every third singer right after they
+    # signed up all at once. Applied in the order they were sent, each guild ends up with
+    # everyone else, in signup order.
+    callbacks = benchmark.get_callbacks(queue_bot)
+    await queue_bot.startup_task
+    calls = []
+    for user_id in range(1, users + 1):
+        for guild_id in range(1, guilds + 1):
+            interaction = benchmark.FakeInteraction(guild_id, user_id)
+            calls.append(callbacks["queue add"](interaction, song=f"Song {user_id}", requeue=False))
+            if(user_id % 3 == 0):
+                calls.append(callbacks["queue remove"](interaction))
+    await asyncio.gather(*calls)
+
+    queues = {guild_id: await queued_users(queue_bot, guild_id) for guild_id in range(1, guilds + 1)}
+    await queue_bot.close()
+    return queues
+
+@pytest.mark.parametrize("backend,policy", BACKENDS)
+def test_writes_to_a_guild_keep_their_order(tmp_path, backend, policy):
+    queue_bot = make_queue_bot(tmp_path, backend, policy)
+    queues = benchmark.run_on_bot_loop(queue_bot, interleaved_writes(queue_bot, 4, 30))
+    expected = [user_id for user_id in range(1, 31) if user_id % 3]
+    assert queues == {guild_id: expected for guild_id in range(1, 5)}
+
+@pytest.mark.parametrize("backend,policy", BACKENDS)
+def test_concurrent_commands_keep_queues_consistent(tmp_path, backend, policy):
+    queue_bot = make_queue_bot(tmp_path, backend, policy)
+    errors = benchmark.run_on_bot_loop(queue_bot, benchmark.stress_errors(queue_bot, 5, 20, 3, 0, str(tmp_path)))
+    assert errors == []
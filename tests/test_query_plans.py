@@ -0,0 +1,20 @@
+import pytest
+
+import benchmark
+
+@pytest.fixture(scope="module")
+def plans(tmp_path_factory) -> dict:
+    # With a retention period, so compacting the history is checked too.
+    queue_bot = benchmark.make_queue_bot(str(tmp_path_factory.mktemp("plans") / "plans.db"), history_retention_days=30)
+    return benchmark.run_on_bot_loop(queue_bot, benchmark.collect_query_plans(queue_bot))
+
+def test_no_full_scans(plans):
+    scans = {" ".join(statement.split()): benchmark.full_scans(plan) for statement, plan in plans.items() if benchmark.full_scans(plan)}
+    assert scans == {}
+
+@pytest.mark.parametrize("table", ["queue", "nextmsg"])
+def test_table_is_searched_by_index(plans, table):
+    steps = [step for plan in plans.values() for step in plan]
+    assert [step for step in steps if step.startswith(f"SCAN {table}")] == []
+    # The commands did look rows up in it, so the check above isn't vacuous.
+    assert any(step.startswith(f"SEARCH {table} ") for step in steps)
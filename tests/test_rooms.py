@@ -0,0 +1,24 @@
+import nextcord
+
+import benchmark
+from KaraokeQueueBot import get_room_id
+from KaraokeQueueBotObjects import MAIN_ROOM_ID
+
+class Channel(benchmark.FakeChannel):
+    def __init__(self, channel_id: int, channel_type: nextcord.ChannelType) -> None:
+        super().__init__(channel_id)
+        self.type = channel_type
+
+def test_commands_default_to_the_invokers_voice_channel():
+    assert get_room_id(benchmark.FakeInteraction(1, 1, voice_channel_id=5), None) == 5
+    assert get_room_id(benchmark.FakeInteraction(1, 1), None) == MAIN_ROOM_ID
+
+def test_picking_a_voice_channel_uses_its_room():
+    interaction = benchmark.FakeInteraction(1, 1, voice_channel_id=5)
+    assert get_room_id(interaction, Channel(6, nextcord.ChannelType.voice)) == 6
+    assert get_room_id(interaction, Channel(7, nextcord.ChannelType.stage_voice)) == 7
+
+def test_picking_a_text_channel_reaches_the_main_queue_from_voice():
+    # Queues from before there were rooms were all migrated to the main queue.
+    interaction = benchmark.FakeInteraction(1, 1, voice_channel_id=5)
+    assert get_room_id(interaction, Channel(8, nextcord.ChannelType.text)) == MAIN_ROOM_ID
@@ -0,0 +1,26 @@
+import pytest
+
+import benchmark
+from KaraokeQueueBotPolicies import POLICIES
+
+# The budgets are spelled out here rather than taken from benchmark.py, so raising one shows up
+# as a change to this test. See benchmark.py for what each statement is.
+NEXT_STATEMENT_BUDGET = 7
+HISTORY_STATEMENT_BUDGET = 5
+
+@pytest.mark.parametrize("policy", POLICIES)
+def test_next_stays_within_its_statement_budget(policy):
+    queue_bot = benchmark.make_queue_bot(None, queue_policy=policy)
+    counts, history_counts, sent = benchmark.run_on_bot_loop(queue_bot, benchmark.count_next_statements(queue_bot, 3, 12))
+    assert max(counts) <= NEXT_STATEMENT_BUDGET
+    assert max(history_counts) <= HISTORY_STATEMENT_BUDGET
+    # Each counted /next finished someone's turn, so each one was recorded.
+    assert min(history_counts) > 0
+
+def test_next_uses_changed_templates_right_away():
+    queue_bot = benchmark.make_queue_bot(None)
+    counts, history_counts, sent = benchmark.run_on_bot_loop(queue_bot, benchmark.count_next_statements(queue_bot, 1, 3))
+    assert sent == ["Song by <@1>"]
+
+def test_benchmark_budgets_match():
+    assert (benchmark.NEXT_STATEMENT_BUDGET, benchmark.HISTORY_STATEMENT_BUDGET) == (NEXT_STATEMENT_BUDGET, HISTORY_STATEMENT_BUDGET)